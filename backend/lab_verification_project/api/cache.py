@@ -0,0 +1,107 @@
+"""
+Read-through cache of API responses.
+
+Responses of list and retrieve requests are cached per user and role under
+the versions of the data they show (see verification.cache_versions), so
+repeated polls of unchanged data skip the queries and the serializers. Any
+cache error falls back to building the response normally.
+
+With a file-based cache all processes of a host share the responses and
+versions. A local-memory cache is per process, so a process only notices
+the changes made by itself and serves others' stale data for up to the
+cache TIMEOUT.
+"""
+import hashlib
+import logging
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.response import Response
+
+from lab_verification_project.verification import cache_versions
+
+logger = logging.getLogger(__name__)
+
+
+def submission_scopes(user):
+    """Return the cache scopes of the submissions a user can see."""
+    if user.is_teacher or user.is_admin:
+        return [cache_versions.ASSIGNMENTS, cache_versions.SUBMISSIONS]
+    return [cache_versions.ASSIGNMENTS, cache_versions.student_scope(user.pk)]
+
+
+class CachedResponseMixin:
+    """
+    Serve the list and retrieve actions of a viewset from the response cache.
+
+    Viewsets set cache_scopes, or override get_cache_scopes when the scopes
+    depend on the action or the user.
+    """
+
+    cache_scopes = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.cache_scopes is None and cls.get_cache_scopes is CachedResponseMixin.get_cache_scopes:
+            raise ImproperlyConfigured(f"{cls.__name__} must set cache_scopes or override get_cache_scopes()")
+
+    def get_cache_scopes(self):
+        """Return the version scopes of the data the current action shows."""
+        return list(self.cache_scopes)
+
+    def response_cache_key(self, request, scopes):
+        user = request.user
+        parts = [
+            self.__class__.__name__,
+            self.action or '',
+            user.role,
+            str(user.pk),
+            request.build_absolute_uri(),
+            *cache_versions.get_versions(scopes),
+        ]
+        return 'response:' + hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def cached_response(self, request, build):
+        """
+        Return the cached response of a GET request, building and caching it on a miss.
+
+        Args:
+            request: The request
+            build: Function returning the response
+
+        Returns:
+            Response: Response, with an X-Cache header telling whether it was cached
+        """
+        cache = cache_versions.get_cache()
+        if cache is None or request.method != 'GET':
+            return build()
+
+        try:
+            key = self.response_cache_key(request, self.get_cache_scopes())
+            data = cache.get(key)
+        except Exception as e:
+            logger.error(f"Error reading the response cache: {str(e)}")
+            return build()
+
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = build()
+        if response.status_code == 200:
+            try:
+                cache.set(key, response.data)
+            except Exception as e:
+                logger.error(f"Error writing the response cache: {str(e)}")
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs)
+        )
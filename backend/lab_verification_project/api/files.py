@@ -0,0 +1,154 @@
+"""
+Streaming file responses with conditional GET and HTTP Range support.
+
+Files are either streamed by Django in chunks, or, when
+SUBMISSION_FILE_SENDFILE is set, handed off to the front web server with an
+X-Accel-Redirect (nginx) or X-Sendfile (Apache, lighttpd) header so that no
+Python worker is busy while the bytes are sent.
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, quote_etag
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class PassthroughRenderer(BaseRenderer):
+    """
+    Renderer that lets file responses skip DRF content negotiation.
+
+    File responses are not DRF Responses and never reach it. Error
+    responses of the same views (404, 401, 403) carry data and are rendered
+    as JSON, whatever the client accepts.
+    """
+
+    media_type = '*/*'
+    format = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = JSONRenderer.media_type
+        return JSONRenderer().render(data, renderer_context=renderer_context)
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range ``Range`` header.
+
+    Args:
+        header: Value of the Range header
+        size: Size of the file in bytes
+
+    Returns:
+        tuple or None: Inclusive (start, end) byte positions, None if the
+        header is not a single byte range (the full file is served then)
+
+    Raises:
+        ValueError: If the range cannot be satisfied
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+
+    if not start:
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError('Empty suffix range')
+        return max(0, size - length), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, path, filename, relative_name=None, etag=None):
+    """
+    Build the response serving a file from disk.
+
+    Args:
+        request: The current request
+        path: Absolute path to the file
+        filename: File name for the Content-Disposition header
+        relative_name: Path relative to MEDIA_ROOT, used for X-Accel-Redirect
+        etag: Optional strong entity tag; derived from size and mtime if omitted
+
+    Returns:
+        HttpResponse: 200, 206, 304, 412 or 416 response
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = quote_etag(etag or f"{size:x}-{stat.st_mtime_ns:x}")
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    def finish(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        response['Accept-Ranges'] = 'bytes'
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+        return response
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if conditional is not None:
+        return finish(conditional)
+
+    sendfile = settings.SUBMISSION_FILE_SENDFILE
+    if sendfile == 'x-accel-redirect' and relative_name:
+        # The front server handles Range requests itself
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.SUBMISSION_FILE_ACCEL_PREFIX + relative_name
+        return finish(response)
+    if sendfile == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return finish(response)
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if range_header and (not if_range or if_range == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{size}"
+            return finish(response)
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        return finish(response)
+
+    start, end = byte_range
+    response = StreamingHttpResponse(
+        _read_range(path, start, end - start + 1), status=206, content_type=content_type
+    )
+    response['Content-Length'] = str(end - start + 1)
+    response['Content-Range'] = f"bytes {start}-{end}/{size}"
+    return finish(response)
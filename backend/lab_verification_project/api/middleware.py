@@ -0,0 +1,80 @@
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+
+from lab_verification_project.verification.metrics import observe_request
+from .profiling import RequestProfile
+
+logger = logging.getLogger(__name__)
+
+# Other methods share one label value so clients cannot inflate the metrics
+KNOWN_METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'])
+
+
+class RequestMetricsMiddleware:
+    """Middleware recording the latency of every request for the metrics endpoint."""
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        
+        # Label by URL name rather than path to keep the number of series small
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unmatched'
+        method = request.method if request.method in KNOWN_METHODS else 'other'
+        observe_request(method, view, response.status_code, time.perf_counter() - start)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Middleware profiling requests that ask for it or are sampled.
+    
+    A request is profiled if it carries PROFILING_TOKEN in the X-Profile-Token
+    header, or with probability PROFILING_SAMPLE_RATE. Authorized requests get
+    the summary in Server-Timing and X-Profile-Summary headers; sampled ones
+    are only logged. With PROFILING_DIR set, every profile is also stored
+    there and its id returned in X-Profile-Id.
+    """
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        authorized = self.is_authorized(request)
+        sample_rate = settings.PROFILING_SAMPLE_RATE
+        if not authorized and not (sample_rate and random.random() < sample_rate):
+            return self.get_response(request)
+        
+        profile = RequestProfile()
+        with profile.activate():
+            response = self.get_response(request)
+        
+        summary = profile.summary()
+        profile_id = None
+        if settings.PROFILING_DIR:
+            try:
+                profile_id = profile.save(request, response)
+            except OSError as e:
+                logger.error(f"Error saving request profile: {str(e)}")
+        logger.info(f"Profiled {request.method} {request.path} ({profile_id or 'not stored'}): {summary}")
+        
+        if authorized:
+            response['Server-Timing'] = profile.server_timing()
+            response['X-Profile-Summary'] = '; '.join(f"{name}={value}" for name, value in summary.items())
+            if profile_id:
+                response['X-Profile-Id'] = profile_id
+        return response
+    
+    @staticmethod
+    def is_authorized(request):
+        """Return True if the request carries the profiling token."""
+        token = settings.PROFILING_TOKEN
+        header = request.headers.get('X-Profile-Token')
+        return bool(token and header and constant_time_compare(header, token))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination with a client-selectable, bounded page size."""
+    
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class SubmissionCursorPagination(KeysetPagination):
+    """Keyset pagination of submissions, newest first."""
+    
+    ordering = ('-submitted_at', '-id')
+
+
+class AssignmentCursorPagination(KeysetPagination):
+    """Keyset pagination of assignments, newest first."""
+    
+    ordering = ('-created_at', '-id')
+
+
+class CodeCommentCursorPagination(KeysetPagination):
+    """Keyset pagination of code comments in the order they were written."""
+    
+    ordering = ('created_at', 'id')
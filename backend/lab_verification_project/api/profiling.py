@@ -0,0 +1,203 @@
+"""
+Profiling of single API requests.
+
+A RequestProfile records, for the request it is active in, every SQL query
+(with its time, so repeated statements point at N+1 queries), a cProfile
+profile of the whole request and the time spent in serializers that use
+ProfiledSerializerMixin. It is switched on per request by ProfilingMiddleware;
+outside of a profiled request the mixin only costs one context variable
+lookup per serialized object.
+"""
+import cProfile
+import json
+import logging
+import os
+import pstats
+import time
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.fields import empty
+
+logger = logging.getLogger(__name__)
+
+_active_profile = ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    """Queries, cProfile data and serializer time of one request."""
+
+    def __init__(self):
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.statements = defaultdict(lambda: [0, 0.0])
+        self.serializer_seconds = 0.0
+        self.serializer_depth = 0
+        self.seconds = 0.0
+        self.profiler = None
+
+    def record_query(self, execute, sql, params, many, context):
+        """Database execute wrapper timing every query."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.query_count += 1
+            self.query_seconds += elapsed
+            statement = self.statements[sql]
+            statement[0] += 1
+            statement[1] += elapsed
+
+    @contextmanager
+    def activate(self):
+        """Profile the code run in this context."""
+        token = _active_profile.set(self)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self.record_query))
+                try:
+                    profiler.enable()
+                    self.profiler = profiler
+                except ValueError:
+                    # Another profiler (e.g. a coverage tool) is already active
+                    self.profiler = None
+                try:
+                    yield self
+                finally:
+                    if self.profiler is not None:
+                        self.profiler.disable()
+        finally:
+            self.seconds = time.perf_counter() - start
+            _active_profile.reset(token)
+
+    def top_functions(self, limit):
+        """Return the functions with the highest cumulative time."""
+        if self.profiler is None:
+            return []
+        stats = pstats.Stats(self.profiler).sort_stats('cumulative')
+        functions = []
+        for function in stats.fcn_list[:limit]:
+            _, calls, total, cumulative, _ = stats.stats[function]
+            file_name, line, name = function
+            functions.append({
+                'function': f"{file_name}:{line}({name})",
+                'calls': calls,
+                'total_ms': round(total * 1000, 3),
+                'cumulative_ms': round(cumulative * 1000, 3),
+            })
+        return functions
+
+    def repeated_queries(self, limit=10):
+        """Return the statements run more than once, the usual sign of N+1 queries."""
+        repeated = [
+            {'sql': sql, 'count': count, 'ms': round(seconds * 1000, 3)}
+            for sql, (count, seconds) in self.statements.items() if count > 1
+        ]
+        repeated.sort(key=lambda statement: statement['count'], reverse=True)
+        return repeated[:limit]
+
+    def summary(self):
+        """Return the headline numbers of the profile."""
+        return {
+            'total_ms': round(self.seconds * 1000, 3),
+            'queries': self.query_count,
+            'sql_ms': round(self.query_seconds * 1000, 3),
+            'repeated_queries': sum(1 for count, _ in self.statements.values() if count > 1),
+            'serializer_ms': round(self.serializer_seconds * 1000, 3),
+        }
+
+    def server_timing(self):
+        """Return the profile as a Server-Timing header value."""
+        summary = self.summary()
+        return (
+            f'total;dur={summary["total_ms"]}, '
+            f'sql;dur={summary["sql_ms"]};desc="{summary["queries"]} queries", '
+            f'serializer;dur={summary["serializer_ms"]}'
+        )
+
+    def save(self, request, response):
+        """
+        Store the profile in PROFILING_DIR.
+
+        Writes ``<id>.json`` with the summary, repeated queries and hot
+        functions, and ``<id>.prof`` with the raw cProfile data for tools
+        like snakeviz.
+
+        Returns:
+            str: Profile id
+        """
+        directory = settings.PROFILING_DIR
+        os.makedirs(directory, exist_ok=True)
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+        user = getattr(request, 'user', None)
+        report = {
+            'id': profile_id,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'user': user.pk if user is not None and user.is_authenticated else None,
+            'summary': self.summary(),
+            'repeated_queries': self.repeated_queries(),
+            'top_functions': self.top_functions(settings.PROFILING_TOP_FUNCTIONS),
+        }
+        with open(os.path.join(directory, f"{profile_id}.json"), 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        if self.profiler is not None:
+            self.profiler.dump_stats(os.path.join(directory, f"{profile_id}.prof"))
+
+        _prune_profiles(directory, settings.PROFILING_MAX_PROFILES)
+        return profile_id
+
+
+def _prune_profiles(directory, keep):
+    """Delete the oldest stored profiles above the limit."""
+    reports = sorted(
+        (name for name in os.listdir(directory) if name.endswith('.json')),
+        key=lambda name: os.path.getmtime(os.path.join(directory, name))
+    )
+    for name in reports[:max(0, len(reports) - keep)]:
+        profile_id = name[:-len('.json')]
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, profile_id + suffix))
+            except OSError:
+                pass
+
+
+def _timed(method, *args):
+    profile = _active_profile.get()
+    # Nested serializers are counted as part of the outermost one
+    if profile is None or profile.serializer_depth:
+        return method(*args)
+    profile.serializer_depth += 1
+    start = time.perf_counter()
+    try:
+        return method(*args)
+    finally:
+        profile.serializer_seconds += time.perf_counter() - start
+        profile.serializer_depth -= 1
+
+
+class ProfiledSerializerMixin:
+    """
+    Count the time spent serializing and validating in profiled requests.
+
+    Only the top-level serializers of the list and detail responses that grow
+    with the data use it (assignments, submissions, comments, verification
+    results); nested serializers are timed as part of them.
+    """
+
+    def to_representation(self, instance):
+        return _timed(super().to_representation, instance)
+
+    def run_validation(self, data=empty):
+        return _timed(super().run_validation, data)
@@ -1,12 +1,39 @@
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from django.contrib.auth import get_user_model
 from lab_verification_project.verification.models import (
-    Assignment, Submission, VerificationResult, TeacherReview, CodeComment
+    Assignment, Submission, VerificationResult, VerificationJob, TeacherReview, CodeComment,
+    TestCase, TestCaseResult, AssignmentStats
 )
+from .profiling import ProfiledSerializerMixin
 
 User = get_user_model()
 
-class AssignmentSerializer(serializers.ModelSerializer):
+class SparseFieldsetMixin:
+    """
+    Limit the serialized fields to those listed in ?fields=a,b,c on GET requests.
+    
+    Raises:
+        ValidationError: If a listed field does not exist (a 400 response)
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        requested = request.query_params.get('fields')
+        if not requested:
+            return
+        
+        allowed = {name.strip() for name in requested.split(',') if name.strip()}
+        unknown = allowed - set(self.fields)
+        if unknown:
+            raise serializers.ValidationError({'fields': [f"Unknown fields: {', '.join(sorted(unknown))}"]})
+        for name in set(self.fields) - allowed:
+            self.fields.pop(name)
+
+class AssignmentSerializer(ProfiledSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for Assignment model."""
     
     created_by_name = serializers.SerializerMethodField()
@@ -23,7 +50,24 @@ class AssignmentSerializer(serializers.ModelSerializer):
         validated_data['created_by'] = self.context['request'].user
         return super().create(validated_data)
 
-class CodeCommentSerializer(serializers.ModelSerializer):
+class AssignmentStatsSerializer(serializers.ModelSerializer):
+    """Serializer for AssignmentStats model."""
+    
+    average_plagiarism_score = serializers.FloatField(read_only=True)
+    average_grade = serializers.FloatField(read_only=True)
+    test_pass_rate = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = AssignmentStats
+        fields = [
+            'assignment', 'submission_count', 'student_count', 'pending_count', 'verified_count',
+            'reviewed_count', 'verification_count', 'syntax_passed_count', 'average_plagiarism_score',
+            'tests_passed_sum', 'tests_total_sum', 'test_pass_rate', 'review_count', 'graded_count',
+            'average_grade', 'grade_distribution', 'updated_at'
+        ]
+        read_only_fields = fields
+
+class CodeCommentSerializer(ProfiledSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for CodeComment model."""
     
     teacher_name = serializers.SerializerMethodField()
@@ -41,16 +85,101 @@ class CodeCommentSerializer(serializers.ModelSerializer):
         validated_data['submission_id'] = self.context.get('submission_id')
         return super().create(validated_data)
 
-class VerificationResultSerializer(serializers.ModelSerializer):
+class BulkItemMixin:
+    """
+    Item of a bulk request naming its submission.
+    
+    The view preloads the submissions of all items into the 'submissions'
+    context (id -> Submission), so validating an item needs no query; the
+    'submission' field is a plain IntegerField for the same reason.
+    """
+    
+    def validate_submission(self, value):
+        if value not in self.context['submissions']:
+            raise serializers.ValidationError('Submission not found.')
+        return value
+
+class BulkCodeCommentSerializer(BulkItemMixin, CodeCommentSerializer):
+    """Serializer for one code comment of a bulk comment request."""
+    
+    submission = serializers.IntegerField(source='submission_id')
+    
+    class Meta(CodeCommentSerializer.Meta):
+        fields = ['id', 'submission', 'line_number', 'comment', 'teacher', 'teacher_name', 'created_at']
+
+class TestCaseSerializer(serializers.ModelSerializer):
+    """Serializer for TestCase model."""
+    
+    class Meta:
+        model = TestCase
+        fields = [
+            'id', 'assignment', 'name', 'input_data', 'expected_output', 'is_hidden',
+            'order', 'time_limit', 'memory_limit', 'created_at'
+        ]
+        read_only_fields = ['id', 'created_at']
+    
+    def validate_time_limit(self, value):
+        if not 0 < value <= 60:
+            raise serializers.ValidationError('Time limit must be between 0 and 60 seconds.')
+        return value
+    
+    def validate_memory_limit(self, value):
+        if not 16 <= value <= 4096:
+            raise serializers.ValidationError('Memory limit must be between 16 and 4096 MB.')
+        return value
+
+class TestCaseResultSerializer(serializers.ModelSerializer):
+    """Serializer for TestCaseResult model."""
+    
+    test_name = serializers.CharField(source='test_case.name', read_only=True)
+    
+    class Meta:
+        model = TestCaseResult
+        fields = [
+            'id', 'test_case', 'test_name', 'status', 'output', 'errors',
+            'exit_code', 'wall_time', 'cpu_time'
+        ]
+        read_only_fields = fields
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        request = self.context.get('request')
+        # Students must not learn the content of hidden tests
+        if instance.test_case.is_hidden and not (
+                request and (request.user.is_teacher or request.user.is_admin)):
+            data.pop('output')
+            data.pop('errors')
+        return data
+
+class VerificationResultSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Serializer for VerificationResult model."""
     
+    test_results = TestCaseResultSerializer(many=True, read_only=True)
+    
     class Meta:
         model = VerificationResult
         fields = [
-            'id', 'syntax_check_passed', 'syntax_errors', 
-            'plagiarism_score', 'plagiarism_details', 'verified_at'
+            'id', 'submission', 'syntax_check_passed', 'syntax_errors', 
+            'plagiarism_score', 'plagiarism_details', 'tests_passed', 'tests_total',
+            'test_results', 'stage_timings', 'verified_at'
         ]
-        read_only_fields = ['id', 'verified_at']
+        read_only_fields = ['id', 'submission', 'tests_passed', 'tests_total', 'verified_at']
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        request = self.context.get('request')
+        # Stage timings describe the server, not the submission
+        if not (request and (request.user.is_teacher or request.user.is_admin)):
+            data.pop('stage_timings', None)
+        return data
+
+class VerificationJobSerializer(serializers.ModelSerializer):
+    """Serializer for VerificationJob model."""
+    
+    class Meta:
+        model = VerificationJob
+        fields = ['id', 'submission', 'status', 'error', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
 
 class TeacherReviewSerializer(serializers.ModelSerializer):
     """Serializer for TeacherReview model."""
@@ -70,7 +199,15 @@ class TeacherReviewSerializer(serializers.ModelSerializer):
         validated_data['submission_id'] = self.context.get('submission_id')
         return super().create(validated_data)
 
-class SubmissionSerializer(serializers.ModelSerializer):
+class BulkTeacherReviewSerializer(BulkItemMixin, TeacherReviewSerializer):
+    """Serializer for one review of a bulk review request."""
+    
+    submission = serializers.IntegerField(source='submission_id')
+    
+    class Meta(TeacherReviewSerializer.Meta):
+        fields = ['id', 'submission', 'comments', 'grade', 'teacher', 'teacher_name', 'reviewed_at']
+
+class SubmissionSerializer(ProfiledSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for Submission model."""
     
     student_name = serializers.SerializerMethodField()
@@ -88,6 +225,8 @@ class SubmissionSerializer(serializers.ModelSerializer):
             'verification_result', 'teacher_review', 'code_comments'
         ]
         read_only_fields = ['id', 'student', 'submitted_at', 'status']
+        # Uploaded only; files are read through the permission-checked file_url
+        extra_kwargs = {'file': {'write_only': True}}
     
     def get_student_name(self, obj):
         return obj.student.full_name
@@ -97,14 +236,14 @@ class SubmissionSerializer(serializers.ModelSerializer):
     
     def get_file_url(self, obj):
         if obj.file:
-            return obj.file.url
+            return reverse('submission-download', args=[obj.pk], request=self.context.get('request'))
         return None
     
     def create(self, validated_data):
         validated_data['student'] = self.context['request'].user
         return super().create(validated_data)
 
-class SubmissionListSerializer(serializers.ModelSerializer):
+class SubmissionListSerializer(ProfiledSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     """Simplified serializer for listing submissions."""
     
     student_name = serializers.SerializerMethodField()
@@ -126,7 +265,12 @@ class SubmissionListSerializer(serializers.ModelSerializer):
         return obj.assignment.title
     
     def get_has_verification(self, obj):
+        # Annotated by Submission.objects.for_list()
+        if hasattr(obj, 'has_verification'):
+            return obj.has_verification
         return hasattr(obj, 'verification_result')
     
     def get_has_review(self, obj):
+        if hasattr(obj, 'has_review'):
+            return obj.has_review
         return hasattr(obj, 'teacher_review')
@@ -0,0 +1,287 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.test import APIClient
+from rest_framework.viewsets import GenericViewSet
+
+from lab_verification_project.verification import cache_versions
+from lab_verification_project.verification.models import (
+    Assignment, Submission, VerificationResult, TeacherReview, CodeComment
+)
+
+from .cache import CachedResponseMixin
+
+User = get_user_model()
+
+
+@override_settings(API_RESPONSE_CACHE_ALIAS=None)
+class SubmissionQueryCountTests(TestCase):
+    """The submission endpoints run a fixed number of queries however many rows they show."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(
+            'teacher@example.com', first_name='Teacher', last_name='One', role='teacher'
+        )
+        cls.assignment = Assignment.objects.create(
+            title='Lab 1', description='First lab', created_by=cls.teacher
+        )
+        cls.student_count = 0
+        cls.add_submissions(3)
+
+    @classmethod
+    def add_submissions(cls, count):
+        """Add submissions with a verification result, a review and comments each."""
+        submissions = []
+        for _ in range(count):
+            cls.student_count += 1
+            student = User.objects.create_user(
+                f"student{cls.student_count}@example.com",
+                first_name='Student', last_name=str(cls.student_count), role='student'
+            )
+            submission = Submission.objects.create(
+                assignment=cls.assignment, student=student, file='submissions/lab1.py'
+            )
+            VerificationResult.objects.create(
+                submission=submission, syntax_check_passed=True, plagiarism_score=10.0
+            )
+            TeacherReview.objects.create(submission=submission, teacher=cls.teacher, comments='Good', grade=5)
+            for line_number in (1, 2):
+                CodeComment.objects.create(
+                    submission=submission, teacher=cls.teacher, line_number=line_number, comment='Check this'
+                )
+            submissions.append(submission)
+        return submissions
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher)
+
+    def assert_constant_queries(self, url, queries):
+        """Fetch a URL before and after adding rows, expecting the same number of queries."""
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        self.add_submissions(5)
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_submission_list(self):
+        response = self.assert_constant_queries('/api/submissions/', 1)
+        self.assertEqual(len(response.data['results']), 8)
+
+    def test_assignment_submissions(self):
+        response = self.assert_constant_queries(f"/api/assignments/{self.assignment.id}/submissions/", 2)
+        self.assertEqual(len(response.data['results']), 8)
+
+    def test_sparse_fieldset(self):
+        response = self.client.get('/api/submissions/?fields=id,status')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'status'})
+
+    def test_sparse_fieldset_rejects_unknown_fields(self):
+        response = self.client.get('/api/submissions/?fields=id,grade,owner')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'fields': ['Unknown fields: grade, owner']})
+
+    def test_submission_detail(self):
+        submission = Submission.objects.first()
+        response = self.assert_constant_queries(f"/api/submissions/{submission.id}/", 3)
+        self.assertEqual(len(response.data['code_comments']), 2)
+
+    def test_stage_timings_are_shown_to_teachers_only(self):
+        submission = Submission.objects.first()
+        url = f"/api/submissions/{submission.id}/"
+        self.assertIn('stage_timings', self.client.get(url).data['verification_result'])
+
+        self.client.force_authenticate(submission.student)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('stage_timings', response.data['verification_result'])
+
+
+@override_settings(API_RESPONSE_CACHE_ALIAS=None)
+class SubmissionDownloadTests(TestCase):
+    """The download endpoint serves files with Range and conditional GET, and JSON errors."""
+
+    content = b'print("hello world")\n'
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.student = User.objects.create_user(
+            'student@example.com', first_name='Student', last_name='One', role='student'
+        )
+        assignment = Assignment.objects.create(
+            title='Lab 1', description='First lab', created_by=self.student
+        )
+        self.submission = Submission.objects.create(
+            assignment=assignment, student=self.student,
+            file=SimpleUploadedFile('lab1.py', self.content)
+        )
+        self.url = f"/api/submissions/{self.submission.id}/download/"
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def assert_json_error(self, response, status_code):
+        self.assertEqual(response.status_code, status_code)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('detail', response.json())
+        self.assertTrue(response.json()['detail'])
+
+    def test_full_download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertTrue(response['ETag'])
+        self.assertIn('lab1.py', response['Content-Disposition'])
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=6-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[6:11])
+        self.assertEqual(response['Content-Range'], f"bytes 6-10/{len(self.content)}")
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=1000-2000')
+        self.assertEqual(response.status_code, 416)
+
+    def test_missing_file(self):
+        Submission.objects.filter(id=self.submission.id).update(file='submissions/missing.py')
+        self.assert_json_error(self.client.get(self.url), 404)
+
+    def test_other_students_submission(self):
+        other = User.objects.create_user(
+            'other@example.com', first_name='Student', last_name='Two', role='student'
+        )
+        self.client.force_authenticate(other)
+        self.assert_json_error(self.client.get(self.url), 404)
+
+    def test_unauthenticated(self):
+        self.client.force_authenticate(None)
+        self.assert_json_error(self.client.get(self.url), 401)
+
+    def test_permission_denied(self):
+        with mock.patch.object(IsAuthenticated, 'has_permission', return_value=False):
+            self.assert_json_error(self.client.get(self.url), 403)
+
+
+@override_settings(API_RESPONSE_CACHE_ALIAS=None, API_BULK_MAX_ITEMS=5)
+class BulkEndpointTests(TestCase):
+    """Bulk comments and reviews are teacher-only and store the valid items of a partly invalid payload."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(
+            'teacher@example.com', first_name='Teacher', last_name='One', role='teacher'
+        )
+        cls.student = User.objects.create_user(
+            'student@example.com', first_name='Student', last_name='One', role='student'
+        )
+        assignment = Assignment.objects.create(title='Lab 1', description='First lab', created_by=cls.teacher)
+        cls.submissions = [
+            Submission.objects.create(assignment=assignment, student=cls.student, file='submissions/lab1.py')
+            for _ in range(3)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher)
+
+    def test_students_are_forbidden(self):
+        self.client.force_authenticate(self.student)
+        submission = self.submissions[0].id
+        comment = {'submission': submission, 'line_number': 1, 'comment': 'x'}
+        response = self.client.post('/api/submissions/bulk-comment/', {'comments': [comment]}, format='json')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(
+            '/api/submissions/bulk-review/', {'reviews': [{'submission': submission, 'comments': 'x'}]}, format='json'
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(CodeComment.objects.exists())
+        self.assertFalse(TeacherReview.objects.exists())
+
+    def test_anonymous_is_unauthorized(self):
+        self.client.force_authenticate(None)
+        response = self.client.post('/api/submissions/bulk-comment/', {'comments': []}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_invalid_payloads(self):
+        for payload in ({'comments': []}, {'comments': 'x'}, {'comments': [{}] * 6}):
+            response = self.client.post('/api/submissions/bulk-comment/', payload, format='json')
+            self.assertEqual(response.status_code, 400, payload)
+
+    def test_partial_comments(self):
+        first, second = self.submissions[0].id, self.submissions[1].id
+        response = self.client.post('/api/submissions/bulk-comment/', [
+            {'submission': first, 'line_number': 1, 'comment': 'Name this better'},
+            {'submission': 999999, 'line_number': 1, 'comment': 'Missing submission'},
+            {'submission': second, 'comment': 'Missing line'},
+            {'submission': second, 'line_number': 3, 'comment': 'Check the bounds'},
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([comment['submission'] for comment in response.data['created']], [first, second])
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertIn('submission', response.data['errors'][0]['errors'])
+        self.assertIn('line_number', response.data['errors'][1]['errors'])
+        self.assertEqual(CodeComment.objects.count(), 2)
+
+    def test_all_comments_invalid(self):
+        response = self.client.post(
+            '/api/submissions/bulk-comment/', [{'submission': 999999, 'line_number': 1, 'comment': 'x'}], format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], [])
+        self.assertFalse(CodeComment.objects.exists())
+
+    def test_partial_reviews(self):
+        first, second, third = (submission.id for submission in self.submissions)
+        TeacherReview.objects.create(submission_id=third, teacher=self.teacher, comments='Earlier', grade=3)
+        response = self.client.post('/api/submissions/bulk-review/', {'reviews': [
+            {'submission': first, 'comments': 'Good', 'grade': 5},
+            {'submission': first, 'comments': 'Twice', 'grade': 4},
+            {'submission': third, 'comments': 'Already reviewed', 'grade': 4},
+            {'submission': 999999, 'comments': 'Missing', 'grade': 4},
+            {'submission': second, 'comments': 'Fine'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([review['submission'] for review in response.data['created']], [first, second])
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2, 3])
+        self.assertEqual(
+            dict(Submission.objects.filter(id__in=[first, second]).values_list('id', 'status')),
+            {first: 'reviewed', second: 'reviewed'}
+        )
+        self.assertEqual(TeacherReview.objects.get(submission_id=first).grade, 5)
+
+
+class CachedResponseMixinTests(SimpleTestCase):
+    """Viewsets serving cached responses must name the scopes of their data."""
+
+    def test_cache_scopes_attribute(self):
+        class ScopedViewSet(CachedResponseMixin, GenericViewSet):
+            cache_scopes = [cache_versions.ASSIGNMENTS]
+
+        self.assertEqual(ScopedViewSet().get_cache_scopes(), [cache_versions.ASSIGNMENTS])
+
+    def test_missing_scopes_are_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            class UnscopedViewSet(CachedResponseMixin, GenericViewSet):
+                pass
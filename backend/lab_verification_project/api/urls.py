@@ -1,13 +1,19 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AssignmentViewSet, SubmissionViewSet, CodeCommentViewSet
+from .views import (
+    AssignmentViewSet, SubmissionViewSet, CodeCommentViewSet, VerificationJobViewSet, TestCaseViewSet,
+    GradebookView
+)
 
 # Create a router and register our viewsets
 router = DefaultRouter()
 router.register(r'assignments', AssignmentViewSet)
 router.register(r'submissions', SubmissionViewSet)
 router.register(r'comments', CodeCommentViewSet)
+router.register(r'verification-jobs', VerificationJobViewSet)
+router.register(r'test-cases', TestCaseViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('gradebook/', GradebookView.as_view(), name='gradebook'),
 ]
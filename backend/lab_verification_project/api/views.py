@@ -1,14 +1,35 @@
+import os
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
 from rest_framework import viewsets, permissions, status, generics
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.decorators import action
+from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
+from django.conf import settings
 from lab_verification_project.verification.models import (
-    Assignment, Submission, VerificationResult, TeacherReview, CodeComment
+    Assignment, Submission, VerificationResult, VerificationJob, TeacherReview, CodeComment, TestCase
+)
+from lab_verification_project.verification.services import (
+    add_code_comments, add_teacher_reviews, find_similar_pairs
+)
+from lab_verification_project.verification.jobs import enqueue_verification, enqueue_verifications, queue_stats
+from lab_verification_project.verification import cache_versions, metrics
+from lab_verification_project.verification.fingerprints import get_submission_fingerprint, index_assignment
+from lab_verification_project.verification.minhash import LSH_RELIABLE_THRESHOLD
+from lab_verification_project.verification.stats import get_stats
+from lab_verification_project.verification.storage import release_blob
+from .cache import CachedResponseMixin, submission_scopes
+from .files import PassthroughRenderer, serve_file
+from .pagination import (
+    AssignmentCursorPagination, SubmissionCursorPagination, CodeCommentCursorPagination
 )
-from lab_verification_project.verification.services import verify_submission
 from .serializers import (
     AssignmentSerializer, SubmissionSerializer, SubmissionListSerializer,
-    VerificationResultSerializer, TeacherReviewSerializer, CodeCommentSerializer
+    VerificationResultSerializer, VerificationJobSerializer, TeacherReviewSerializer,
+    CodeCommentSerializer, TestCaseSerializer, AssignmentStatsSerializer,
+    BulkCodeCommentSerializer, BulkTeacherReviewSerializer
 )
 
 class IsTeacherOrAdmin(permissions.BasePermission):
@@ -32,15 +53,24 @@ class IsOwnerOrTeacher(permissions.BasePermission):
         
         return False
 
-class AssignmentViewSet(viewsets.ModelViewSet):
+class AssignmentViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """ViewSet for Assignment model."""
     
-    queryset = Assignment.objects.all()
+    queryset = Assignment.objects.select_related('created_by')
     serializer_class = AssignmentSerializer
+    pagination_class = AssignmentCursorPagination
+    cache_scopes = [cache_versions.ASSIGNMENTS]
+    
+    def get_cache_scopes(self):
+        if self.action == 'submissions':
+            return submission_scopes(self.request.user)
+        return super().get_cache_scopes()
     
     def get_permissions(self):
         """Return the permissions that the action should be enforced."""
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in [
+            'create', 'update', 'partial_update', 'destroy', 'similarity_matrix', 'verify_pending', 'stats'
+        ]:
             permission_classes = [IsTeacherOrAdmin]
         else:
             permission_classes = [permissions.IsAuthenticated]
@@ -49,20 +79,102 @@ class AssignmentViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def submissions(self, request, pk=None):
         """Get all submissions for an assignment."""
+        return self.cached_response(request, lambda: self._list_submissions(request))
+    
+    def _list_submissions(self, request):
         assignment = self.get_object()
-        submissions = assignment.submissions.all()
+        submissions = assignment.submissions.for_list()
         
         # Students can only see their own submissions
         if not (request.user.is_teacher or request.user.is_admin):
             submissions = submissions.filter(student=request.user)
         
-        serializer = SubmissionListSerializer(submissions, many=True)
+        paginator = SubmissionCursorPagination()
+        page = paginator.paginate_queryset(submissions, request, view=self)
+        serializer = SubmissionListSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+    
+    @action(detail=True, methods=['get'], url_path='similarity-matrix')
+    def similarity_matrix(self, request, pk=None):
+        """Get all pairs of similar submissions for an assignment."""
+        assignment = self.get_object()
+        
+        try:
+            threshold = float(request.query_params.get(
+                'threshold', settings.VERIFICATION_SIMILARITY_THRESHOLD
+            ))
+        except ValueError:
+            return Response(
+                {'detail': 'Threshold must be a number.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 0 <= threshold <= 100:
+            # Also rejects nan, which compares false with everything
+            return Response(
+                {'detail': 'Threshold must be between 0 and 100.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        max_pairs = settings.VERIFICATION_SIMILARITY_MAX_PAIRS
+        try:
+            limit = int(request.query_params.get('limit', max_pairs))
+        except ValueError:
+            return Response(
+                {'detail': 'Limit must be an integer.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 1 <= limit <= max_pairs:
+            return Response(
+                {'detail': f"Limit must be between 1 and {max_pairs}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        pairs, candidate_count, pair_count = find_similar_pairs(assignment, threshold, limit)
+        return Response({
+            'assignment': assignment.id,
+            'threshold': threshold,
+            # LSH may miss less similar pairs, see find_similar_pairs()
+            'may_miss_pairs': threshold < LSH_RELIABLE_THRESHOLD,
+            'candidate_count': candidate_count,
+            'pair_count': pair_count,
+            'truncated': pair_count > len(pairs),
+            'pairs': pairs,
+        })
+    
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """Get the submission, verification and grade statistics of an assignment."""
+        assignment = self.get_object()
+        serializer = AssignmentStatsSerializer(get_stats(assignment))
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['post'], url_path='verify-pending')
+    def verify_pending(self, request, pk=None):
+        """Queue all pending submissions of an assignment for verification."""
+        assignment = self.get_object()
+        
+        # Index the assignment once for the whole run; the batches of the job
+        # workers then share the index instead of each indexing missing files
+        index_assignment(assignment)
+        # Job workers verify queued submissions of one assignment in batches
+        pending = assignment.submissions.filter(status='pending', verification_result__isnull=True).only('id')
+        jobs = enqueue_verifications(pending)
+        
+        serializer = VerificationJobSerializer(jobs, many=True)
+        return Response({
+            'assignment': assignment.id,
+            'queued_count': len(jobs),
+            'jobs': serializer.data,
+        }, status=status.HTTP_202_ACCEPTED)
 
-class SubmissionViewSet(viewsets.ModelViewSet):
+class SubmissionViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """ViewSet for Submission model."""
     
     queryset = Submission.objects.all()
+    pagination_class = SubmissionCursorPagination
+    
+    def get_cache_scopes(self):
+        return submission_scopes(self.request.user)
     
     def get_serializer_class(self):
         if self.action == 'list':
@@ -79,13 +191,51 @@ class SubmissionViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """Get the queryset based on the user role."""
+        if self.action == 'list':
+            queryset = Submission.objects.for_list()
+        else:
+            queryset = Submission.objects.for_detail()
+        
         if self.request.user.is_teacher or self.request.user.is_admin:
-            return Submission.objects.all()
-        return Submission.objects.filter(student=self.request.user)
+            return queryset
+        return queryset.filter(student=self.request.user)
+    
+    def perform_create(self, serializer):
+        submission = serializer.save()
+        # Fingerprint the upload once so plagiarism checks never re-read it
+        get_submission_fingerprint(submission)
+    
+    def perform_update(self, serializer):
+        if 'file' in serializer.validated_data:
+            old_name, old_hash = serializer.instance.file.name, serializer.instance.content_hash
+            submission = serializer.save(fingerprint=None)
+            get_submission_fingerprint(submission)
+            if submission.file.name != old_name:
+                release_blob(old_name, old_hash)
+        else:
+            serializer.save()
+    
+    @action(detail=True, methods=['get'], renderer_classes=[PassthroughRenderer])
+    def download(self, request, pk=None):
+        """Download the submitted file, with Range and conditional GET support."""
+        submission = self.get_object()
+        
+        if not submission.file or not os.path.exists(submission.file.path):
+            return Response(
+                {'detail': 'Submission file not found.'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        return serve_file(
+            request,
+            submission.file.path,
+            submission.filename,
+            relative_name=submission.file.name,
+        )
     
     @action(detail=True, methods=['post'])
     def verify(self, request, pk=None):
-        """Verify a submission."""
+        """Queue a submission for verification."""
         submission = self.get_object()
         
         # Check if the submission has already been verified
@@ -95,21 +245,11 @@ class SubmissionViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Verify the submission
-        verification_data = verify_submission(submission)
-        
-        # Create the verification result
-        verification_result = VerificationResult.objects.create(
-            submission=submission,
-            **verification_data
-        )
-        
-        # Update the submission status
-        submission.status = 'verified'
-        submission.save()
+        # Queue the verification; a worker process runs the checks
+        job = enqueue_verification(submission)
         
-        serializer = VerificationResultSerializer(verification_result)
-        return Response(serializer.data)
+        serializer = VerificationJobSerializer(job)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
     
     @action(detail=True, methods=['post'])
     def review(self, request, pk=None):
@@ -170,12 +310,138 @@ class SubmissionViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    def _validate_bulk_items(self, request, key, serializer_class):
+        """
+        Validate every item of a bulk request on its own.
+        
+        The payload is either a list of items or an object holding the list
+        under key. All submissions the items name are loaded with one query.
+        
+        Args:
+            request: The request
+            key: Name of the item list, e.g. 'comments'
+            serializer_class: Serializer of one item
+        
+        Returns:
+            tuple: (list of (index, validated data), list of item errors,
+                submissions by id), or (None, error response, None) if the
+                payload itself is invalid
+        """
+        items = request.data.get(key) if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return None, Response(
+                {'detail': f"Expected a non-empty list of {key}."},
+                status=status.HTTP_400_BAD_REQUEST
+            ), None
+        if len(items) > settings.API_BULK_MAX_ITEMS:
+            return None, Response(
+                {'detail': f"At most {settings.API_BULK_MAX_ITEMS} {key} can be sent at once."},
+                status=status.HTTP_400_BAD_REQUEST
+            ), None
+        
+        submission_ids = set()
+        for item in items:
+            try:
+                submission_ids.add(int(item.get('submission')))
+            except (AttributeError, TypeError, ValueError):
+                pass
+        submissions = Submission.objects.only('id', 'student_id', 'assignment_id', 'status').in_bulk(submission_ids)
+        
+        context = {'request': request, 'submissions': submissions}
+        valid, errors = [], []
+        for index, item in enumerate(items):
+            serializer = serializer_class(data=item, context=context)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+        return valid, errors, submissions
+    
+    def _bulk_response(self, request, created, errors, serializer_class):
+        """Return the created items and the errors of the rejected ones."""
+        errors.sort(key=lambda error: error['index'])
+        serializer = serializer_class(created, many=True, context={'request': request})
+        return Response(
+            {'created': serializer.data, 'errors': errors},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
+        )
+    
+    @action(detail=False, methods=['post'], url_path='bulk-comment')
+    def bulk_comment(self, request):
+        """
+        Add many code comments, to one or more submissions, in one request.
+        
+        Invalid items are reported by their index in the payload, the valid
+        ones are still stored.
+        """
+        if not (request.user.is_teacher or request.user.is_admin):
+            return Response(
+                {'detail': 'Only teachers can add code comments.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        valid, errors, submissions = self._validate_bulk_items(request, 'comments', BulkCodeCommentSerializer)
+        if valid is None:
+            return errors
+        
+        comments = [CodeComment(teacher=request.user, **data) for index, data in valid]
+        created, skipped = add_code_comments(comments)
+        skipped = set(skipped)
+        errors += [
+            {'index': index, 'errors': {'submission': ['Submission not found.']}}
+            for index, data in valid if data['submission_id'] in skipped
+        ]
+        return self._bulk_response(request, created, errors, BulkCodeCommentSerializer)
+    
+    @action(detail=False, methods=['post'], url_path='bulk-review')
+    def bulk_review(self, request):
+        """
+        Review many submissions in one request and mark them reviewed.
+        
+        Invalid items, and items for submissions that already have a review
+        or appear earlier in the payload, are reported by their index; the
+        valid ones are still stored.
+        """
+        if not (request.user.is_teacher or request.user.is_admin):
+            return Response(
+                {'detail': 'Only teachers can review submissions.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        valid, errors, submissions = self._validate_bulk_items(request, 'reviews', BulkTeacherReviewSerializer)
+        if valid is None:
+            return errors
+        
+        reviewed = set(
+            TeacherReview.objects.filter(submission_id__in=submissions).values_list('submission_id', flat=True)
+        )
+        reviews, indexes = [], {}
+        for index, data in valid:
+            if data['submission_id'] in reviewed:
+                errors.append({'index': index, 'errors': {'submission': ['Submission has already been reviewed.']}})
+                continue
+            reviewed.add(data['submission_id'])
+            review = TeacherReview(teacher=request.user, **data)
+            indexes[review.submission_id] = index
+            reviews.append(review)
+        
+        created, skipped = add_teacher_reviews(reviews)
+        errors += [
+            {
+                'index': indexes[submission_id],
+                'errors': {'submission': ['Submission was deleted or reviewed meanwhile.']}
+            }
+            for submission_id in skipped
+        ]
+        return self._bulk_response(request, created, errors, BulkTeacherReviewSerializer)
 
 class CodeCommentViewSet(viewsets.ModelViewSet):
     """ViewSet for CodeComment model."""
     
-    queryset = CodeComment.objects.all()
+    queryset = CodeComment.objects.select_related('teacher')
     serializer_class = CodeCommentSerializer
+    pagination_class = CodeCommentCursorPagination
     permission_classes = [IsTeacherOrAdmin]
     
     def get_queryset(self):
@@ -185,3 +451,107 @@ class CodeCommentViewSet(viewsets.ModelViewSet):
         if submission_id:
             queryset = queryset.filter(submission_id=submission_id)
         return queryset
+
+class TestCaseViewSet(viewsets.ModelViewSet):
+    """ViewSet for the test cases of assignments (teachers only)."""
+    
+    queryset = TestCase.objects.all()
+    serializer_class = TestCaseSerializer
+    permission_classes = [IsTeacherOrAdmin]
+    
+    def get_queryset(self):
+        """Get the queryset filtered by assignment if provided."""
+        queryset = super().get_queryset()
+        assignment_id = self.request.query_params.get('assignment')
+        if assignment_id:
+            queryset = queryset.filter(assignment_id=assignment_id)
+        return queryset
+
+class VerificationJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet for polling the status of verification jobs."""
+    
+    queryset = VerificationJob.objects.all()
+    serializer_class = VerificationJobSerializer
+    
+    def get_queryset(self):
+        """Get the queryset based on the user role."""
+        if self.request.user.is_teacher or self.request.user.is_admin:
+            return VerificationJob.objects.all()
+        return VerificationJob.objects.filter(submission__student=self.request.user)
+
+class GradebookView(APIView):
+    """Student x assignment matrix of the latest submissions, optionally for one group."""
+    
+    permission_classes = [IsTeacherOrAdmin]
+    
+    def get(self, request):
+        group = request.query_params.get('group')
+        
+        students = get_user_model().objects.filter(role='student')
+        if group:
+            students = students.filter(group=group)
+        
+        # One query for all cells: the newest submission per student and assignment
+        cells = (
+            Submission.objects.latest_per_student()
+            .filter(student__in=students)
+            .values_list(
+                'assignment_id', 'student_id', 'id', 'status', 'submitted_at',
+                'verification_result__plagiarism_score', 'teacher_review__grade'
+            )
+        )
+        rows = {}
+        for assignment_id, student_id, submission_id, submission_status, submitted_at, score, grade in cells:
+            rows.setdefault(student_id, {})[assignment_id] = {
+                'submission': submission_id,
+                'status': submission_status,
+                'submitted_at': submitted_at,
+                'plagiarism_score': score,
+                'grade': grade,
+            }
+        
+        assignments = Assignment.objects.order_by('created_at', 'id').values('id', 'title', 'deadline')
+        return Response({
+            'group': group,
+            'assignments': list(assignments),
+            'students': [
+                {
+                    'id': student['id'],
+                    'full_name': f"{student['first_name']} {student['last_name']}",
+                    'email': student['email'],
+                    'group': student['group'],
+                    'submissions': rows.get(student['id'], {}),
+                }
+                for student in students.order_by('last_name', 'first_name', 'id').values(
+                    'id', 'first_name', 'last_name', 'email', 'group'
+                )
+            ],
+        })
+
+def metrics_view(request):
+    """
+    Export the metrics of all processes in the Prometheus text format.
+    
+    Requires the METRICS_AUTH_TOKEN bearer token if one is set, otherwise
+    only answers clients in METRICS_ALLOWED_IPS that connect directly.
+    """
+    token = settings.METRICS_AUTH_TOKEN
+    if token:
+        if not constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {token}"):
+            return HttpResponse(status=401)
+    elif request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS or 'X-Forwarded-For' in request.headers:
+        # A reverse proxy on an allowed address would pass on anyone's requests
+        return HttpResponse(status=403)
+    
+    counts, oldest_age = queue_stats()
+    gauges = [
+        (
+            'verification_queue_depth', 'Verification jobs by status.',
+            {(('status', job_status),): count for job_status, count in counts.items()}
+        ),
+        (
+            'verification_queue_oldest_seconds', 'Age of the oldest queued verification job.',
+            {(): oldest_age}
+        ),
+    ]
+    return HttpResponse(metrics.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
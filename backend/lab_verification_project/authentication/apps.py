@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class AuthenticationConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'lab_verification_project.authentication'
+    
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -1,6 +1,11 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from .tokens import add_user_claims, cache_user
 
 User = get_user_model()
 
@@ -39,7 +44,36 @@ class ChangePasswordSerializer(serializers.Serializer):
     new_password = serializers.CharField(required=True, validators=[validate_password])
     
     def validate_old_password(self, value):
-        user = self.context['request'].user
+        # The request user may be built from token claims, without a password
+        user = self.context['user']
         if not user.check_password(value):
             raise serializers.ValidationError("Old password is not correct")
         return value
+
+class UserTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Issue tokens carrying the user claims read by CachedJWTAuthentication."""
+    
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
+
+class UserTokenRefreshSerializer(TokenRefreshSerializer):
+    """Refresh tokens with the current user claims, so profile changes reach new tokens."""
+    
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = User.objects.filter(
+            **{api_settings.USER_ID_FIELD: refresh.get(api_settings.USER_ID_CLAIM)}, is_active=True
+        ).first()
+        if user is None:
+            raise InvalidToken("User not found or inactive.")
+        
+        data = super().validate(attrs)
+        access = add_user_claims(AccessToken(data['access']), user)
+        # Access tokens copy iat from the refresh token, but their claims are new
+        access.set_iat()
+        data['access'] = str(access)
+        if 'refresh' in data:
+            data['refresh'] = str(add_user_claims(self.token_class(data['refresh']), user))
+        cache_user(user)
+        return data
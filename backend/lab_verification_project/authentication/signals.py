@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import User
+from .tokens import invalidate_user
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Make every process reload a changed or deleted user instead of trusting older tokens."""
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate_user(user_id))
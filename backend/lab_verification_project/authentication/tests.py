@@ -0,0 +1,91 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .tokens import CachedJWTAuthentication, add_user_claims, get_cache
+
+User = get_user_model()
+
+
+@override_settings(AUTH_USER_CACHE_ALIAS='default', AUTH_USER_CACHE_TTL=60)
+class CachedJWTAuthenticationTests(TestCase):
+    """Recent token claims are trusted, older tokens use the user cache, changes invalidate both."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            'teacher@example.com', password='secret-1', first_name='Teacher', last_name='One', role='teacher'
+        )
+
+    def setUp(self):
+        get_cache().clear()
+        self.authentication = CachedJWTAuthentication()
+
+    def token(self, age=0):
+        token = add_user_claims(AccessToken.for_user(self.user), self.user)
+        token['iat'] = int(time.time()) - age
+        return token
+
+    def change_user(self, **fields):
+        user = User.objects.get(pk=self.user.pk)
+        for name, value in fields.items():
+            setattr(user, name, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        return user
+
+    def test_recent_token_uses_claims(self):
+        with self.assertNumQueries(0):
+            user = self.authentication.get_user(self.token())
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(user.role, 'teacher')
+        self.assertTrue(user.is_teacher)
+
+    def test_old_token_loads_user_once(self):
+        token = self.token(age=120)
+        with self.assertNumQueries(1):
+            self.authentication.get_user(token)
+        with self.assertNumQueries(0):
+            user = self.authentication.get_user(token)
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(user.role, 'teacher')
+
+    def test_cache_holds_no_password(self):
+        self.authentication.get_user(self.token(age=120))
+        cached = get_cache().get(f"auth:user:{self.user.pk}")
+        self.assertIsInstance(cached, dict)
+        self.assertNotIn('password', cached)
+        self.assertNotIn(self.user.password, cached.values())
+
+    def test_role_change_invalidates_claims_and_cache(self):
+        recent, old = self.token(), self.token(age=120)
+        self.authentication.get_user(old)
+        self.change_user(role='student')
+
+        # The first lookup reloads the user, the second finds it cached again
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authentication.get_user(recent).role, 'student')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authentication.get_user(old).role, 'student')
+
+    def test_password_change_invalidates_claims(self):
+        recent = self.token()
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('secret-2')
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+
+        with self.assertNumQueries(1):
+            self.authentication.get_user(recent)
+
+    def test_deactivated_user_is_rejected(self):
+        recent, old = self.token(), self.token(age=120)
+        self.authentication.get_user(old)
+        self.change_user(is_active=False)
+
+        for token in (recent, old):
+            with self.assertRaises(AuthenticationFailed):
+                self.authentication.get_user(token)
@@ -0,0 +1,149 @@
+"""
+JWT authentication without a database query per request.
+
+Tokens issued by the token endpoints carry the user's email, name, role and
+group as claims. For AUTH_USER_CACHE_TTL seconds after a token was issued,
+CachedJWTAuthentication builds request.user from those claims, so
+permission checks like ``is_teacher`` need no query. Older tokens resolve
+their user from the database, which also checks that it is still active,
+and the fields of CACHED_USER_FIELDS of the loaded user are kept in the
+AUTH_USER_CACHE_ALIAS cache for the TTL. The cache is stored on disk, so it
+never holds the user instance with its password hash.
+
+Saving or deleting a user drops the cached user and marks the claims of
+tokens issued until then as stale (see signals.py). Both live in the shared
+cache, so every process sees them, and expire after the TTL, when the
+claims of those tokens are not trusted anymore anyway. A change therefore
+reaches all requests within the TTL even if its invalidation is lost.
+
+Users built from claims or the cache are not complete rows (no password, no
+flags except is_active and, for cached users, is_staff and is_superuser),
+and may be up to the TTL old. Views that save the
+user or check the password must load it with ``load_user()`` first.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+# User fields copied into token claims
+USER_CLAIMS = ('email', 'first_name', 'last_name', 'role', 'group')
+
+# User fields kept in the user cache, never the password
+CACHED_USER_FIELDS = USER_CLAIMS + ('is_active', 'is_staff', 'is_superuser')
+
+
+def add_user_claims(token, user):
+    """Store the fields that requests need about a user in a token."""
+    for field in USER_CLAIMS:
+        token[field] = getattr(user, field)
+    token['full_name'] = user.full_name
+    return token
+
+
+def _build_user(user_id, fields):
+    User = get_user_model()
+    user = User(**{api_settings.USER_ID_FIELD: user_id}, **fields)
+    # Behave like a fetched row, e.g. for comparisons and foreign keys
+    user._state.adding = False
+    return user
+
+
+def user_from_claims(token):
+    """
+    Build a user from token claims without querying the database.
+
+    Returns:
+        User or None: Unsaved-looking instance with the primary key set,
+        None if the token has no user claims
+    """
+    if any(field not in token for field in USER_CLAIMS):
+        return None
+    return _build_user(
+        token[api_settings.USER_ID_CLAIM],
+        {**{field: token[field] for field in USER_CLAIMS}, 'is_active': True},
+    )
+
+
+def load_user(user):
+    """Return a fresh database copy of a request user, e.g. before saving it."""
+    return get_user_model().objects.get(pk=user.pk)
+
+
+def get_cache():
+    """Return the cache shared by all processes for users and their changes."""
+    return caches[settings.AUTH_USER_CACHE_ALIAS]
+
+
+def _user_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def _changed_key(user_id):
+    return f"auth:changed:{user_id}"
+
+
+def cache_user(user):
+    """Cache the CACHED_USER_FIELDS of a user loaded from the database for AUTH_USER_CACHE_TTL seconds."""
+    fields = {field: getattr(user, field) for field in CACHED_USER_FIELDS}
+    try:
+        get_cache().set(_user_key(user.pk), fields, timeout=settings.AUTH_USER_CACHE_TTL)
+    except Exception as e:
+        logger.error(f"Error caching user {user.pk}: {str(e)}")
+
+
+def invalidate_user(user_id):
+    """Drop a cached user and distrust the claims of the tokens issued until now."""
+    try:
+        cache = get_cache()
+        # Only tokens younger than the TTL are trusted, so the mark can expire with it
+        cache.set(_changed_key(user_id), time.time(), timeout=settings.AUTH_USER_CACHE_TTL)
+        cache.delete(_user_key(user_id))
+    except Exception as e:
+        logger.error(f"Error invalidating cached user {user_id}: {str(e)}")
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication resolving users from recent token claims and the user cache.
+
+    Tokens older than AUTH_USER_CACHE_TTL, tokens of users changed since
+    they were issued and tokens without user claims (issued before they were
+    added) fall back to a database query, whose result is cached as well.
+    """
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        user_key, changed_key = _user_key(user_id), _changed_key(user_id)
+        try:
+            cached = get_cache().get_many([user_key, changed_key])
+        except Exception as e:
+            logger.error(f"Error reading cached user {user_id}: {str(e)}")
+            cached = {}
+
+        issued_at = validated_token.get('iat', 0)
+        changed_at = cached.get(changed_key)
+        # iat has whole seconds, a change in the same second counts as later
+        if time.time() - issued_at < settings.AUTH_USER_CACHE_TTL and (
+            changed_at is None or changed_at < issued_at
+        ):
+            user = user_from_claims(validated_token)
+            if user is not None:
+                return user
+
+        fields = cached.get(user_key)
+        if fields is not None:
+            return _build_user(user_id, fields)
+        # Raises AuthenticationFailed for missing and inactive users
+        user = super().get_user(validated_token)
+        cache_user(user)
+        return user
@@ -3,6 +3,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth import get_user_model
 from .serializers import UserSerializer, UserRegistrationSerializer, ChangePasswordSerializer
+from .tokens import load_user
 
 User = get_user_model()
 
@@ -20,7 +21,8 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_object(self):
-        return self.request.user
+        # request.user comes from the token claims or the user cache
+        return load_user(self.request.user)
 
 class ChangePasswordView(generics.UpdateAPIView):
     """View for changing password."""
@@ -29,10 +31,10 @@ class ChangePasswordView(generics.UpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def update(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
+        user = load_user(request.user)
+        serializer = self.get_serializer(data=request.data, context={'request': request, 'user': user})
         serializer.is_valid(raise_exception=True)
         
-        user = request.user
         user.set_password(serializer.validated_data['new_password'])
         user.save()
         
@@ -40,6 +40,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'lab_verification_project.api.middleware.RequestMetricsMiddleware',
+    'lab_verification_project.api.middleware.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -117,7 +119,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'lab_verification_project.authentication.tokens.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -129,8 +131,16 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_OBTAIN_SERIALIZER': 'lab_verification_project.authentication.serializers.UserTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'lab_verification_project.authentication.serializers.UserTokenRefreshSerializer',
 }
 
+# Users resolved by CachedJWTAuthentication: seconds token claims are
+# trusted and loaded users are cached, and the cache shared by all processes
+# holding them (see authentication/tokens.py)
+AUTH_USER_CACHE_TTL = 60
+AUTH_USER_CACHE_ALIAS = 'auth'
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -146,3 +156,149 @@ DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 
 # Verification settings
 VERIFICATION_TEMP_DIR = os.path.join(BASE_DIR, 'temp_verification')
+
+# Minimum similarity (0-100) of pairs reported by the similarity matrix
+VERIFICATION_SIMILARITY_THRESHOLD = 50
+
+# Maximum number of pairs returned by the similarity matrix endpoint
+VERIFICATION_SIMILARITY_MAX_PAIRS = 1000
+
+# Number of processes started by the run_verification_workers command
+VERIFICATION_WORKERS = 4
+
+# Seconds after which a running verification job is considered stale
+VERIFICATION_JOB_TIMEOUT = 600
+
+# Warm pylint processes per verifying process (0 runs pylint as a subprocess)
+VERIFICATION_PYLINT_WORKERS = 2
+
+# Files a pylint process checks before it is replaced
+VERIFICATION_PYLINT_MAX_TASKS = 500
+
+# Seconds to wait for pylint to check one file
+VERIFICATION_PYLINT_TIMEOUT = 60
+
+# Maximum number of syntax check results kept in each process's cache
+VERIFICATION_CHECK_CACHE_SIZE = 10000
+
+# Approximate memory limit of each process's syntax check cache
+VERIFICATION_CHECK_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Extra g++ flags for C++ syntax checks
+VERIFICATION_CPP_FLAGS = []
+
+# Precompiled headers for include sets shared by many C++ submissions
+VERIFICATION_CPP_PCH_ENABLED = True
+VERIFICATION_CPP_PCH_DIR = os.path.join(BASE_DIR, 'cpp_pch')
+VERIFICATION_CPP_PCH_MIN_USES = 2
+VERIFICATION_CPP_PCH_MAX = 32
+
+# Maximum number of C++ files checked in one g++ run
+VERIFICATION_CPP_BATCH_SIZE = 32
+
+# Maximum number of queued jobs of one assignment a worker claims and
+# verifies as one batch; workers claim an even share of the queue below it.
+# Bounds the time a batch runs, keep it well within VERIFICATION_JOB_TIMEOUT
+VERIFICATION_JOB_BATCH_SIZE = 20
+
+# Parallel syntax checks within one verification batch
+VERIFICATION_BULK_CONCURRENCY = 4
+
+# Default page size of the cursor-paginated API lists
+API_PAGE_SIZE = 50
+
+# Maximum number of items in one bulk comment or review request
+API_BULK_MAX_ITEMS = 500
+
+# Hand submission downloads off to the front web server: None (stream from
+# Django), 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd)
+SUBMISSION_FILE_SENDFILE = None
+
+# Internal nginx location that maps to MEDIA_ROOT for X-Accel-Redirect
+SUBMISSION_FILE_ACCEL_PREFIX = '/protected-media/'
+
+# Memory-mapped shards of previous years' submissions checked for plagiarism
+# (built with the build_corpus_index management command)
+VERIFICATION_CORPUS_DIR = os.path.join(BASE_DIR, 'corpus')
+
+# Minimum similarity and maximum number of reported corpus matches
+VERIFICATION_CORPUS_MIN_SIMILARITY = 20
+VERIFICATION_CORPUS_MAX_MATCHES = 10
+
+# Fingerprints in more than this fraction of a corpus shard's documents (and
+# in more than VERIFICATION_CORPUS_STOP_MIN_DOCS of them) are boilerplate and
+# ignored by corpus searches
+VERIFICATION_CORPUS_STOP_FRACTION = 0.01
+VERIFICATION_CORPUS_STOP_MIN_DOCS = 50
+
+# Directory where every process publishes its metrics for the /metrics
+# endpoint (None keeps metrics per process)
+METRICS_DIR = os.path.join(BASE_DIR, 'metrics')
+
+# Bearer token required to read /metrics. Without one, /metrics only
+# answers direct (not proxied) requests from METRICS_ALLOWED_IPS
+METRICS_AUTH_TOKEN = None
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+
+# Request profiling: requests with this token in the X-Profile-Token header
+# are profiled (None disables it), and a fraction of all requests is sampled
+PROFILING_TOKEN = None
+PROFILING_SAMPLE_RATE = 0.0
+
+# Where request profiles are stored (None only reports them) and how many are kept
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+PROFILING_MAX_PROFILES = 500
+
+# Number of hot functions listed in a stored profile
+PROFILING_TOP_FUNCTIONS = 25
+
+# Test case runs: parallel sandboxed programs per verifying process, the
+# Python interpreter running submissions, the C++ compile timeout in seconds,
+# the output size limit in bytes and the RLIMIT_NPROC of programs (it counts
+# every process of VERIFICATION_TEST_USER, so it must exceed the workers)
+VERIFICATION_TEST_WORKERS = os.cpu_count() or 2
+VERIFICATION_TEST_PYTHON = 'python3'
+VERIFICATION_TEST_COMPILE_TIMEOUT = 30
+VERIFICATION_TEST_OUTPUT_LIMIT = 1024 * 1024
+VERIFICATION_TEST_MAX_PROCESSES = max(64, 2 * VERIFICATION_TEST_WORKERS)
+
+# Unprivileged user sandboxed programs run as, preferably one used for
+# nothing else. Verification workers need root, or CAP_SETUID, CAP_SETGID
+# and CAP_SYS_ADMIN (for the programs' network namespace), and the user
+# must not be able to read the project directory (e.g. chmod o-rwx on it).
+# None runs programs as the server's own user, which lets them read
+# settings.py and the media; only for development.
+VERIFICATION_TEST_USER = 'nobody'
+
+# Run Python test cases in forks of a warm interpreter (a "zygote") instead
+# of starting a new interpreter per run
+VERIFICATION_TEST_ZYGOTE = True
+
+# Executables compiled from C++ submissions, keyed by source hash and reused
+# by the syntax check and the test runs; at most this many are kept
+VERIFICATION_CPP_BINARY_DIR = os.path.join(BASE_DIR, 'cpp_bin')
+VERIFICATION_CPP_BINARY_MAX = 256
+
+# Cache of API list and detail responses (see api/cache.py). The file-based
+# cache is shared by all processes of a host; a local-memory cache also
+# works but only sees the writes of its own process. Set
+# API_RESPONSE_CACHE_ALIAS to None to turn response caching off.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'api'),
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # Users and their changes for CachedJWTAuthentication; must be shared by
+    # all processes (use Redis or Memcached when there are several hosts)
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'auth'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+API_RESPONSE_CACHE_ALIAS = 'api'
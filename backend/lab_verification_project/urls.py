@@ -3,15 +3,14 @@ URL Configuration for lab_verification_project.
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
+from lab_verification_project.api.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/auth/', include('lab_verification_project.authentication.urls')),
     path('api/', include('lab_verification_project.api.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
-# Serve media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Media files are not served by URL: submission files are only readable
+# through the permission-checked /api/submissions/{id}/download/ endpoint
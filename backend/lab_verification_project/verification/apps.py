@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class VerificationConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'lab_verification_project.verification'
+    
+    def ready(self):
+        from . import signals  # noqa: F401
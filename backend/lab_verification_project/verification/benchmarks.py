@@ -0,0 +1,457 @@
+"""
+Synthetic-load benchmarks for the verification and listing paths.
+
+Synthetic assignments are generated from the seed files in docs/mock-files:
+every submission is a seed with its identifiers renamed and its top-level
+definitions reordered, which is what copied lab work usually looks like.
+Each stage is timed on a sample of the submissions and the results are
+returned as a JSON-serializable dict, so runs on different commits can be
+compared with ``compare_results``.
+
+The benchmarks never touch the configured databases, media or response
+cache: run_benchmarks creates test databases the way the test runner does,
+writes the files to a temporary MEDIA_ROOT and caches in local memory, and
+drops all of it afterwards.
+"""
+import ast
+import builtins
+import io
+import keyword
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tokenize
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings, setup_databases, teardown_databases
+from django.utils import timezone
+
+from . import result_cache, stats
+from .fingerprints import assignment_index
+from .models import Assignment, CodeFingerprint, Submission
+from .services import PlagiarismChecker, SyntaxChecker, verify_submission
+from .storage import submission_storage
+
+BENCHMARK_FORMAT_VERSION = 1
+
+DEFAULT_SEED_DIR = os.path.join(settings.BASE_DIR.parent, 'docs', 'mock-files')
+
+_PROTECTED_NAMES = frozenset(dir(builtins)) | frozenset(keyword.kwlist) | {'self', 'cls', '__name__'}
+
+
+def load_seeds(seed_dir=DEFAULT_SEED_DIR):
+    """Return the source of every Python seed file in a directory."""
+    seeds = []
+    for file_name in sorted(os.listdir(seed_dir)):
+        if file_name.endswith('.py'):
+            with open(os.path.join(seed_dir, file_name), 'r', encoding='utf-8') as f:
+                seeds.append(f.read())
+    return seeds
+
+
+def _defined_names(tree):
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            names.add(node.id)
+    return names - _PROTECTED_NAMES
+
+
+def rename_identifiers(source, rng):
+    """
+    Consistently rename the functions, classes, arguments and variables a file defines.
+
+    Args:
+        source: Python source code
+        rng: random.Random instance
+
+    Returns:
+        str: The source with renamed identifiers
+    """
+    names = _defined_names(ast.parse(source))
+    mapping = {name: f"{name}_{rng.randrange(1 << 16):04x}" for name in names}
+
+    lines = source.splitlines(keepends=True)
+    replacements = []
+    previous = None
+    for token in tokenize.generate_tokens(io.StringIO(source).readline):
+        # Attribute names are left alone, they may belong to other objects
+        if token.type == tokenize.NAME and token.string in mapping and previous != '.':
+            replacements.append((token.start, token.end, mapping[token.string]))
+        if token.type not in (tokenize.NL, tokenize.COMMENT):
+            previous = token.string
+    for (row, start), (_, end), name in reversed(replacements):
+        line = lines[row - 1]
+        lines[row - 1] = line[:start] + name + line[end:]
+    return ''.join(lines)
+
+
+def reorder_definitions(source, rng):
+    """
+    Shuffle the top-level function and class definitions of a file.
+
+    Imports and other statements keep their place, so the result still runs.
+
+    Args:
+        source: Python source code
+        rng: random.Random instance
+
+    Returns:
+        str: The source with reordered definitions
+    """
+    tree = ast.parse(source)
+    lines = source.splitlines(keepends=True)
+    blocks = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list]) - 1
+            blocks.append((start, node.end_lineno))
+    if len(blocks) < 2:
+        return source
+
+    texts = [''.join(lines[start:end]) for start, end in blocks]
+    rng.shuffle(texts)
+    result = []
+    position = 0
+    for (start, end), text in zip(blocks, texts):
+        result.extend(lines[position:start])
+        if not text.endswith('\n'):
+            text += '\n'
+        result.append(text)
+        position = end
+    result.extend(lines[position:])
+    return ''.join(result)
+
+
+def mutate_source(source, rng):
+    """Return a renamed and reordered variant of a seed file."""
+    return reorder_definitions(rename_identifiers(source, rng), rng)
+
+
+def create_assignment(size, seeds, rng):
+    """
+    Create an assignment with synthetic submissions by as many students.
+
+    Rows are bulk inserted and files are written directly to the storage,
+    so large assignments can be set up in reasonable time. The bulk insert
+    sends no signals, so the statistics are updated here.
+
+    Args:
+        size: Number of submissions
+        seeds: Seed sources, see load_seeds
+        rng: random.Random instance
+
+    Returns:
+        Assignment: The created assignment
+        User: Teacher owning the assignment
+    """
+    User = get_user_model()
+    tag = uuid.uuid4().hex[:12]
+    password = make_password(None)
+    teacher = User.objects.create(
+        email=f"bench-{tag}-teacher@bench.invalid", first_name='Benchmark', last_name='Teacher',
+        role='teacher', password=password
+    )
+    students = User.objects.bulk_create([
+        User(
+            email=f"bench-{tag}-{number}@bench.invalid", first_name='Benchmark', last_name=str(number),
+            role='student', group=f"BENCH-{number % 10}", password=password
+        )
+        for number in range(size)
+    ], batch_size=1000)
+    if not all(student.pk for student in students):
+        # Backends without RETURNING on bulk inserts
+        students = list(User.objects.filter(email__startswith=f"bench-{tag}-", role='student').order_by('id'))
+
+    assignment = Assignment.objects.create(
+        title=f"Benchmark {size} ({tag})", description='Synthetic benchmark assignment', created_by=teacher
+    )
+    submissions = []
+    for number, student in enumerate(students):
+        content = mutate_source(rng.choice(seeds), rng).encode('utf-8')
+        name = submission_storage.save(f"submissions/bench_{number}.py", ContentFile(content))
+        submissions.append(Submission(
+            student=student,
+            assignment=assignment,
+            file=name,
+            original_filename=f"lab_{number}.py",
+            content_hash=submission_storage.content_hash(name),
+        ))
+    Submission.objects.bulk_create(submissions, batch_size=1000)
+    stats.apply_delta(assignment.id, stats.add_deltas(
+        {'submission_count': size, 'student_count': size},
+        stats.status_delta(['pending'] * size),
+    ))
+    return assignment, teacher
+
+
+def delete_assignment(assignment, teacher):
+    """Delete a synthetic assignment with its students, files and fingerprints."""
+    User = get_user_model()
+    content_hashes = list(assignment.submissions.values_list('content_hash', flat=True))
+    student_ids = list(assignment.submissions.values_list('student_id', flat=True))
+    # Deleting the submissions releases their files
+    assignment.delete()
+    User.objects.filter(id__in=student_ids + [teacher.id]).delete()
+    CodeFingerprint.objects.filter(content_hash__in=content_hashes, submissions__isnull=True).delete()
+
+
+def summarize(samples):
+    """
+    Summarize timing samples.
+
+    Args:
+        samples: Durations in seconds
+
+    Returns:
+        dict: Run count and min/median/mean/p95/max in milliseconds
+    """
+    ordered = sorted(samples)
+
+    def milliseconds(value):
+        return round(value * 1000, 3)
+
+    return {
+        'runs': len(ordered),
+        'min_ms': milliseconds(ordered[0]),
+        'median_ms': milliseconds(statistics.median(ordered)),
+        'mean_ms': milliseconds(statistics.fmean(ordered)),
+        'p95_ms': milliseconds(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]),
+        'max_ms': milliseconds(ordered[-1]),
+    }
+
+
+def measure(function, arguments, before=None):
+    """
+    Time a function once per argument.
+
+    Args:
+        function: Callable taking one argument
+        arguments: Arguments of the timed calls
+        before: Optional callable run untimed before every call
+
+    Returns:
+        dict: Timing summary, see summarize
+    """
+    samples = []
+    for argument in arguments:
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        function(argument)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def measure_request(client, url, repeat):
+    """Time GET requests to an API endpoint and count their database queries."""
+    samples = []
+    queries = 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = client.get(url)
+            samples.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+        queries = len(context.captured_queries)
+    result = summarize(samples)
+    result['queries'] = queries
+    return result
+
+
+def benchmark_assignment(assignment, teacher, samples, reference_limit):
+    """
+    Time the verification stages and API endpoints on one assignment.
+
+    Args:
+        assignment: Assignment to benchmark
+        teacher: Teacher used for the API requests
+        samples: Number of submissions each stage is timed on
+        reference_limit: Maximum number of reference files passed to
+            PlagiarismChecker.check_plagiarism
+
+    Returns:
+        dict: Stage name -> timing summary
+    """
+    from rest_framework.test import APIClient
+
+    submissions = list(assignment.submissions.order_by('id'))
+    sample = submissions[:samples]
+    paths = [submission.file.path for submission in submissions]
+    references = paths[:reference_limit]
+    cache = result_cache.get_cache()
+
+    sample_paths = [submission.file.path for submission in sample]
+
+    stages = {}
+    stages['syntax_check_file'] = measure(SyntaxChecker.check_file, sample_paths, before=cache.clear)
+    for path in sample_paths:
+        SyntaxChecker.check_file(path)
+    stages['syntax_check_file_cached'] = measure(SyntaxChecker.check_file, sample_paths)
+    stages['check_plagiarism'] = measure(
+        lambda path: PlagiarismChecker.check_plagiarism(path, references),
+        sample_paths
+    )
+    # The first call also fingerprints and indexes every submission
+    stages['assignment_index_cold'] = measure(assignment_index, [assignment])
+    stages['assignment_index'] = measure(assignment_index, [assignment] * 3)
+    stages['verify_submission'] = measure(verify_submission, sample)
+    index = assignment_index(assignment)
+    stages['verify_submission_indexed'] = measure(
+        lambda submission: verify_submission(submission, index=index), sample
+    )
+
+    client = APIClient()
+    client.force_authenticate(teacher)
+    repeat = max(3, min(samples, 20))
+    hosts = list(settings.ALLOWED_HOSTS) + ['testserver']
+    # Repeated requests would be answered by the response cache after the first
+    with override_settings(ALLOWED_HOSTS=hosts, API_RESPONSE_CACHE_ALIAS=None):
+        stages['api_assignment_submissions'] = measure_request(
+            client, f"/api/assignments/{assignment.id}/submissions/", repeat
+        )
+        stages['api_submission_list'] = measure_request(client, '/api/submissions/', repeat)
+        stages['api_submission_detail'] = measure_request(
+            client, f"/api/submissions/{sample[0].id}/", repeat
+        )
+    if settings.API_RESPONSE_CACHE_ALIAS:
+        with override_settings(ALLOWED_HOSTS=hosts):
+            client.get('/api/submissions/')
+            stages['api_submission_list_cached'] = measure_request(client, '/api/submissions/', repeat)
+    return stages
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=False
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+@contextmanager
+def isolated_environment(verbosity=0):
+    """
+    Point the ORM, file storage and caches at throwaway copies for a benchmark run.
+
+    Args:
+        verbosity: Verbosity of the test database creation messages
+    """
+    media_root = tempfile.mkdtemp(prefix='benchmark-media-')
+    caches = {
+        alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f"benchmark-{alias}"}
+        for alias in settings.CACHES
+    }
+    old_config = setup_databases(verbosity, interactive=False, serialized_aliases=set())
+    try:
+        with override_settings(MEDIA_ROOT=media_root, CACHES=caches):
+            yield
+    finally:
+        teardown_databases(old_config, verbosity)
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def run_benchmarks(sizes, samples=20, reference_limit=1000, seed=0, seed_dir=DEFAULT_SEED_DIR, log=None):
+    """
+    Run the benchmark suite on synthetic assignments of the given sizes.
+
+    Args:
+        sizes: Numbers of submissions of the generated assignments
+        samples: Number of submissions each stage is timed on
+        reference_limit: Maximum number of reference files for check_plagiarism
+        seed: Random seed of the generated submissions
+        seed_dir: Directory with the seed files
+        log: Optional callable receiving progress messages
+
+    Returns:
+        dict: JSON-serializable benchmark report
+    """
+    import numpy
+
+    seeds = load_seeds(seed_dir)
+    if not seeds:
+        raise ValueError(f"No seed files found in {seed_dir}")
+
+    results = []
+    with isolated_environment():
+        for size in sizes:
+            rng = random.Random(f"{seed}-{size}")
+            start = time.perf_counter()
+            assignment, teacher = create_assignment(size, seeds, rng)
+            setup_seconds = time.perf_counter() - start
+            if log:
+                log(f"Created {size} submissions in {setup_seconds:.1f}s")
+            try:
+                stages = benchmark_assignment(assignment, teacher, min(samples, size), reference_limit)
+            finally:
+                # Keep the sizes independent of each other
+                delete_assignment(assignment, teacher)
+            results.append({
+                'size': size,
+                'setup_seconds': round(setup_seconds, 3),
+                'stages': stages,
+            })
+            if log:
+                log(f"Benchmarked {size} submissions")
+
+    return {
+        'format_version': BENCHMARK_FORMAT_VERSION,
+        'commit': _git_commit(),
+        'created_at': timezone.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': connection.vendor,
+            'numpy': numpy.__version__,
+        },
+        'parameters': {
+            'sizes': list(sizes),
+            'samples': samples,
+            'reference_limit': reference_limit,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def compare_results(baseline, current, metric='median_ms'):
+    """
+    Compare two benchmark reports stage by stage.
+
+    Args:
+        baseline: Earlier report
+        current: Report to compare with it
+        metric: Timing summary field to compare
+
+    Returns:
+        list: (size, stage, baseline value, current value, ratio) tuples for
+        every stage present in both reports
+    """
+    baseline_stages = {result['size']: result['stages'] for result in baseline['results']}
+    rows = []
+    for result in current['results']:
+        old_stages = baseline_stages.get(result['size'], {})
+        for stage, timing in result['stages'].items():
+            if stage not in old_stages:
+                continue
+            old, new = old_stages[stage][metric], timing[metric]
+            rows.append((result['size'], stage, old, new, new / old if old else None))
+    return rows
@@ -0,0 +1,89 @@
+"""
+Version keys of the data shown by cached API responses.
+
+Cached responses are keyed by the current versions of the data they show,
+so changing the data only needs a new version: responses stored under the
+old one are never read again and expire from the cache. Versions are
+random tokens in the API_RESPONSE_CACHE_ALIAS cache; a missing version
+(evicted, or the cache was cleared) simply gets a new token, which at
+worst costs cache misses.
+
+Scopes:
+    ASSIGNMENTS: Assignments, test cases and user names, which appear in
+        every cached response
+    SUBMISSIONS: All submissions and what hangs off them, for teachers
+    student_scope(id): The submissions of one student
+
+Model signals bump the versions after the transaction commits. Bulk
+queries (bulk_create, bulk_update, QuerySet.update) send no signals, so
+code using them calls bump_submissions() itself.
+"""
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+ASSIGNMENTS = 'assignments'
+SUBMISSIONS = 'submissions'
+
+
+def student_scope(student_id):
+    """Return the scope of the submissions of one student."""
+    return f"submissions:student:{student_id}"
+
+
+def get_cache():
+    """Return the response cache, None if response caching is off."""
+    if not settings.API_RESPONSE_CACHE_ALIAS:
+        return None
+    return caches[settings.API_RESPONSE_CACHE_ALIAS]
+
+
+def _version_key(scope):
+    return f"version:{scope}"
+
+
+def get_versions(scopes):
+    """
+    Return the current version of every scope, creating missing ones.
+
+    Args:
+        scopes: Scope names
+
+    Returns:
+        list: Version tokens in the order of the scopes
+    """
+    cache = get_cache()
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # add() keeps a version another process created meanwhile
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            versions[key] = cache.get(key) or uuid.uuid4().hex
+    return [versions[key] for key in keys]
+
+
+def bump(*scopes):
+    """Give scopes new versions, making the responses cached for them stale."""
+    cache = get_cache()
+    if cache is None or not scopes:
+        return
+    try:
+        cache.set_many({_version_key(scope): uuid.uuid4().hex for scope in scopes}, timeout=None)
+    except Exception as e:
+        logger.error(f"Error bumping cache versions {scopes}: {str(e)}")
+
+
+def bump_on_commit(*scopes):
+    """Bump scopes once the current transaction commits (right away outside of one)."""
+    transaction.on_commit(lambda: bump(*scopes))
+
+
+def bump_submissions(student_ids):
+    """Bump the versions of the submissions of some students."""
+    bump_on_commit(SUBMISSIONS, *(student_scope(student_id) for student_id in set(student_ids)))
@@ -0,0 +1,374 @@
+"""
+On-disk corpus of historical submissions for cross-course plagiarism search.
+
+The corpus is a set of shards under VERIFICATION_CORPUS_DIR, e.g. one per
+course or year. A shard stores one posting per (fingerprint, document) pair
+as two aligned NumPy arrays sorted by fingerprint, plus per-document arrays
+and a small JSON file naming the current generation::
+
+    <shard>/meta.json
+    <shard>/hashes-<generation>.npy        uint64, sorted
+    <shard>/docs-<generation>.npy          uint32, document of each posting
+    <shard>/sizes-<generation>.npy         uint32, postings per document
+    <shard>/assignments-<generation>.npy   int64, assignment id or 0
+    <shard>/submissions-<generation>.npy   int64, submission id or -1
+    <shard>/contents-<generation>.npy      uint8 (documents x 32), SHA-256 of
+                                           the content, zeros if unknown
+    <shard>/labels-<generation>.npy        uint8, UTF-8 labels back to back
+    <shard>/offsets-<generation>.npy       uint64, label boundaries
+    <shard>/stop-<generation>.npy          uint64, sorted stoplist
+
+All arrays are opened memory-mapped, so a query only reads the pages that
+its binary searches, matching postings and reported labels touch, however
+large the shard is.
+
+Fingerprints found in more than VERIFICATION_CORPUS_STOP_FRACTION of the
+documents of a shard (and at least VERIFICATION_CORPUS_STOP_MIN_DOCS) are
+boilerplate: starter code, common idioms. They go to the stoplist and have
+no postings, which bounds the postings a query fingerprint can expand to,
+and similarities are computed over the remaining fingerprints. A
+fingerprint stays on the stoplist when the shard grows.
+
+A shard is extended by writing a new generation of arrays and then
+atomically replacing meta.json, so readers never see a half-written shard.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .fingerprints import FINGERPRINT_VERSION
+
+logger = logging.getLogger(__name__)
+
+CORPUS_FORMAT_VERSION = 3
+
+_ARRAYS = ('hashes', 'docs', 'sizes', 'assignments', 'submissions', 'contents', 'labels', 'offsets', 'stop')
+
+_SHARD_NAME_RE = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+_shards = {}
+_shards_lock = threading.Lock()
+
+
+class CorpusShard:
+    """A memory-mapped shard of the historical corpus."""
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.meta = meta
+        arrays = _load_arrays(path, meta['generation'], mmap_mode='r')
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def label(self, doc):
+        """Return the display name of a document."""
+        start, end = int(self.offsets[doc]), int(self.offsets[doc + 1])
+        return bytes(self.labels[start:end]).decode('utf-8')
+
+    def shared_counts(self, fingerprints, exclude_assignment=None):
+        """
+        Count the fingerprints each document shares with a query.
+
+        Args:
+            fingerprints: Sorted unique uint64 array of query fingerprints,
+                without the fingerprints on the stoplist
+            exclude_assignment: Optional assignment id whose documents are skipped
+
+        Returns:
+            ndarray: Document numbers
+            ndarray: Shared fingerprint counts, aligned with the documents
+        """
+        left = np.searchsorted(self.hashes, fingerprints, side='left')
+        right = np.searchsorted(self.hashes, fingerprints, side='right')
+        lengths = right - left
+        hit = lengths > 0
+        left, lengths = left[hit], lengths[hit]
+        total = int(lengths.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        # Positions of all postings of the matched fingerprints
+        starts = np.repeat(left - np.cumsum(lengths) + lengths, lengths)
+        positions = starts + np.arange(total)
+        docs, counts = np.unique(np.asarray(self.docs[positions]), return_counts=True)
+        if exclude_assignment is not None:
+            keep = self.assignments[docs] != exclude_assignment
+            docs, counts = docs[keep], counts[keep]
+        return docs, counts
+
+
+def _shard_path(name):
+    if not _SHARD_NAME_RE.match(name):
+        raise ValueError(f"Invalid corpus shard name: {name}")
+    return os.path.join(settings.VERIFICATION_CORPUS_DIR, name)
+
+
+def _read_meta(path):
+    with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _load_arrays(path, generation, mmap_mode=None):
+    return {
+        name: np.load(os.path.join(path, f"{name}-{generation}.npy"), mmap_mode=mmap_mode)
+        for name in _ARRAYS
+    }
+
+
+def _check_meta(meta):
+    """Return why a shard cannot be used, None if it can."""
+    if meta.get('format_version') != CORPUS_FORMAT_VERSION:
+        return 'written in an older format'
+    if meta.get('fingerprint_version') != FINGERPRINT_VERSION:
+        return 'built with other fingerprints'
+    return None
+
+
+def load_shard(path):
+    """
+    Open a shard, reusing the one opened before if it has not changed.
+
+    Returns:
+        CorpusShard or None: The shard, None if it is missing or was built
+        with another fingerprint version or format
+    """
+    meta_path = os.path.join(path, 'meta.json')
+    try:
+        mtime = os.stat(meta_path).st_mtime_ns
+    except OSError:
+        return None
+
+    with _shards_lock:
+        cached = _shards.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            meta = _read_meta(path)
+            problem = _check_meta(meta)
+            if problem:
+                logger.warning(f"Skipping corpus shard {path}: {problem}, rebuild it")
+                shard = None
+            else:
+                shard = CorpusShard(path, meta)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Error loading corpus shard {path}: {str(e)}")
+            shard = None
+        _shards[path] = (mtime, shard)
+        return shard
+
+
+def get_shards():
+    """Return all usable shards of the corpus."""
+    root = settings.VERIFICATION_CORPUS_DIR
+    if not root or not os.path.isdir(root):
+        return []
+    shards = []
+    for name in sorted(os.listdir(root)):
+        shard = load_shard(os.path.join(root, name))
+        if shard is not None and len(shard):
+            shards.append(shard)
+    return shards
+
+
+def search_corpus(fingerprints, exclude_assignment=None, min_similarity=None, max_matches=None):
+    """
+    Score fingerprints against every shard of the historical corpus.
+
+    Args:
+        fingerprints: Fingerprint hashes of the checked file
+        exclude_assignment: Optional assignment id whose documents are skipped
+            (they are checked live against the assignment index)
+        min_similarity: Minimum reported similarity, defaults to
+            VERIFICATION_CORPUS_MIN_SIMILARITY
+        max_matches: Maximum number of reported matches, defaults to
+            VERIFICATION_CORPUS_MAX_MATCHES
+
+    Returns:
+        list: ((shard name, document number), similarity) tuples sorted by
+        descending similarity
+        dict: Match key -> display name
+    """
+    if min_similarity is None:
+        min_similarity = settings.VERIFICATION_CORPUS_MIN_SIMILARITY
+    if max_matches is None:
+        max_matches = settings.VERIFICATION_CORPUS_MAX_MATCHES
+
+    query = np.unique(np.fromiter(fingerprints, dtype=np.uint64))
+    if not len(query):
+        return [], {}
+
+    matches = []
+    labels = {}
+    for shard in get_shards():
+        # Boilerplate fingerprints count neither as shared nor in the sizes
+        stopped = np.isin(query, shard.stop, assume_unique=True)
+        shard_query = query[~stopped]
+        if not len(shard_query):
+            continue
+        docs, shared = shard.shared_counts(shard_query, exclude_assignment)
+        if not len(docs):
+            continue
+        sizes = np.asarray(shard.sizes[docs], dtype=np.int64)
+        # Jaccard similarity, as for the assignment index
+        similarities = shared / (len(shard_query) + sizes - shared) * 100
+        for doc in np.flatnonzero(similarities >= min_similarity):
+            key = (shard.name, int(docs[doc]))
+            matches.append((key, float(similarities[doc])))
+            labels[key] = f"{shard.label(key[1])} [{shard.name}]"
+
+    matches.sort(key=lambda match: match[1], reverse=True)
+    matches = matches[:max_matches]
+    return matches, {key: labels[key] for key, _ in matches}
+
+
+def _write_array(path, array):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, array)
+    os.replace(temp_path, path)
+
+
+def stoplist_size(document_count):
+    """Return the number of documents above which a fingerprint is boilerplate."""
+    return max(
+        settings.VERIFICATION_CORPUS_STOP_MIN_DOCS,
+        int(document_count * settings.VERIFICATION_CORPUS_STOP_FRACTION),
+    )
+
+
+def write_shard(name, documents, fingerprint_arrays, append=True):
+    """
+    Create a shard or add documents to it.
+
+    Args:
+        name: Shard name, e.g. a course or year
+        documents: Metadata dict of each new document; needs a 'label' and
+            may carry 'submission_id', 'assignment_id' and 'content_hash'
+            (SHA-256 hex digest of the content)
+        fingerprint_arrays: Fingerprint array of each new document
+        append: Keep the documents already in the shard
+
+    Returns:
+        int: Number of documents in the shard
+    """
+    path = _shard_path(name)
+    os.makedirs(path, exist_ok=True)
+
+    old_meta = _read_meta(path) if os.path.exists(os.path.join(path, 'meta.json')) else None
+    if append and old_meta is not None:
+        problem = _check_meta(old_meta)
+        if problem:
+            raise ValueError(f"Shard {name} was {problem}, rebuild it without appending")
+        old = _load_arrays(path, old_meta['generation'])
+    else:
+        old = {
+            'hashes': np.empty(0, dtype=np.uint64), 'docs': np.empty(0, dtype=np.uint32),
+            'assignments': np.empty(0, dtype=np.int64), 'submissions': np.empty(0, dtype=np.int64),
+            'contents': np.empty((0, 32), dtype=np.uint8), 'labels': np.empty(0, dtype=np.uint8),
+            'offsets': np.zeros(1, dtype=np.uint64), 'stop': np.empty(0, dtype=np.uint64),
+        }
+    old_count = len(old['offsets']) - 1
+    stop = old['stop']
+
+    hashes = [old['hashes']]
+    docs = [old['docs']]
+    for number, fingerprints in enumerate(fingerprint_arrays, start=old_count):
+        fingerprints = np.unique(np.asarray(fingerprints, dtype=np.uint64))
+        fingerprints = fingerprints[~np.isin(fingerprints, stop, assume_unique=True)]
+        hashes.append(fingerprints)
+        docs.append(np.full(len(fingerprints), number, dtype=np.uint32))
+    hashes = np.concatenate(hashes)
+    docs = np.concatenate(docs)
+    order = np.argsort(hashes, kind='stable')
+    hashes, docs = hashes[order], docs[order]
+
+    # Move fingerprints that have become boilerplate to the stoplist
+    document_count = old_count + len(documents)
+    distinct, counts = np.unique(hashes, return_counts=True)
+    common = counts > stoplist_size(document_count)
+    if common.any():
+        stop = np.union1d(stop, distinct[common])
+        keep = np.repeat(~common, counts)
+        hashes, docs = hashes[keep], docs[keep]
+
+    labels = [document['label'].encode('utf-8') for document in documents]
+    offsets = np.concatenate((
+        old['offsets'],
+        old['offsets'][-1] + np.cumsum([len(label) for label in labels], dtype=np.uint64),
+    ))
+    arrays = {
+        'hashes': hashes,
+        'docs': docs,
+        'sizes': np.bincount(docs, minlength=document_count).astype(np.uint32),
+        'assignments': np.concatenate((old['assignments'], np.array(
+            [document.get('assignment_id') or 0 for document in documents], dtype=np.int64
+        ))),
+        'submissions': np.concatenate((old['submissions'], np.array(
+            [document.get('submission_id') or -1 for document in documents], dtype=np.int64
+        ))),
+        'contents': np.concatenate((old['contents'], np.frombuffer(b''.join(
+            bytes.fromhex(document.get('content_hash') or '').ljust(32, b'\0') for document in documents
+        ), dtype=np.uint8).reshape(-1, 32))),
+        'labels': np.concatenate((old['labels'], np.frombuffer(b''.join(labels), dtype=np.uint8))),
+        'offsets': offsets,
+        'stop': stop,
+    }
+
+    generation = old_meta['generation'] + 1 if old_meta is not None else 1
+    for array_name, array in arrays.items():
+        _write_array(os.path.join(path, f"{array_name}-{generation}.npy"), array)
+
+    meta = {
+        'format_version': CORPUS_FORMAT_VERSION,
+        'fingerprint_version': FINGERPRINT_VERSION,
+        'generation': generation,
+        'document_count': document_count,
+    }
+    fd, temp_path = tempfile.mkstemp(dir=path, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(temp_path, os.path.join(path, 'meta.json'))
+
+    # Readers that still map the old generation keep it until they reload
+    for file_name in os.listdir(path):
+        match = re.match(r'^[a-z]+-(\d+)\.npy$', file_name)
+        if match and int(match.group(1)) != generation:
+            os.remove(os.path.join(path, file_name))
+    return document_count
+
+
+def _stored_array(name, array_name):
+    """Return an array of the current generation of a shard, None if the shard cannot be appended to."""
+    path = _shard_path(name)
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return None
+    meta = _read_meta(path)
+    if _check_meta(meta):
+        return None
+    return np.load(os.path.join(path, f"{array_name}-{meta['generation']}.npy"), mmap_mode='r')
+
+
+def shard_submission_ids(name):
+    """Return the ids of the submissions already stored in a shard."""
+    submissions = _stored_array(name, 'submissions')
+    if submissions is None:
+        return set()
+    return set(int(submission_id) for submission_id in submissions[submissions >= 0])
+
+
+def shard_content_hashes(name):
+    """Return the SHA-256 hex digests of the document contents already stored in a shard."""
+    contents = _stored_array(name, 'contents')
+    if contents is None:
+        return set()
+    return set(bytes(row).hex() for row in contents[np.any(contents, axis=1)])
@@ -0,0 +1,431 @@
+"""
+Fast C++ syntax checking with precompiled headers and batched g++ runs.
+
+Almost all of the time of ``g++ -fsyntax-only`` on a student file goes into
+parsing standard library headers. Files are grouped by the exact set of
+``<...>`` headers they include; a precompiled header is built for every
+include set that keeps coming back and forced in with ``-include``, so the
+headers are parsed once per set instead of once per file. Files of a group
+are checked in one compiler invocation and the diagnostics are split back
+per file.
+
+Precompiled headers are evicted least recently used first, by the mtime
+that every use refreshes. A check holds a shared lock on the header's
+directory while it compiles with it, and eviction skips headers it cannot
+lock exclusively, so a header is never removed while a compiler reads it.
+
+Compiler failures that say nothing about the checked file (crashes, killed
+compilers, invalid precompiled headers) are reported as "Error checking
+syntax: ..." so that they are not cached as results of the file, and
+compile_binary raises CompilerError for them.
+
+Executables built for running test cases are cached by source hash, so a
+program compiled once (by the syntax check of a verification or by an
+earlier identical submission) is never compiled again.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import metrics
+from .result_cache import checker_version
+
+logger = logging.getLogger(__name__)
+
+COMPILER = 'g++'
+
+_INCLUDE_RE = re.compile(r'^[ \t]*#[ \t]*include[ \t]*([<"])([^>"\n]+)[>"]', re.MULTILINE)
+_HEADER_NAME_RE = re.compile(r'^[A-Za-z0-9_./+-]+$')
+_ERROR_RE = re.compile(r'\b(?:fatal )?error:')
+_INFRASTRUCTURE_ERROR_RE = re.compile(
+    r'internal compiler error|Killed signal terminated program|No space left on device'
+    r'|virtual memory exhausted|out of memory allocating|one or more PCH files were found, but they were invalid'
+)
+
+# Flags added to the configured ones when building executables
+BUILD_FLAGS = ['-O2']
+
+# How often each include set was seen by this process
+_include_set_uses = Counter()
+_pch_lock = threading.Lock()
+
+# Builds of the same source wait for each other, different sources do not
+_build_locks = [threading.Lock() for _ in range(16)]
+
+
+class CompilerError(RuntimeError):
+    """Raised when the compiler fails for reasons unrelated to the compiled file."""
+
+
+def _infrastructure_error(result):
+    """Return whether a compiler run failed for reasons unrelated to its input files."""
+    return result.returncode < 0 or bool(_INFRASTRUCTURE_ERROR_RE.search(result.stderr))
+
+
+def include_set(source):
+    """
+    Return the standard headers a file includes, if it can use a precompiled header.
+
+    Args:
+        source: C++ source code as a string
+
+    Returns:
+        tuple or None: Sorted header names, None if the file includes local
+        headers or includes nothing
+    """
+    headers = set()
+    for delimiter, name in _INCLUDE_RE.findall(source):
+        name = name.strip()
+        if delimiter == '"' or not _HEADER_NAME_RE.match(name):
+            return None
+        headers.add(name)
+    return tuple(sorted(headers)) or None
+
+
+def _compiler_flags():
+    return list(settings.VERIFICATION_CPP_FLAGS)
+
+
+def cache_options(*flags):
+    """
+    Return the result cache options of a g++ run.
+
+    Args:
+        flags: Flags of the run besides VERIFICATION_CPP_FLAGS
+
+    Returns:
+        str: Every flag of the run, VERIFICATION_CPP_FLAGS included
+    """
+    return json.dumps(_compiler_flags() + list(flags))
+
+
+def _pch_dir(headers):
+    key = hashlib.sha256('\n'.join(
+        [checker_version(COMPILER), cache_options()] + list(headers)
+    ).encode('utf-8')).hexdigest()[:32]
+    return os.path.join(settings.VERIFICATION_CPP_PCH_DIR, key)
+
+
+def _open_lock(directory):
+    return os.open(os.path.join(directory, 'lock'), os.O_RDWR | os.O_CREAT, 0o644)
+
+
+def _evict_old_headers(keep=None):
+    """
+    Remove the least recently used precompiled headers above the limit, skipping those in use.
+
+    Args:
+        keep: Optional directory of a header about to be used, never removed
+    """
+    root = settings.VERIFICATION_CPP_PCH_DIR
+    entries = []
+    for name in os.listdir(root):
+        gch = os.path.join(root, name, 'pch.h.gch')
+        try:
+            entries.append((os.path.getmtime(gch), os.path.join(root, name)))
+        except OSError:
+            continue
+    entries.sort()
+    excess = len(entries) - settings.VERIFICATION_CPP_PCH_MAX
+    for _, path in entries:
+        if excess <= 0:
+            break
+        if path == keep:
+            continue
+        try:
+            fd = _open_lock(path)
+        except OSError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # A compiler is using it
+            os.close(fd)
+            continue
+        try:
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+            os.rmdir(path)
+            excess -= 1
+        except OSError as e:
+            logger.error(f"Error evicting precompiled header {path}: {str(e)}")
+        finally:
+            os.close(fd)
+
+
+@contextmanager
+def _locked_header(header_path):
+    """
+    Hold a shared lock on a precompiled header while it is used.
+
+    Yields:
+        str or None: The header path, None if it was evicted meanwhile
+    """
+    directory = os.path.dirname(header_path)
+    try:
+        fd = _open_lock(directory)
+    except OSError:
+        yield None
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        try:
+            # The lock only protects the directory if its lock file is still ours
+            current = os.stat(os.path.join(directory, 'lock')).st_ino == os.fstat(fd).st_ino
+            if current:
+                # Mark as recently used for the eviction
+                os.utime(header_path + '.gch')
+        except OSError:
+            current = False
+        yield header_path if current else None
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def precompiled_header(headers, uses=1):
+    """
+    Use the header to force-include for an include set, building it if due.
+
+    A precompiled header is only built once an include set has been seen
+    VERIFICATION_CPP_PCH_MIN_USES times, so one-off include sets do not
+    fill the disk. It cannot be evicted until the with block ends.
+
+    Args:
+        headers: Sorted tuple of standard header names
+        uses: Number of files about to be checked with this include set
+
+    Yields:
+        str or None: Path to pass to ``-include``, None to compile without
+    """
+    header_path = _build_header(headers, uses)
+    if header_path is None:
+        yield None
+        return
+    with _locked_header(header_path) as locked_path:
+        yield locked_path
+
+
+def _build_header(headers, uses):
+    """Return the precompiled header of an include set, building it if due, or None."""
+    if not settings.VERIFICATION_CPP_PCH_ENABLED or not headers:
+        return None
+
+    directory = _pch_dir(headers)
+    header_path = os.path.join(directory, 'pch.h')
+    if os.path.exists(header_path + '.gch'):
+        return header_path
+
+    with _pch_lock:
+        _include_set_uses[headers] += uses
+        if _include_set_uses[headers] < settings.VERIFICATION_CPP_PCH_MIN_USES:
+            return None
+        if os.path.exists(header_path + '.gch'):
+            return header_path
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(header_path, 'w', encoding='utf-8') as f:
+                f.writelines(f"#include <{name}>\n" for name in headers)
+            # Build next to the target and rename, so concurrent workers never
+            # see a half-written precompiled header
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.gch.tmp')
+            os.close(fd)
+            with metrics.stage('precompiled_header'):
+                result = subprocess.run(
+                    [COMPILER, *_compiler_flags(), '-x', 'c++-header', header_path, '-o', temp_path],
+                    capture_output=True,
+                    text=True,
+                    check=False
+                )
+            if result.returncode != 0:
+                os.remove(temp_path)
+                logger.error(f"Error building precompiled header for {headers}: {result.stderr}")
+                return None
+            os.replace(temp_path, header_path + '.gch')
+            _evict_old_headers(keep=directory)
+        except OSError as e:
+            logger.error(f"Error building precompiled header for {headers}: {str(e)}")
+            return None
+    return header_path
+
+
+def split_diagnostics(output, file_paths):
+    """
+    Split the diagnostics of a multi-file compiler run per input file.
+
+    Args:
+        output: Compiler stderr
+        file_paths: Paths of the compiled files, as passed to the compiler
+
+    Returns:
+        dict: File path -> its diagnostics
+        str: Diagnostics that could not be attributed to a file
+    """
+    chunks = defaultdict(list)
+    unattributed = []
+    current = None
+    prefixes = sorted(file_paths, key=len, reverse=True)
+    for line in output.splitlines(keepends=True):
+        text = line
+        if text.startswith('In file included from '):
+            text = text[len('In file included from '):]
+        for path in prefixes:
+            if text.startswith(path + ':'):
+                current = path
+                break
+        if current is None:
+            unattributed.append(line)
+        else:
+            chunks[current].append(line)
+    return {path: ''.join(lines) for path, lines in chunks.items()}, ''.join(unattributed)
+
+
+def _run_group(file_paths, pch_header):
+    command = [COMPILER, *_compiler_flags(), '-fsyntax-only']
+    if pch_header:
+        command += ['-include', pch_header]
+    with metrics.stage('gxx'):
+        result = subprocess.run(command + list(file_paths), capture_output=True, text=True, check=False)
+
+    if len(file_paths) == 1:
+        path = file_paths[0]
+        if _infrastructure_error(result):
+            return {path: (False, f"Error checking syntax: {result.stderr}")}
+        return {path: (result.returncode == 0, result.stderr)}
+
+    chunks, unattributed = split_diagnostics(result.stderr, file_paths)
+    if _infrastructure_error(result) or result.returncode != 0 and (unattributed.strip() or not any(
+            _ERROR_RE.search(chunk) for chunk in chunks.values())):
+        # The failure cannot be pinned on a file, check them one by one
+        results = {}
+        for path in file_paths:
+            results.update(_run_group([path], pch_header))
+        return results
+
+    return {
+        path: (not _ERROR_RE.search(chunks.get(path, '')), chunks.get(path, ''))
+        for path in file_paths
+    }
+
+
+def check_files(file_paths):
+    """
+    Syntax-check C++ files, batching files that include the same headers.
+
+    Args:
+        file_paths: Paths to C++ files
+
+    Returns:
+        dict: File path -> (passed, compiler output); compiler failures
+        unrelated to a file give (False, "Error checking syntax: ...")
+    """
+    groups = defaultdict(list)
+    for path in dict.fromkeys(file_paths):
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                headers = include_set(f.read())
+        except OSError:
+            headers = None
+        groups[headers].append(path)
+
+    batch_size = settings.VERIFICATION_CPP_BATCH_SIZE
+    results = {}
+    for headers, paths in groups.items():
+        with precompiled_header(headers, len(paths)) as pch_header:
+            for start in range(0, len(paths), batch_size):
+                results.update(_run_group(paths[start:start + batch_size], pch_header))
+    return results
+
+
+def _binary_path(source):
+    key = hashlib.sha256(b'\n'.join([
+        checker_version(COMPILER).encode('utf-8'),
+        cache_options(*BUILD_FLAGS).encode('utf-8'),
+        source,
+    ])).hexdigest()
+    return os.path.join(settings.VERIFICATION_CPP_BINARY_DIR, key)
+
+
+def _evict_old_binaries():
+    """Remove the least recently used executables above the limit."""
+    root = settings.VERIFICATION_CPP_BINARY_DIR
+    entries = []
+    for name in os.listdir(root):
+        if '.' not in name:
+            entries.append((os.path.getmtime(os.path.join(root, name)), name))
+    entries.sort()
+    for _, name in entries[:max(0, len(entries) - settings.VERIFICATION_CPP_BINARY_MAX)]:
+        for path in (os.path.join(root, name), os.path.join(root, name + '.log')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def compile_binary(file_path, timeout=None):
+    """
+    Compile a C++ file into an executable, reusing the one built for identical source.
+
+    Args:
+        file_path: Path to the C++ file
+        timeout: Seconds the compiler may run, raises subprocess.TimeoutExpired
+
+    Returns:
+        str or None: Path of the cached executable, None if compilation failed
+        str: Compiler diagnostics
+
+    Raises:
+        CompilerError: If the compiler failed for reasons unrelated to the file
+    """
+    with open(file_path, 'rb') as f:
+        source = f.read()
+    binary_path = _binary_path(source)
+    log_path = binary_path + '.log'
+
+    with _build_locks[int(os.path.basename(binary_path)[:4], 16) % len(_build_locks)]:
+        if os.path.exists(binary_path):
+            # Mark as recently used for the eviction
+            os.utime(binary_path)
+            try:
+                with open(log_path, 'r', encoding='utf-8') as f:
+                    return binary_path, f.read()
+            except OSError:
+                return binary_path, ''
+
+        os.makedirs(settings.VERIFICATION_CPP_BINARY_DIR, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=settings.VERIFICATION_CPP_BINARY_DIR, suffix='.tmp')
+        os.close(fd)
+        try:
+            with metrics.stage('gxx_build'):
+                result = subprocess.run(
+                    [COMPILER, *_compiler_flags(), *BUILD_FLAGS, '-o', temp_path, file_path],
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout,
+                    check=False
+                )
+            if _infrastructure_error(result):
+                raise CompilerError(f"Compiler failed: {result.stderr.strip()}")
+            if result.returncode != 0:
+                return None, result.stderr
+            with open(log_path, 'w', encoding='utf-8') as f:
+                f.write(result.stderr)
+            os.chmod(temp_path, 0o555)
+            # Concurrent workers only ever see complete executables
+            os.replace(temp_path, binary_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        _evict_old_binaries()
+    return binary_path, result.stderr
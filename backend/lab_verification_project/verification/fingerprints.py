@@ -0,0 +1,324 @@
+"""
+Persistent store of per-submission similarity data.
+
+Each distinct file content is tokenized and fingerprinted once; the result
+is saved in a CodeFingerprint row keyed by the SHA-256 of the content, the
+lexer language and the fingerprint algorithm version. Plagiarism checks
+read these rows instead of re-reading every reference file from disk.
+
+The fingerprints of every submission are also stored as FingerprintPosting
+rows, one per hash, which form the inverted index of its assignment (see
+AssignmentIndex). They are written whenever a submission gets a new
+fingerprint, so scoring a submission queries the postings of its own hashes
+instead of rebuilding the index from every submission of the assignment.
+"""
+import hashlib
+import logging
+import sys
+from array import array
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, OuterRef, Q
+
+from .lexer import detect_language, tokenize_code
+from .models import CodeFingerprint, FingerprintPosting, Submission
+from .winnowing import K_GRAM_SIZE, TOKEN_K_GRAM_SIZE, fingerprint_symbols, jaccard_similarity, normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever tokenization or fingerprint selection changes
+FINGERPRINT_VERSION = 2
+
+
+def hash_content(content):
+    """Return the SHA-256 hex digest of file content."""
+    return hashlib.sha256(content).hexdigest()
+
+
+def _pack(typecode, values):
+    packed = array(typecode, values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(typecode, data):
+    unpacked = array(typecode)
+    unpacked.frombytes(bytes(data))
+    if sys.byteorder == 'big':
+        unpacked.byteswap()
+    return unpacked
+
+
+def pack_tokens(tokens):
+    """Pack a token stream into little-endian 32-bit integers."""
+    return _pack('I', tokens)
+
+
+def unpack_tokens(data):
+    """Unpack a token stream packed with pack_tokens."""
+    return _unpack('I', data)
+
+
+def pack_fingerprints(fingerprints):
+    """Pack fingerprint hashes into sorted little-endian 64-bit integers."""
+    return _pack('Q', sorted(fingerprints))
+
+
+def unpack_fingerprints(data):
+    """Unpack fingerprint hashes packed with pack_fingerprints."""
+    return _unpack('Q', data)
+
+
+def tokenize_content(content, language=None):
+    """
+    Turn raw file content into the normalized token stream.
+
+    Supported languages are lexed into normalized integer tokens; other
+    files fall back to their whitespace-free character stream.
+
+    Args:
+        content: File content as bytes
+        language: Lexer language (see lexer.detect_language) or None
+
+    Returns:
+        list: Sequence of integer tokens
+    """
+    source = content.decode('utf-8', errors='replace')
+    if language:
+        return tokenize_code(source, language)
+    return normalize_text(source)
+
+
+def compute_fingerprints(tokens, language=None):
+    """Return the winnowing fingerprints of a token stream."""
+    k = TOKEN_K_GRAM_SIZE if language else K_GRAM_SIZE
+    return fingerprint_symbols(tokens, k)
+
+
+def fingerprint_file(file_path):
+    """
+    Compute the fingerprints of a file on disk without storing them.
+
+    Args:
+        file_path: Path to the file
+
+    Returns:
+        frozenset: Fingerprint hashes
+    """
+    language = detect_language(file_path)
+    with open(file_path, 'rb') as f:
+        tokens = tokenize_content(f.read(), language)
+    return compute_fingerprints(tokens, language)
+
+
+def get_or_create_fingerprint(content, language=None, content_hash=None):
+    """
+    Return the stored fingerprint of file content, computing it if needed.
+
+    Args:
+        content: File content as bytes
+        language: Lexer language (see lexer.detect_language) or None
+        content_hash: Optional precomputed SHA-256 of the content
+
+    Returns:
+        CodeFingerprint: Stored fingerprint for the current version
+    """
+    content_hash = content_hash or hash_content(content)
+    language = language or ''
+    lookup = {'content_hash': content_hash, 'version': FINGERPRINT_VERSION, 'language': language}
+    existing = CodeFingerprint.objects.filter(**lookup).first()
+    if existing:
+        return existing
+
+    tokens = tokenize_content(content, language)
+    fingerprint = CodeFingerprint(
+        tokens=pack_tokens(tokens),
+        fingerprints=pack_fingerprints(compute_fingerprints(tokens, language)),
+        **lookup
+    )
+    try:
+        with transaction.atomic():
+            fingerprint.save()
+    except IntegrityError:
+        # Another worker stored the same content concurrently
+        return CodeFingerprint.objects.get(**lookup)
+    return fingerprint
+
+
+def get_submission_fingerprint(submission):
+    """
+    Return the stored fingerprint of a submission, computing it on first use.
+
+    The file is only read when no fingerprint of the current version is
+    stored for its content yet; identical uploads share one fingerprint.
+
+    Args:
+        submission: Submission model instance
+
+    Returns:
+        CodeFingerprint or None: Stored fingerprint, None if the file is unreadable
+    """
+    language = detect_language(submission.file.name) or ''
+    current = submission.fingerprint
+    if current is not None and current.version == FINGERPRINT_VERSION and current.language == language:
+        return current
+
+    try:
+        fingerprint = None
+        # Known content (stored hash, or an older algorithm version): reuse
+        # the fingerprint if any submission with that content has one
+        content_hash = submission.content_hash or (current.content_hash if current else '')
+        if content_hash:
+            fingerprint = CodeFingerprint.objects.filter(
+                content_hash=content_hash, version=FINGERPRINT_VERSION, language=language
+            ).first()
+        if fingerprint is None:
+            with submission.file.open('rb') as f:
+                content = f.read()
+            fingerprint = get_or_create_fingerprint(content, language)
+    except Exception as e:
+        logger.error(f"Error fingerprinting submission {submission.id}: {str(e)}")
+        # Postings of a replaced file must not match anymore
+        FingerprintPosting.objects.filter(submission_id=submission.pk).delete()
+        return None
+
+    with transaction.atomic():
+        submission.fingerprint = fingerprint
+        type(submission).objects.filter(pk=submission.pk).update(fingerprint=fingerprint)
+        index_submission(submission, fingerprint)
+    return fingerprint
+
+
+def _signed(hashes):
+    """Map unsigned 64-bit hashes to the signed values stored in FingerprintPosting.hash."""
+    return [value - (1 << 64) if value >= 1 << 63 else value for value in hashes]
+
+
+def index_submission(submission, fingerprint):
+    """
+    Replace the postings of a submission with the hashes of a fingerprint.
+
+    Args:
+        submission: Submission model instance
+        fingerprint: Its CodeFingerprint
+    """
+    with transaction.atomic():
+        FingerprintPosting.objects.filter(submission_id=submission.pk).delete()
+        # Concurrent indexing of the same submission stores the same rows
+        FingerprintPosting.objects.bulk_create([
+            FingerprintPosting(assignment_id=submission.assignment_id, submission_id=submission.pk, hash=value)
+            for value in _unpack('q', fingerprint.fingerprints)
+        ], ignore_conflicts=True)
+
+
+def index_assignment(assignment):
+    """
+    Index the submissions of an assignment that have no current postings.
+
+    Submissions are indexed when they are fingerprinted, so this only finds
+    submissions fingerprinted before the index existed, with an older
+    fingerprint version or with unreadable files. Costs one query otherwise.
+
+    Args:
+        assignment: Assignment model instance
+
+    Returns:
+        int: Number of indexed submissions
+    """
+    has_postings = Exists(FingerprintPosting.objects.filter(submission=OuterRef('pk')))
+    stale = (
+        assignment.submissions
+        .select_related('fingerprint').defer('fingerprint__tokens')
+        .filter(
+            Q(fingerprint__isnull=True)
+            | ~Q(fingerprint__version=FINGERPRINT_VERSION)
+            # Empty fingerprints (tiny files) have no postings to look for
+            | (~Q(fingerprint__fingerprints=b'') & ~has_postings)
+        )
+    )
+    indexed = 0
+    for submission in stale:
+        previous = submission.fingerprint_id
+        fingerprint = get_submission_fingerprint(submission)
+        if fingerprint is None:
+            continue
+        if fingerprint.id == previous:
+            # Unchanged fingerprints are not indexed by get_submission_fingerprint
+            index_submission(submission, fingerprint)
+        indexed += 1
+    return indexed
+
+
+def assignment_index(assignment):
+    """Bring the index of an assignment up to date and return it."""
+    index_assignment(assignment)
+    return AssignmentIndex(assignment.id)
+
+
+class AssignmentIndex:
+    """
+    Inverted index of the submissions of an assignment, stored as FingerprintPosting rows.
+
+    Has the query interface of winnowing.FingerprintIndex, keyed by
+    submission id. A query costs two grouped queries over the postings of
+    the query's hashes and of the matched submissions.
+    """
+
+    def __init__(self, assignment_id):
+        self.assignment_id = assignment_id
+
+    def shared_counts(self, fingerprints, exclude=None):
+        """
+        Count the fingerprints each indexed submission shares with a query.
+
+        Args:
+            fingerprints: Fingerprint hashes of the query document
+            exclude: Optional submission id to leave out of the result
+
+        Returns:
+            dict: Submission id -> number of shared fingerprints
+        """
+        hashes = _signed(set(fingerprints))
+        if not hashes:
+            return {}
+        postings = FingerprintPosting.objects.filter(assignment_id=self.assignment_id, hash__in=hashes)
+        if exclude is not None:
+            postings = postings.exclude(submission_id=exclude)
+        return dict(
+            postings.values('submission_id').annotate(shared=Count('id')).values_list('submission_id', 'shared')
+        )
+
+    def sizes(self, submission_ids):
+        """Return submission id -> number of indexed fingerprints of these submissions."""
+        return dict(
+            FingerprintPosting.objects.filter(submission_id__in=submission_ids)
+            .values('submission_id').annotate(size=Count('id')).values_list('submission_id', 'size')
+        )
+
+    def query(self, fingerprints, exclude=None):
+        """
+        Score a document against every indexed submission it overlaps with.
+
+        Args:
+            fingerprints: Fingerprint hashes of the query document
+            exclude: Optional submission id to leave out of the result
+
+        Returns:
+            list: (submission id, similarity) tuples sorted by descending similarity
+        """
+        fingerprints = frozenset(fingerprints)
+        shared_counts = self.shared_counts(fingerprints, exclude)
+        sizes = self.sizes(shared_counts)
+        matches = [
+            (submission_id, jaccard_similarity(shared, len(fingerprints), sizes[submission_id]))
+            for submission_id, shared in shared_counts.items()
+        ]
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches
+
+    @staticmethod
+    def labels(submission_ids):
+        """Return submission id -> file name of these submissions, for reporting."""
+        submissions = Submission.objects.filter(id__in=submission_ids).only('id', 'original_filename', 'file')
+        return {submission.id: submission.filename for submission in submissions}
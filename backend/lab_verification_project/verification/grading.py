@@ -0,0 +1,329 @@
+"""
+Correctness grading of submissions against the test cases of their assignment.
+
+A submission is prepared once (C++ is compiled into the binary cache,
+Python is compile-checked) and then run on every test case in the sandbox
+zygote; Python programs run in forks of its warm interpreter when
+VERIFICATION_TEST_ZYGOTE is set. Runs of all verifications
+in a process share one thread pool of VERIFICATION_TEST_WORKERS threads;
+each thread only waits for its sandboxed child process, so the pool size is
+the number of programs running on the machine's cores at the same time.
+
+Programs run as VERIFICATION_TEST_USER, each run in a run directory of its
+own inside the verification's work directory. Executables and scripts the
+program is started from are copied into the work directory, so that user
+needs no access to the media or the binary cache; the zygote reads scripts
+before switching users.
+"""
+import logging
+import os
+import pwd
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+
+from django.conf import settings
+
+from . import cpp_checker
+from .sandbox import PythonZygote
+
+logger = logging.getLogger(__name__)
+
+CPP_EXTENSIONS = ('.cpp', '.cc', '.cxx', '.c++')
+
+# Runs the script named by the first argument as __main__, like the zygote,
+# opening it by that path (the interpreter and runpy make it absolute)
+RUN_RELATIVE_SCRIPT = (
+    "import sys, types\n"
+    "del sys.argv[0]\n"
+    "with open(sys.argv[0], 'rb') as f:\n"
+    "    code = compile(f.read(), sys.argv[0], 'exec', dont_inherit=True)\n"
+    "main = sys.modules['__main__'] = types.ModuleType('__main__')\n"
+    "main.__file__ = sys.argv[0]\n"
+    "exec(code, main.__dict__)\n"
+)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+_zygote = None
+_zygote_pid = None
+_zygote_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process-wide pool running test cases."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.VERIFICATION_TEST_WORKERS, thread_name_prefix='test-runner'
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def get_zygote():
+    """
+    Return the process-wide sandbox zygote, starting a new one if it exited.
+
+    Raises:
+        SandboxError: If programs cannot be sandboxed
+    """
+    global _zygote, _zygote_pid
+    user = sandbox_user()
+    with _zygote_lock:
+        if _zygote is None or _zygote_pid != os.getpid() or not _zygote.alive() or _zygote.user != user:
+            _zygote = None
+            _zygote = PythonZygote(settings.VERIFICATION_TEST_PYTHON, user)
+            _zygote_pid = os.getpid()
+        return _zygote
+
+
+def close_zygote():
+    """Stop the zygote of this process if it is running."""
+    global _zygote, _zygote_pid
+    with _zygote_lock:
+        if _zygote is not None and _zygote_pid == os.getpid():
+            _zygote.close()
+        _zygote = None
+        _zygote_pid = None
+
+
+def check_sandbox():
+    """
+    Make sure test programs can be sandboxed, e.g. when a worker starts.
+
+    Raises:
+        SandboxError: If they cannot, with the reason
+        KeyError: If VERIFICATION_TEST_USER does not exist
+    """
+    get_zygote()
+
+
+@lru_cache(maxsize=None)
+def _lookup_user(name):
+    entry = pwd.getpwnam(name)
+    return entry.pw_uid, entry.pw_gid
+
+
+def sandbox_user():
+    """
+    Return the (uid, gid) sandboxed programs run as.
+
+    Returns:
+        tuple or None: None when VERIFICATION_TEST_USER is not set or is the
+        user of this process
+
+    Raises:
+        KeyError: If VERIFICATION_TEST_USER does not exist
+    """
+    if not settings.VERIFICATION_TEST_USER:
+        return None
+    user = _lookup_user(settings.VERIFICATION_TEST_USER)
+    if user == (os.geteuid(), os.getegid()):
+        return None
+    return user
+
+
+def _give_to_user(path, user):
+    """Make a run directory writable by the sandbox user."""
+    try:
+        os.chown(path, *user)
+    except PermissionError:
+        # Without CAP_CHOWN, only the random name of the directory protects it
+        os.chmod(path, 0o777)
+
+
+def run_in_zygote(script_path, *args, **kwargs):
+    """Run a Python script in a fork of the zygote, see PythonZygote.run."""
+    return get_zygote().run(script_path, *args, **kwargs)
+
+
+def execute_in_zygote(command, *args, **kwargs):
+    """Exec a program from the zygote, see PythonZygote.execute."""
+    return get_zygote().execute(command, *args, **kwargs)
+
+
+def normalize_output(text):
+    """Ignore trailing whitespace on lines and trailing blank lines."""
+    return '\n'.join(line.rstrip() for line in text.replace('\r\n', '\n').rstrip().split('\n'))
+
+
+def prepare_program(file_path, work_dir=None, user=None):
+    """
+    Turn a submission file into a program that can be run on test inputs.
+
+    Args:
+        file_path: Path to the submission file
+        work_dir: Directory containing the run directories, needed with a user
+        user: Optional (uid, gid) the program runs as, see sandbox_user
+
+    Returns:
+        callable or None: Runs the program, takes the arguments of
+        PythonZygote.run after the script; None if the program cannot be built
+        str: Build errors, empty on success
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.py':
+        with open(file_path, 'rb') as f:
+            source = f.read()
+        try:
+            compile(source, file_path, 'exec', dont_inherit=True)
+        except (SyntaxError, ValueError) as e:
+            return None, f"{type(e).__name__}: {str(e)}"
+        if settings.VERIFICATION_TEST_ZYGOTE:
+            return partial(run_in_zygote, os.path.abspath(file_path)), ''
+        # Isolated mode: no user site-packages, no PYTHON* variables
+        command = [settings.VERIFICATION_TEST_PYTHON, '-I', '-B']
+        if user:
+            # An absolute script path would go through directories the
+            # sandbox user cannot enter
+            command += ['-c', RUN_RELATIVE_SCRIPT]
+        command.append(_program_path(file_path, work_dir, user))
+        return partial(execute_in_zygote, command), ''
+
+    if extension in CPP_EXTENSIONS:
+        try:
+            binary, errors = cpp_checker.compile_binary(
+                file_path, timeout=settings.VERIFICATION_TEST_COMPILE_TIMEOUT
+            )
+        except subprocess.TimeoutExpired:
+            return None, "Compilation timed out."
+        if binary is None:
+            return None, errors
+        return partial(execute_in_zygote, [_program_path(binary, work_dir, user)]), ''
+
+    return None, f"Running {extension or 'extensionless'} files is not supported."
+
+
+def _program_path(path, work_dir, user):
+    """
+    Return the path a program file is started with.
+
+    The sandbox user gets a copy in the work directory, started relative to
+    its run directory, instead of access to the media or binary cache.
+    """
+    if not user:
+        return os.path.abspath(path)
+    name = 'program' + os.path.splitext(path)[1]
+    shutil.copyfile(path, os.path.join(work_dir, name))
+    os.chmod(os.path.join(work_dir, name), 0o555)
+    return os.path.join('..', name)
+
+
+def classify(run, test_case, memory):
+    """
+    Decide the status of a finished run.
+
+    Returns:
+        str: One of the TestCaseResult statuses
+    """
+    # RLIMIT_CPU is whole seconds, so the limit itself is checked on the measured time
+    over_cpu = run.exit_code == -signal.SIGXCPU or run.cpu_time > test_case.time_limit
+    if run.timed_out or over_cpu:
+        return 'time_limit'
+    if run.output_truncated:
+        return 'output_limit'
+    if run.exit_code != 0:
+        errors = run.errors.decode('utf-8', errors='replace')
+        if 'MemoryError' in errors or 'std::bad_alloc' in errors or run.max_memory >= memory * 0.95:
+            return 'memory_limit'
+        return 'runtime_error'
+    expected = normalize_output(test_case.expected_output)
+    actual = normalize_output(run.output.decode('utf-8', errors='replace'))
+    return 'passed' if actual == expected else 'wrong_answer'
+
+
+def run_test_case(program, test_case, work_dir, user=None):
+    """
+    Run a prepared program on one test case.
+
+    Args:
+        program: Program returned by prepare_program
+        test_case: TestCase model instance
+        work_dir: Parent directory for the run
+        user: (uid, gid) the program was prepared for
+
+    Returns:
+        dict: TestCaseResult field values
+    """
+    run_dir = tempfile.mkdtemp(dir=work_dir)
+    if user:
+        _give_to_user(run_dir, user)
+    memory = test_case.memory_limit * 1024 * 1024
+    try:
+        run = program(
+            test_case.input_data.encode('utf-8'),
+            run_dir,
+            cpu_time=test_case.time_limit,
+            memory=memory,
+            output_limit=settings.VERIFICATION_TEST_OUTPUT_LIMIT,
+            max_processes=settings.VERIFICATION_TEST_MAX_PROCESSES,
+        )
+    except Exception as e:
+        logger.error(f"Error running test case {test_case.id}: {str(e)}")
+        return {'test_case': test_case, 'status': 'error', 'errors': str(e)}
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    return {
+        'test_case': test_case,
+        'status': classify(run, test_case, memory),
+        'output': run.output.decode('utf-8', errors='replace'),
+        'errors': run.errors.decode('utf-8', errors='replace'),
+        'exit_code': run.exit_code,
+        'wall_time': round(run.wall_time * 1000, 3),
+        'cpu_time': round(run.cpu_time * 1000, 3),
+    }
+
+
+def compile_error_results(test_cases, errors):
+    """Return the results of test cases of a program that does not build."""
+    return [{'test_case': test_case, 'status': 'compile_error', 'errors': errors} for test_case in test_cases]
+
+
+def run_test_cases(file_path, test_cases):
+    """
+    Run a submission on test cases in parallel.
+
+    Args:
+        file_path: Path to the submission file
+        test_cases: TestCase model instances
+
+    Returns:
+        list: TestCaseResult field values per test case, in test case order
+    """
+    if not test_cases:
+        return []
+
+    work_dir = tempfile.mkdtemp(dir=settings.VERIFICATION_TEMP_DIR)
+    try:
+        try:
+            user = sandbox_user()
+            if user:
+                # Entered through a run directory, but not listable
+                os.chmod(work_dir, 0o711)
+            program, build_errors = prepare_program(file_path, work_dir, user)
+        except Exception as e:
+            # Not the submission's fault, e.g. the sandbox user does not exist
+            logger.error(f"Error preparing {file_path} for testing: {str(e)}")
+            return [
+                {'test_case': test_case, 'status': 'error', 'errors': f"Error preparing the program: {str(e)}"}
+                for test_case in test_cases
+            ]
+        if program is None:
+            return compile_error_results(test_cases, build_errors)
+
+        executor = get_executor()
+        futures = [
+            executor.submit(run_test_case, program, test_case, work_dir, user) for test_case in test_cases
+        ]
+        return [future.result() for future in futures]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
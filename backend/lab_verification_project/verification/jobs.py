@@ -0,0 +1,236 @@
+"""
+Database-backed queue for running verifications outside the web request.
+
+The API only enqueues a VerificationJob row. Worker processes started with
+the ``run_verification_workers`` management command claim queued jobs with
+``SELECT ... FOR UPDATE SKIP LOCKED`` and run the verification, so no
+external broker is needed. A worker claims queued jobs of one assignment
+at a time and verifies them as one batch: its share of that assignment's
+queue (the queued jobs divided by the number of workers), at most
+VERIFICATION_JOB_BATCH_SIZE. A bulk verification is thereby spread evenly
+over all workers without losing the savings of batching. The assignment's
+fingerprint index is persistent (see fingerprints.AssignmentIndex), so
+batches share it instead of building their own.
+"""
+import logging
+import math
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from . import metrics
+from .models import Submission, VerificationJob
+from .services import record_verification, verify_submission_batch
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def enqueue_verification(submission):
+    """
+    Queue a submission for verification.
+
+    Args:
+        submission: Submission model instance
+
+    Returns:
+        VerificationJob: The queued or already active job for the submission
+    """
+    with transaction.atomic():
+        job = submission.verification_jobs.filter(status__in=ACTIVE_STATUSES).first()
+        if job is None:
+            job = VerificationJob.objects.create(submission=submission)
+    return job
+
+
+def enqueue_verifications(submissions):
+    """
+    Queue many submissions for verification with one insert.
+
+    Args:
+        submissions: Submission model instances
+
+    Returns:
+        list: The queued or already active jobs of the submissions
+    """
+    submission_ids = [submission.id for submission in submissions]
+    with transaction.atomic():
+        active = set(
+            VerificationJob.objects.filter(submission_id__in=submission_ids, status__in=ACTIVE_STATUSES)
+            .values_list('submission_id', flat=True)
+        )
+        VerificationJob.objects.bulk_create([
+            VerificationJob(submission_id=submission_id)
+            for submission_id in submission_ids if submission_id not in active
+        ])
+    return list(
+        VerificationJob.objects.filter(submission_id__in=submission_ids, status__in=ACTIVE_STATUSES)
+        .order_by('created_at', 'id')
+    )
+
+
+def claim_jobs(limit=1, workers=1):
+    """
+    Claim the oldest queued job, and more queued jobs of the same assignment, and mark them as running.
+
+    Args:
+        limit: Maximum number of jobs to claim
+        workers: Number of workers sharing the queue; at most 1/workers of
+            the assignment's queued jobs are claimed
+
+    Returns:
+        list: The claimed jobs, empty if the queue is empty
+    """
+    with transaction.atomic():
+        first = (
+            VerificationJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='queued')
+            .order_by('created_at', 'id')
+            .first()
+        )
+        if first is None:
+            return []
+        jobs = [first]
+        if limit > 1:
+            assignment_id = Submission.objects.filter(pk=first.submission_id).values_list(
+                'assignment_id', flat=True
+            ).first()
+            queued = VerificationJob.objects.filter(status='queued', submission__assignment_id=assignment_id)
+            limit = min(limit, math.ceil(queued.count() / max(1, workers)))
+            jobs += list(
+                queued
+                .select_for_update(skip_locked=True, of=('self',))
+                .exclude(pk=first.pk)
+                .order_by('created_at', 'id')[:max(0, limit - 1)]
+            )
+        started_at = timezone.now()
+        VerificationJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status='running', started_at=started_at
+        )
+        for job in jobs:
+            job.status = 'running'
+            job.started_at = started_at
+    return jobs
+
+
+def run_job(job):
+    """
+    Run a claimed verification job and record its outcome.
+
+    Args:
+        job: VerificationJob in the running state
+    """
+    submission = job.submission
+    try:
+        if not hasattr(submission, 'verification_result'):
+            record_verification(submission)
+        job.status = 'done'
+    except Exception as e:
+        logger.error(f"Error running verification job {job.id}: {str(e)}")
+        job.status = 'failed'
+        job.error = str(e)
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    # Workers may be stopped at any time, publish the job's metrics now
+    metrics.flush(force=True)
+
+
+def run_jobs(jobs):
+    """
+    Run claimed jobs of one assignment as one verification batch.
+
+    If the batch fails, nothing of it was stored, and every job is run on
+    its own so that one broken submission only fails its own job.
+
+    Args:
+        jobs: VerificationJobs in the running state, of one assignment
+    """
+    if len(jobs) == 1:
+        run_job(jobs[0])
+        return
+
+    submissions = list(
+        Submission.objects
+        .filter(id__in=[job.submission_id for job in jobs], verification_result__isnull=True)
+        .select_related('assignment', 'fingerprint')
+    )
+    try:
+        if submissions:
+            verify_submission_batch(
+                submissions[0].assignment, submissions, settings.VERIFICATION_BULK_CONCURRENCY
+            )
+    except Exception as e:
+        logger.error(f"Error running verification jobs {[job.id for job in jobs]} as a batch: {str(e)}")
+        for job in jobs:
+            run_job(job)
+        return
+
+    VerificationJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+        status='done', error='', finished_at=timezone.now()
+    )
+    metrics.flush(force=True)
+
+
+def requeue_stale_jobs():
+    """
+    Put jobs that have been running for too long back into the queue.
+
+    Jobs are left in the running state when a worker dies mid-verification.
+
+    Returns:
+        int: Number of requeued jobs
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.VERIFICATION_JOB_TIMEOUT)
+    return VerificationJob.objects.filter(status='running', started_at__lt=cutoff).update(
+        status='queued', started_at=None
+    )
+
+
+def queue_stats():
+    """
+    Return the number of active jobs per status and the age of the oldest queued job.
+
+    Returns:
+        dict: Status -> number of jobs, for every active status
+        float: Seconds the oldest queued job has been waiting, 0 if none is
+    """
+    counts = dict.fromkeys(ACTIVE_STATUSES, 0)
+    rows = (
+        VerificationJob.objects.filter(status__in=ACTIVE_STATUSES)
+        .values('status').annotate(count=Count('id'), oldest=Min('created_at'))
+    )
+    oldest_age = 0.0
+    for row in rows:
+        counts[row['status']] = row['count']
+        if row['status'] == 'queued' and row['oldest'] is not None:
+            oldest_age = max(0.0, (timezone.now() - row['oldest']).total_seconds())
+    return counts, oldest_age
+
+
+def worker_loop(poll_interval=1.0, max_jobs=None, workers=1):
+    """
+    Process queued jobs until interrupted.
+
+    Args:
+        poll_interval: Seconds to sleep when the queue is empty
+        max_jobs: Optional number of jobs after which the loop returns
+        workers: Number of workers sharing the queue (see claim_jobs)
+    """
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        close_old_connections()
+        limit = settings.VERIFICATION_JOB_BATCH_SIZE
+        if max_jobs is not None:
+            limit = min(limit, max_jobs - processed)
+        jobs = claim_jobs(limit, workers)
+        if not jobs:
+            time.sleep(poll_interval)
+            continue
+        run_jobs(jobs)
+        processed += len(jobs)
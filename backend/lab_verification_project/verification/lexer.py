@@ -0,0 +1,170 @@
+"""
+Token-normalizing lexers for similarity scoring.
+
+Source code is turned into a compact sequence of integer tokens in which all
+identifiers map to one token, all numeric literals to another and all
+string literals to a third. Keywords and operators keep distinct ids.
+Renaming variables, changing literals, reformatting or editing comments
+therefore leaves the token stream unchanged.
+"""
+import io
+import keyword
+import re
+import tokenize
+import zlib
+
+# Token ids of the normalized categories
+IDENTIFIER = 1
+NUMBER = 2
+STRING = 3
+NEWLINE = 4
+INDENT = 5
+DEDENT = 6
+
+# Keywords and operators are mapped into [SYMBOL_OFFSET, SYMBOL_OFFSET + 2**16)
+SYMBOL_OFFSET = 16
+
+PYTHON = 'python'
+CPP = 'cpp'
+
+LANGUAGE_EXTENSIONS = {
+    '.py': PYTHON,
+    '.cpp': CPP,
+    '.cc': CPP,
+    '.cxx': CPP,
+    '.c++': CPP,
+}
+
+CPP_KEYWORDS = frozenset("""
+    alignas alignof and and_eq asm auto bitand bitor bool break case catch char
+    char8_t char16_t char32_t class compl concept const consteval constexpr
+    constinit const_cast continue co_await co_return co_yield decltype default
+    delete do double dynamic_cast else enum explicit export extern false float
+    for friend goto if inline int long mutable namespace new noexcept not not_eq
+    nullptr operator or or_eq private protected public register
+    reinterpret_cast requires return short signed sizeof static static_assert
+    static_cast struct switch template this thread_local throw true try typedef
+    typeid typename union unsigned using virtual void volatile wchar_t while xor
+    xor_eq
+""".split())
+
+# Standard library names students rarely rename keep their own token ids
+CPP_LIBRARY_NAMES = frozenset("""
+    cin cout cerr endl std string vector map set pair main printf scanf
+""".split())
+
+_CPP_TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<directive>\#\s*[A-Za-z_]+)
+  | (?P<header><[A-Za-z0-9_./+-]+>)
+  | (?P<string>(?:u8|[uUL])?R"(?P<delim>[^()\\\s]{0,16})\(.*?\)(?P=delim)"
+               |(?:u8|[uUL])?"(?:\\.|[^"\\\n])*"
+               |(?:u8|[uUL])?'(?:\\.|[^'\\\n])*')
+  | (?P<number>\.?\d(?:[eEpP][+-]|[\w.'])*)
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<op>->\*|<<=|>>=|<=>|\.\.\.|::|->|\+\+|--|<<|>>|<=|>=|==|!=|&&|\|\||[-+*/%&|^!=<>]=|\.\*|\S)
+""", re.VERBOSE | re.DOTALL)
+
+
+def _symbol_id(text):
+    """Return the stable token id of a keyword or operator."""
+    return SYMBOL_OFFSET + (zlib.crc32(text.encode('utf-8')) & 0xFFFF)
+
+
+def detect_language(file_name):
+    """Return the lexer language for a file name, or None if unsupported."""
+    for extension, language in LANGUAGE_EXTENSIONS.items():
+        if file_name.lower().endswith(extension):
+            return language
+    return None
+
+
+def tokenize_python(source):
+    """
+    Tokenize Python source into normalized integer tokens.
+
+    Args:
+        source: Python source code as a string
+
+    Returns:
+        list: Sequence of integer tokens
+
+    Raises:
+        tokenize.TokenError, SyntaxError: If the source cannot be tokenized
+    """
+    tokens = []
+    for token in tokenize.generate_tokens(io.StringIO(source).readline):
+        if token.type == tokenize.NAME:
+            if keyword.iskeyword(token.string):
+                tokens.append(_symbol_id(token.string))
+            else:
+                tokens.append(IDENTIFIER)
+        elif token.type == tokenize.NUMBER:
+            tokens.append(NUMBER)
+        elif token.type == tokenize.STRING:
+            tokens.append(STRING)
+        elif token.type == tokenize.OP:
+            tokens.append(_symbol_id(token.string))
+        elif token.type == tokenize.NEWLINE:
+            tokens.append(NEWLINE)
+        elif token.type == tokenize.INDENT:
+            tokens.append(INDENT)
+        elif token.type == tokenize.DEDENT:
+            tokens.append(DEDENT)
+    return tokens
+
+
+def tokenize_cpp(source):
+    """
+    Tokenize C++ source into normalized integer tokens.
+
+    Args:
+        source: C++ source code as a string
+
+    Returns:
+        list: Sequence of integer tokens
+    """
+    tokens = []
+    for match in _CPP_TOKEN_RE.finditer(source):
+        kind = match.lastgroup
+        if kind in ('space', 'comment'):
+            continue
+        text = match.group(kind)
+        if kind == 'directive':
+            tokens.append(_symbol_id(re.sub(r'\s+', '', text)))
+        elif kind in ('header', 'string'):
+            tokens.append(STRING)
+        elif kind == 'number':
+            tokens.append(NUMBER)
+        elif kind == 'name':
+            if text in CPP_KEYWORDS or text in CPP_LIBRARY_NAMES:
+                tokens.append(_symbol_id(text))
+            else:
+                tokens.append(IDENTIFIER)
+        else:
+            tokens.append(_symbol_id(text))
+    return tokens
+
+
+def tokenize_code(source, language):
+    """
+    Tokenize source code of the given language.
+
+    Python that the standard tokenizer rejects (e.g. broken indentation) is
+    lexed with the C-style lexer instead, which still normalizes identifiers
+    and literals.
+
+    Args:
+        source: Source code as a string
+        language: PYTHON or CPP
+
+    Returns:
+        list: Sequence of integer tokens
+    """
+    if language == PYTHON:
+        try:
+            return tokenize_python(source)
+        except (tokenize.TokenError, SyntaxError):
+            return tokenize_cpp(source)
+    return tokenize_cpp(source)
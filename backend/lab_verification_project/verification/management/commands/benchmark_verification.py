@@ -0,0 +1,65 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lab_verification_project.verification.benchmarks import (
+    DEFAULT_SEED_DIR, compare_results, run_benchmarks
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark verification and listing on synthetic assignments in a throwaway test database '
+        'and print a JSON report.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[100, 1000],
+            help='Numbers of submissions of the generated assignments (100 to 50000).'
+        )
+        parser.add_argument(
+            '--samples', type=int, default=20,
+            help='Number of submissions each stage is timed on.'
+        )
+        parser.add_argument(
+            '--reference-limit', type=int, default=1000,
+            help='Maximum number of reference files for PlagiarismChecker.check_plagiarism.'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated submissions.')
+        parser.add_argument('--seed-dir', default=DEFAULT_SEED_DIR, help='Directory with the seed files.')
+        parser.add_argument('--output', help='Write the report to this file instead of stdout.')
+        parser.add_argument('--compare', help='Earlier report to compare the results with.')
+    
+    def handle(self, *args, **options):
+        if any(size < 1 for size in options['sizes']) or options['samples'] < 1:
+            raise CommandError('Sizes and samples must be positive.')
+        
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        
+        try:
+            report = run_benchmarks(
+                options['sizes'],
+                samples=options['samples'],
+                reference_limit=options['reference_limit'],
+                seed=options['seed'],
+                seed_dir=options['seed_dir'],
+                log=self.stderr.write,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        
+        if baseline is not None:
+            for size, stage, old, new, ratio in compare_results(baseline, report):
+                change = f"{(ratio - 1) * 100:+.1f}%" if ratio is not None else 'n/a'
+                self.stderr.write(f"{size:>6} {stage:<30} {old:>10.3f} -> {new:>10.3f} ms  {change}")
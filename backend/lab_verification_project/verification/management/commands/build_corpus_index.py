@@ -0,0 +1,105 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lab_verification_project.verification.corpus import shard_content_hashes, shard_submission_ids, write_shard
+from lab_verification_project.verification.fingerprints import (
+    compute_fingerprints, get_submission_fingerprint, hash_content, tokenize_content, unpack_fingerprints
+)
+from lab_verification_project.verification.lexer import detect_language
+from lab_verification_project.verification.models import Submission
+
+
+class Command(BaseCommand):
+    help = 'Build or extend a shard of the historical submission corpus used for plagiarism checks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shard', help='Shard name, e.g. a course or year.')
+        parser.add_argument(
+            '--assignment', type=int, action='append', default=[],
+            help='Add the submissions of this assignment (can be repeated).'
+        )
+        parser.add_argument(
+            '--year', type=int, action='append', default=[],
+            help='Add the submissions of assignments created in this year (can be repeated).'
+        )
+        parser.add_argument(
+            '--directory', action='append', default=[],
+            help='Add the source files of an archive directory (can be repeated).'
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Replace the shard instead of adding to it.'
+        )
+
+    def handle(self, *args, **options):
+        if not (options['assignment'] or options['year'] or options['directory']):
+            raise CommandError('Give at least one --assignment, --year or --directory.')
+
+        name = options['shard']
+        try:
+            known = set() if options['rebuild'] else shard_submission_ids(name)
+            known_contents = set() if options['rebuild'] else shard_content_hashes(name)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        documents = []
+        fingerprint_arrays = []
+
+        if options['assignment'] or options['year']:
+            submissions = Submission.objects.none()
+            if options['assignment']:
+                submissions |= Submission.objects.filter(assignment_id__in=options['assignment'])
+            if options['year']:
+                submissions |= Submission.objects.filter(assignment__created_at__year__in=options['year'])
+            submissions = (
+                submissions.exclude(id__in=known)
+                .select_related('student', 'assignment', 'fingerprint')
+                .defer('fingerprint__tokens')
+                .order_by('id')
+            )
+            for submission in submissions.iterator(chunk_size=500):
+                fingerprint = get_submission_fingerprint(submission)
+                if fingerprint is None or not fingerprint.fingerprints:
+                    continue
+                documents.append({
+                    'label': f"{submission.assignment.title} / {submission.student.full_name} / {submission.filename}",
+                    'submission_id': submission.id,
+                    'assignment_id': submission.assignment_id,
+                    'content_hash': fingerprint.content_hash,
+                })
+                fingerprint_arrays.append(unpack_fingerprints(fingerprint.fingerprints))
+
+        for directory in options['directory']:
+            if not os.path.isdir(directory):
+                raise CommandError(f"Not a directory: {directory}")
+            for root, _, file_names in os.walk(directory):
+                for file_name in sorted(file_names):
+                    language = detect_language(file_name)
+                    if language is None:
+                        continue
+                    path = os.path.join(root, file_name)
+                    try:
+                        with open(path, 'rb') as f:
+                            content = f.read()
+                    except OSError as e:
+                        self.stderr.write(f"Skipping {path}: {str(e)}")
+                        continue
+                    # Files added by an earlier run, or found twice in this one
+                    content_hash = hash_content(content)
+                    if content_hash in known_contents:
+                        continue
+                    known_contents.add(content_hash)
+                    fingerprints = compute_fingerprints(tokenize_content(content, language), language)
+                    if not fingerprints:
+                        continue
+                    documents.append({'label': os.path.relpath(path, directory), 'content_hash': content_hash})
+                    fingerprint_arrays.append(sorted(fingerprints))
+
+        try:
+            total = write_shard(name, documents, fingerprint_arrays, append=not options['rebuild'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Added {len(documents)} document(s) to shard '{name}', {total} in total."
+        ))
@@ -0,0 +1,96 @@
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from lab_verification_project.verification.grading import check_sandbox, close_zygote
+from lab_verification_project.verification.jobs import requeue_stale_jobs, worker_loop
+
+# Seconds between checks for jobs left running by a worker that died
+REQUEUE_INTERVAL = 60
+
+
+def _run_worker(poll_interval, max_jobs, workers):
+    # Let the parent decide when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    worker_loop(poll_interval=poll_interval, max_jobs=max_jobs, workers=workers)
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of worker processes that process queued verification jobs.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.VERIFICATION_WORKERS,
+            help='Number of worker processes.'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds a worker sleeps when the queue is empty.'
+        )
+        parser.add_argument(
+            '--max-jobs-per-worker', type=int, default=None,
+            help='Restart a worker after it has processed this many jobs.'
+        )
+    
+    def handle(self, *args, **options):
+        # Refuse to start rather than fail every test run
+        try:
+            check_sandbox()
+        except (RuntimeError, KeyError) as e:
+            raise CommandError(f"Test programs cannot be sandboxed: {str(e)}")
+        finally:
+            # Workers start their own
+            close_zygote()
+        
+        context = multiprocessing.get_context('fork')
+        worker_args = (options['poll_interval'], options['max_jobs_per_worker'], options['workers'])
+        
+        def requeue():
+            requeued = requeue_stale_jobs()
+            if requeued:
+                self.stdout.write(f"Requeued {requeued} stale job(s).")
+        
+        def start_worker():
+            # Forked workers must not share the parent's database connections
+            connections.close_all()
+            process = context.Process(target=_run_worker, args=worker_args)
+            process.start()
+            return process
+        
+        stopping = False
+        
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+        
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        
+        requeue()
+        last_requeue = time.monotonic()
+        workers = [start_worker() for _ in range(options['workers'])]
+        self.stdout.write(f"Started {len(workers)} verification worker(s).")
+        
+        try:
+            while not stopping:
+                # A worker that exited or crashed may have left its jobs running
+                exited = [w for w in workers if not w.is_alive()]
+                if exited or time.monotonic() - last_requeue >= REQUEUE_INTERVAL:
+                    requeue()
+                    last_requeue = time.monotonic()
+                for worker in exited:
+                    worker.join()
+                # Replace workers that exited or crashed
+                workers = [w if w.is_alive() else start_worker() for w in workers]
+                time.sleep(1)
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+            self.stdout.write("Stopped verification workers.")
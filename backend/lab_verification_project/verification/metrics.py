@@ -0,0 +1,447 @@
+"""
+Per-stage timing of verifications and Prometheus metrics.
+
+``stage(name)`` measures the wall time, CPU time (including finished child
+processes such as g++) and bytes read of a block of work. Every measurement
+goes into the process-wide histograms; inside ``StageTimer.activate()`` it
+is also collected on the timer, which verify_submission stores on the
+VerificationResult.
+
+Web and verification worker processes each keep their own metrics. With
+METRICS_DIR set, every process writes a snapshot of its metrics to a file
+there and the ``/metrics`` view adds up the snapshots of all processes.
+Snapshots of processes that have exited are merged into an aggregate file
+and deleted, by the process itself at exit or by the next collect() for
+processes that died without running their exit handlers (forked workers,
+killed processes), so counters never go back and the directory does not
+grow with every restart. Process ids are checked on this host, so
+METRICS_DIR must not be shared between hosts or PID namespaces.
+"""
+import atexit
+import contextvars
+import fcntl
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+# Seconds between metric snapshots written by one process
+FLUSH_INTERVAL = 1.0
+
+# Metrics of exited processes, in the snapshot format
+AGGREGATE_FILE = 'aggregate.json'
+
+_LOCK_FILE = 'metrics.lock'
+
+_SNAPSHOT_RE = re.compile(r'^(\d+)-[0-9a-f]+\.json$')
+
+
+def _copy_state(state):
+    return {'buckets': list(state['buckets']), 'sum': state['sum'], 'count': state['count']}
+
+
+class Histogram:
+    """Prometheus histogram with labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Record one observation."""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][position] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def snapshot(self):
+        """Return the state of every label set as JSON-serializable data."""
+        with self._lock:
+            return [[list(key), _copy_state(state)] for key, state in self._values.items()]
+
+    @staticmethod
+    def merge(total, state):
+        if total is None:
+            return _copy_state(state)
+        total['buckets'] = [a + b for a, b in zip(total['buckets'], state['buckets'])]
+        total['sum'] += state['sum']
+        total['count'] += state['count']
+        return total
+
+    def render(self, states):
+        lines = []
+        for key, state in sorted(states.items()):
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, state['buckets']):
+                le = '+Inf' if bound == math.inf else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': le})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {state['sum']!r}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {state['count']}")
+        return lines
+
+
+class Counter:
+    """Prometheus counter with labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        """Increase the counter."""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def snapshot(self):
+        """Return the value of every label set as JSON-serializable data."""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(total, value):
+        return value if total is None else total + value
+
+    def render(self, values):
+        return [
+            f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {value!r}"
+            for key, value in sorted(values.items())
+        ]
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + '}'
+
+
+STAGE_SECONDS = Histogram(
+    'verification_stage_seconds', 'Wall time of verification stages.', ['stage']
+)
+STAGE_CPU_SECONDS = Histogram(
+    'verification_stage_cpu_seconds', 'CPU time of verification stages, including child processes.', ['stage']
+)
+STAGE_READ_BYTES = Counter(
+    'verification_stage_read_bytes_total', 'Bytes read by verification stages.', ['stage']
+)
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Latency of HTTP requests.', ['method', 'view', 'status']
+)
+
+REGISTRY = [STAGE_SECONDS, STAGE_CPU_SECONDS, STAGE_READ_BYTES, REQUEST_SECONDS]
+
+
+def _cpu_time():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _read_bytes():
+    """Return the bytes this process has read so far, 0 if the OS does not tell."""
+    try:
+        with open('/proc/self/io', 'rb') as f:
+            for line in f:
+                if line.startswith(b'rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+_current_timer = contextvars.ContextVar('verification_stage_timer', default=None)
+
+
+class StageTimer:
+    """
+    Collects the timings of the stages of one verification.
+
+    Repeated stages are added up. Stages may be nested, e.g. 'pylint' runs
+    inside 'syntax'. CPU time and bytes read are process-wide, so they also
+    count work done in other threads at the same time.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def activate(self):
+        """Collect the stages measured in this context on the timer."""
+        token = _current_timer.set(self)
+        try:
+            yield self
+        finally:
+            _current_timer.reset(token)
+
+    def record(self, name, wall, cpu, read_bytes):
+        """Add a measurement to a stage."""
+        totals = self.stages.setdefault(name, {'wall_ms': 0.0, 'cpu_ms': 0.0, 'read_bytes': 0})
+        totals['wall_ms'] += wall * 1000
+        totals['cpu_ms'] += cpu * 1000
+        totals['read_bytes'] += read_bytes
+
+    def as_dict(self):
+        """Return the stage timings with rounded values."""
+        return {
+            name: {
+                'wall_ms': round(totals['wall_ms'], 3),
+                'cpu_ms': round(totals['cpu_ms'], 3),
+                'read_bytes': totals['read_bytes'],
+            }
+            for name, totals in self.stages.items()
+        }
+
+
+@contextmanager
+def stage(name):
+    """
+    Measure a stage of a verification.
+
+    Args:
+        name: Stage name, used as the 'stage' label of the metrics
+    """
+    wall_start = time.perf_counter()
+    cpu_start = _cpu_time()
+    read_start = _read_bytes()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = max(0.0, _cpu_time() - cpu_start)
+        read_bytes = max(0, _read_bytes() - read_start)
+        STAGE_SECONDS.observe(wall, stage=name)
+        STAGE_CPU_SECONDS.observe(cpu, stage=name)
+        STAGE_READ_BYTES.inc(read_bytes, stage=name)
+        timer = _current_timer.get()
+        if timer is not None:
+            timer.record(name, wall, cpu, read_bytes)
+        flush()
+
+
+def observe_request(method, view, status, seconds):
+    """Record the latency of an HTTP request."""
+    REQUEST_SECONDS.observe(seconds, method=method, view=view, status=status)
+    flush()
+
+
+def snapshot():
+    """Return the metrics of this process as JSON-serializable data."""
+    return {metric.name: metric.snapshot() for metric in REGISTRY}
+
+
+_flush_lock = threading.Lock()
+_flush_state = {'pid': None, 'path': None, 'last': 0.0}
+
+
+def _snapshot_path():
+    """Return this process's snapshot file, a new one after a fork."""
+    if _flush_state['pid'] != os.getpid():
+        _flush_state['pid'] = os.getpid()
+        _flush_state['path'] = os.path.join(settings.METRICS_DIR, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+        _flush_state['last'] = 0.0
+    return _flush_state['path']
+
+
+def flush(force=False):
+    """
+    Write this process's metrics to METRICS_DIR, at most once per FLUSH_INTERVAL.
+
+    Args:
+        force: Write even if the last snapshot is recent
+    """
+    if not settings.METRICS_DIR:
+        return
+    with _flush_lock:
+        path = _snapshot_path()
+        now = time.monotonic()
+        if not force and now - _flush_state['last'] < FLUSH_INTERVAL:
+            return
+        _flush_state['last'] = now
+        try:
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            _write_json(path, snapshot())
+        except OSError as e:
+            logger.error(f"Error writing metrics snapshot: {str(e)}")
+
+
+def _write_json(path, data):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def _read_json(path):
+    """Return the content of a snapshot file, None if it is gone or unreadable."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def _directory_lock(exclusive):
+    """Lock METRICS_DIR against retiring snapshots while it is read, or for retiring them."""
+    fd = os.open(os.path.join(settings.METRICS_DIR, _LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, owned by another user
+        return True
+    return True
+
+
+def retire_snapshots(paths):
+    """
+    Merge snapshot files into the aggregate file and delete them.
+
+    Runs under an exclusive lock of METRICS_DIR, so a file is merged only
+    once and collect() never sees it both merged and on its own.
+
+    Args:
+        paths: Snapshot files of processes that will not write them again
+    """
+    with _directory_lock(exclusive=True):
+        aggregate_path = os.path.join(settings.METRICS_DIR, AGGREGATE_FILE)
+        snapshots = [_read_json(aggregate_path) or {}]
+        retired = []
+        for path in paths:
+            data = _read_json(path)
+            if data is not None:
+                snapshots.append(data)
+                retired.append(path)
+        if not retired:
+            return
+        merged = _merge(snapshots)
+        _write_json(aggregate_path, {
+            name: [[list(key), state] for key, state in states.items()] for name, states in merged.items()
+        })
+        for path in retired:
+            os.remove(path)
+
+
+def _retire_own_snapshot():
+    """Publish this process's final metrics in the aggregate file at exit."""
+    if not settings.METRICS_DIR:
+        return
+    flush(force=True)
+    if _flush_state['pid'] != os.getpid():
+        return
+    try:
+        retire_snapshots([_flush_state['path']])
+    except OSError as e:
+        logger.error(f"Error retiring metrics snapshot: {str(e)}")
+
+
+atexit.register(_retire_own_snapshot)
+
+
+def _merge(snapshots):
+    merged = {}
+    for metric in REGISTRY:
+        states = merged[metric.name] = {}
+        for data in snapshots:
+            for key, state in data.get(metric.name, []):
+                key = tuple(key)
+                states[key] = metric.merge(states.get(key), state)
+    return merged
+
+
+def collect():
+    """
+    Add up the metrics of all processes, retiring the snapshots of dead ones.
+
+    Returns:
+        dict: Metric name -> {label values tuple -> merged state}
+    """
+    snapshots = [snapshot()]
+    own_path = _flush_state['path'] if _flush_state['pid'] == os.getpid() else None
+    if settings.METRICS_DIR and os.path.isdir(settings.METRICS_DIR):
+        try:
+            dead = []
+            for file_name in os.listdir(settings.METRICS_DIR):
+                match = _SNAPSHOT_RE.match(file_name)
+                if match and not _process_alive(int(match.group(1))):
+                    dead.append(os.path.join(settings.METRICS_DIR, file_name))
+            if dead:
+                retire_snapshots(dead)
+
+            with _directory_lock(exclusive=False):
+                for file_name in os.listdir(settings.METRICS_DIR):
+                    path = os.path.join(settings.METRICS_DIR, file_name)
+                    if not file_name.endswith('.json') or path == own_path:
+                        continue
+                    data = _read_json(path)
+                    if data is not None:
+                        snapshots.append(data)
+        except OSError as e:
+            logger.error(f"Error collecting metrics snapshots: {str(e)}")
+    return _merge(snapshots)
+
+
+def render(gauges=()):
+    """
+    Render all metrics in the Prometheus text exposition format.
+
+    Args:
+        gauges: (name, documentation, {labels dict items tuple: value}) of
+            gauges computed at scrape time
+
+    Returns:
+        str: Exposition text
+    """
+    merged = collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render(merged[metric.name]))
+    for name, documentation, values in gauges:
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in values.items():
+            lines.append(f"{name}{_format_labels(dict(labels))} {value!r}")
+    return '\n'.join(lines) + '\n'
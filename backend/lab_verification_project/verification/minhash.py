@@ -0,0 +1,178 @@
+"""
+MinHash signatures and LSH banding for assignment-wide similarity search.
+
+Every submission's fingerprint set is summarized by a fixed-length MinHash
+signature; the signatures of a whole assignment form one NumPy matrix.
+Locality-sensitive hashing splits each signature into bands and only
+submissions that agree on a full band become candidate pairs, so exact
+scoring runs on a small fraction of all N^2 pairs.
+"""
+from collections import defaultdict
+
+import numpy as np
+
+# Number of hash permutations in a signature
+NUM_PERMUTATIONS = 128
+
+# Signatures are split into LSH_BANDS bands of NUM_PERMUTATIONS // LSH_BANDS
+# rows. With 32 bands of 4 rows, pairs with a Jaccard similarity around 0.4
+# or higher become candidates with high probability.
+LSH_BANDS = 32
+
+# Similarity (0-100) above which LSH finds nearly all pairs. Pairs less
+# similar than this are increasingly likely to never become candidates, so
+# lower thresholds give incomplete results.
+LSH_RELIABLE_THRESHOLD = 40
+
+# Buckets with more members than this hold a cluster of near-duplicates.
+# Their members are only paired with the first member, so a cluster of N
+# submissions costs N - 1 candidates instead of N * (N - 1) / 2.
+LSH_MAX_BUCKET_SIZE = 50
+
+# Number of fingerprints compared per vectorized chunk of exact scoring
+SCORE_CHUNK_SIZE = 1 << 22
+
+# Number of fingerprints hashed per vectorized chunk
+CHUNK_SIZE = 8192
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+class MinHasher:
+    """Computes MinHash signatures with universal hash permutations."""
+
+    def __init__(self, num_permutations=NUM_PERMUTATIONS, seed=1):
+        generator = np.random.RandomState(seed)
+        # a and b stay below 2**32 so that a * x + b fits in 64 bits
+        self.a = generator.randint(1, 1 << 32, size=num_permutations, dtype=np.uint64)
+        self.b = generator.randint(0, 1 << 32, size=num_permutations, dtype=np.uint64)
+        self.num_permutations = num_permutations
+
+    def _permute(self, values):
+        values = (values & _MAX_HASH)[:, np.newaxis]
+        return ((values * self.a + self.b) % _MERSENNE_PRIME) & _MAX_HASH
+
+    def signatures(self, fingerprint_arrays):
+        """
+        Compute MinHash signatures for many fingerprint sets at once.
+
+        Args:
+            fingerprint_arrays: List of non-empty uint64 arrays of fingerprints
+
+        Returns:
+            numpy.ndarray: (len(fingerprint_arrays), num_permutations) signatures
+        """
+        count = len(fingerprint_arrays)
+        signatures = np.full((count, self.num_permutations), _MAX_HASH, dtype=np.uint64)
+        if count == 0:
+            return signatures
+
+        lengths = np.array([len(array) for array in fingerprint_arrays], dtype=np.int64)
+        values = np.concatenate(fingerprint_arrays).astype(np.uint64, copy=False)
+        owners = np.repeat(np.arange(count), lengths)
+
+        for start in range(0, len(values), CHUNK_SIZE):
+            chunk_owners = owners[start:start + CHUNK_SIZE]
+            hashed = self._permute(values[start:start + CHUNK_SIZE])
+            # Rows are grouped by owner, so reduce each owner's run at once
+            boundaries = np.flatnonzero(np.diff(chunk_owners)) + 1
+            starts = np.concatenate(([0], boundaries))
+            minima = np.minimum.reduceat(hashed, starts, axis=0)
+            rows = chunk_owners[starts]
+            signatures[rows] = np.minimum(signatures[rows], minima)
+        return signatures
+
+
+def lsh_candidate_pairs(signatures, bands=LSH_BANDS, max_bucket_size=LSH_MAX_BUCKET_SIZE):
+    """
+    Find candidate pairs whose signatures agree on at least one band.
+
+    Args:
+        signatures: (N, num_permutations) signature matrix
+        bands: Number of bands to split each signature into
+        max_bucket_size: Buckets larger than this only pair their members
+            with the first member
+
+    Returns:
+        set: (i, j) row index pairs with i < j
+    """
+    count, num_permutations = signatures.shape
+    rows_per_band = num_permutations // bands
+    candidates = set()
+    if count < 2:
+        return candidates
+
+    for band in range(bands):
+        band_rows = np.ascontiguousarray(
+            signatures[:, band * rows_per_band:(band + 1) * rows_per_band]
+        )
+        keys = band_rows.view(np.dtype((np.void, band_rows.dtype.itemsize * rows_per_band))).ravel()
+        _, bucket_ids, bucket_sizes = np.unique(keys, return_inverse=True, return_counts=True)
+        bucket_ids = bucket_ids.ravel()
+        shared = np.flatnonzero(bucket_sizes[bucket_ids] > 1)
+        if not len(shared):
+            continue
+
+        buckets = defaultdict(list)
+        for row in shared:
+            buckets[bucket_ids[row]].append(row)
+        for members in buckets.values():
+            if len(members) > max_bucket_size:
+                first = int(members[0])
+                candidates.update((first, int(second)) for second in members[1:])
+                continue
+            for i, first in enumerate(members):
+                for second in members[i + 1:]:
+                    candidates.add((int(first), int(second)))
+    return candidates
+
+
+def jaccard_pairs(fingerprint_arrays, pairs):
+    """
+    Compute the exact Jaccard similarity of many pairs of fingerprint sets.
+
+    Fingerprints are first renumbered densely, then the fingerprints of a
+    chunk of pairs are combined with their pair number into one integer key
+    and sorted; equal neighbouring keys are the shared fingerprints.
+
+    Args:
+        fingerprint_arrays: List of sorted uint64 arrays without duplicates
+        pairs: (P, 2) array of row indexes into fingerprint_arrays
+
+    Returns:
+        numpy.ndarray: P similarities (0-100)
+    """
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    lengths = np.array([len(array) for array in fingerprint_arrays], dtype=np.int64)
+    shared = np.zeros(len(pairs), dtype=np.int64)
+    if not len(pairs):
+        return np.zeros(0, dtype=np.float64)
+
+    used = np.unique(pairs)
+    offsets = np.zeros(len(fingerprint_arrays) + 1, dtype=np.int64)
+    offsets[used + 1] = lengths[used]
+    offsets = np.cumsum(offsets)
+    distinct, dense = np.unique(
+        np.concatenate([fingerprint_arrays[row] for row in used]), return_inverse=True
+    )
+    dense = dense.ravel().astype(np.int64)
+
+    start = 0
+    while start < len(pairs):
+        # Take pairs until the chunk holds SCORE_CHUNK_SIZE fingerprints
+        sizes = np.cumsum(lengths[pairs[start:]].sum(axis=1))
+        end = start + max(1, int(np.searchsorted(sizes, SCORE_CHUNK_SIZE, side='right')))
+        chunk = pairs[start:end]
+        rows = chunk.ravel()
+        keys = np.concatenate([dense[offsets[row]:offsets[row + 1]] for row in rows])
+        keys += np.repeat(np.repeat(np.arange(len(chunk), dtype=np.int64), 2), lengths[rows]) * len(distinct)
+        keys.sort()
+        duplicates = keys[1:][keys[1:] == keys[:-1]]
+        shared[start:end] = np.bincount(duplicates // len(distinct), minlength=len(chunk))
+        start = end
+
+    unions = lengths[pairs[:, 0]] + lengths[pairs[:, 1]] - shared
+    similarities = np.zeros(len(pairs), dtype=np.float64)
+    np.divide(shared * 100.0, unions, out=similarities, where=unions > 0)
+    return similarities
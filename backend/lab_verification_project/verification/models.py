@@ -1,7 +1,9 @@
-from django.db import models
+from django.db import connections, models, transaction
 from django.conf import settings
 import os
 
+from .storage import submission_storage
+
 class Assignment(models.Model):
     """Model representing a lab assignment."""
     
@@ -19,6 +21,67 @@ class Assignment(models.Model):
     def __str__(self):
         return self.title
 
+class CodeFingerprint(models.Model):
+    """Model storing precomputed similarity data for a file's content."""
+    
+    content_hash = models.CharField('Content Hash', max_length=64)
+    version = models.PositiveSmallIntegerField('Version')
+    language = models.CharField('Language', max_length=10, blank=True)
+    tokens = models.BinaryField('Tokens')  # Packed normalized token stream
+    fingerprints = models.BinaryField('Fingerprints')  # Packed sorted winnowing hashes
+    created_at = models.DateTimeField('Created At', auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Code Fingerprint'
+        verbose_name_plural = 'Code Fingerprints'
+        unique_together = ('content_hash', 'version', 'language')
+    
+    def __str__(self):
+        return f"Fingerprint {self.content_hash[:12]} (v{self.version})"
+
+class SubmissionQuerySet(models.QuerySet):
+    """QuerySet with the related data the submission serializers need."""
+    
+    def for_list(self):
+        """Load what SubmissionListSerializer reads, in a single query."""
+        return self.select_related('student', 'assignment').annotate(
+            has_verification=models.Exists(
+                VerificationResult.objects.filter(submission=models.OuterRef('pk'))
+            ),
+            has_review=models.Exists(
+                TeacherReview.objects.filter(submission=models.OuterRef('pk'))
+            ),
+        )
+    
+    def for_detail(self):
+        """Load what SubmissionSerializer reads, in a constant number of queries."""
+        return self.select_related(
+            'student', 'assignment', 'verification_result', 'teacher_review__teacher'
+        ).prefetch_related(
+            models.Prefetch('code_comments', queryset=CodeComment.objects.select_related('teacher')),
+            models.Prefetch(
+                'verification_result__test_results',
+                queryset=TestCaseResult.objects.select_related('test_case')
+            ),
+        )
+    
+    def latest_per_student(self):
+        """
+        Keep only the newest submission of every student for every assignment.
+        
+        Uses DISTINCT ON where the database has it (PostgreSQL), a correlated
+        subquery elsewhere; both are served by the (assignment, student,
+        submitted_at) index.
+        """
+        if connections[self.db].features.can_distinct_on_fields:
+            return self.order_by('assignment_id', 'student_id', '-submitted_at', '-id').distinct(
+                'assignment_id', 'student_id'
+            )
+        newest = Submission.objects.filter(
+            assignment=models.OuterRef('assignment'), student=models.OuterRef('student')
+        ).order_by('-submitted_at', '-id').values('id')[:1]
+        return self.filter(id=models.Subquery(newest))
+
 class Submission(models.Model):
     """Model representing a student's lab work submission."""
     
@@ -30,27 +93,69 @@ class Submission(models.Model):
     
     assignment = models.ForeignKey(Assignment, on_delete=models.CASCADE, related_name='submissions')
     student = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='submissions')
-    file = models.FileField('File', upload_to='submissions/')
+    file = models.FileField('File', upload_to='submissions/', storage=submission_storage)
+    original_filename = models.CharField('Original Filename', max_length=255, blank=True)
+    content_hash = models.CharField('Content Hash', max_length=64, blank=True, db_index=True)
     submitted_at = models.DateTimeField('Submitted At', auto_now_add=True)
     status = models.CharField('Status', max_length=10, choices=STATUS_CHOICES, default='pending')
+    fingerprint = models.ForeignKey(
+        CodeFingerprint, on_delete=models.SET_NULL, null=True, blank=True, related_name='submissions'
+    )
+    
+    objects = SubmissionQuerySet.as_manager()
     
     class Meta:
         verbose_name = 'Submission'
         verbose_name_plural = 'Submissions'
         ordering = ['-submitted_at']
+        indexes = [
+            # Latest submission per student and assignment (gradebook)
+            models.Index(fields=['assignment', 'student', 'submitted_at'], name='submission_latest_idx'),
+            models.Index(fields=['status'], name='submission_status_idx'),
+        ]
     
     def __str__(self):
         return f"{self.student.full_name} - {self.assignment.title}"
     
+    def save(self, *args, **kwargs):
+        # One transaction, so the blob lock taken while storing the upload is
+        # held until the row referencing the blob is committed
+        with transaction.atomic():
+            if self.file and not self.file._committed:
+                # Store the upload now so its content hash is known before the row is written
+                self.original_filename = os.path.basename(self.file.name)
+                self.file.save(self.file.name, self.file.file, save=False)
+            if self.file:
+                self.content_hash = submission_storage.content_hash(self.file.name)
+            super().save(*args, **kwargs)
+    
     @property
     def filename(self):
-        return os.path.basename(self.file.name)
+        return self.original_filename or os.path.basename(self.file.name)
     
     @property
     def file_extension(self):
         _, extension = os.path.splitext(self.filename)
         return extension.lower()
 
+class FingerprintPosting(models.Model):
+    """Model storing one fingerprint hash of a submission, the inverted index of its assignment."""
+    
+    assignment = models.ForeignKey(Assignment, on_delete=models.CASCADE, related_name='+')
+    submission = models.ForeignKey(Submission, on_delete=models.CASCADE, related_name='fingerprint_postings')
+    hash = models.BigIntegerField('Hash')  # Unsigned 64-bit winnowing hash stored as signed
+    
+    class Meta:
+        verbose_name = 'Fingerprint Posting'
+        verbose_name_plural = 'Fingerprint Postings'
+        unique_together = ('submission', 'hash')
+        indexes = [
+            models.Index(fields=['assignment', 'hash'], name='posting_assignment_hash_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.hash} in submission {self.submission_id}"
+
 class VerificationResult(models.Model):
     """Model representing the verification result of a submission."""
     
@@ -59,6 +164,9 @@ class VerificationResult(models.Model):
     syntax_errors = models.TextField('Syntax Errors', blank=True)
     plagiarism_score = models.FloatField('Plagiarism Score', default=0.0)  # Percentage of similarity
     plagiarism_details = models.TextField('Plagiarism Details', blank=True)
+    stage_timings = models.JSONField('Stage Timings', default=dict, blank=True)  # Stage -> wall/CPU ms, bytes read
+    tests_passed = models.PositiveIntegerField('Tests Passed', default=0)
+    tests_total = models.PositiveIntegerField('Tests Total', default=0)
     verified_at = models.DateTimeField('Verified At', auto_now_add=True)
     
     class Meta:
@@ -68,6 +176,84 @@ class VerificationResult(models.Model):
     def __str__(self):
         return f"Verification for {self.submission}"
 
+class TestCase(models.Model):
+    """Model representing an input/expected output test of an assignment."""
+    
+    assignment = models.ForeignKey(Assignment, on_delete=models.CASCADE, related_name='test_cases')
+    name = models.CharField('Name', max_length=100)
+    input_data = models.TextField('Input', blank=True)  # Passed on stdin
+    expected_output = models.TextField('Expected Output', blank=True)
+    is_hidden = models.BooleanField('Hidden', default=False)  # Input and output not shown to students
+    order = models.PositiveIntegerField('Order', default=0)
+    time_limit = models.FloatField('Time Limit', default=2.0)  # Seconds of CPU time
+    memory_limit = models.PositiveIntegerField('Memory Limit', default=256)  # Megabytes
+    created_at = models.DateTimeField('Created At', auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Test Case'
+        verbose_name_plural = 'Test Cases'
+        ordering = ['order', 'id']
+    
+    def __str__(self):
+        return f"{self.assignment.title}: {self.name}"
+
+class TestCaseResult(models.Model):
+    """Model representing the outcome of running a submission on a test case."""
+    
+    STATUS_CHOICES = (
+        ('passed', 'Passed'),
+        ('wrong_answer', 'Wrong Answer'),
+        ('runtime_error', 'Runtime Error'),
+        ('time_limit', 'Time Limit Exceeded'),
+        ('memory_limit', 'Memory Limit Exceeded'),
+        ('output_limit', 'Output Limit Exceeded'),
+        ('compile_error', 'Compile Error'),
+        ('error', 'Error'),
+    )
+    
+    verification_result = models.ForeignKey(VerificationResult, on_delete=models.CASCADE, related_name='test_results')
+    test_case = models.ForeignKey(TestCase, on_delete=models.CASCADE, related_name='results')
+    status = models.CharField('Status', max_length=15, choices=STATUS_CHOICES)
+    output = models.TextField('Output', blank=True)
+    errors = models.TextField('Errors', blank=True)
+    exit_code = models.IntegerField('Exit Code', null=True, blank=True)
+    wall_time = models.FloatField('Wall Time', default=0.0)  # Milliseconds
+    cpu_time = models.FloatField('CPU Time', default=0.0)  # Milliseconds
+    
+    class Meta:
+        verbose_name = 'Test Case Result'
+        verbose_name_plural = 'Test Case Results'
+        ordering = ['test_case__order', 'test_case_id']
+        unique_together = ('verification_result', 'test_case')
+    
+    def __str__(self):
+        return f"{self.test_case.name}: {self.status}"
+
+class VerificationJob(models.Model):
+    """Model representing a queued verification of a submission."""
+    
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    
+    submission = models.ForeignKey(Submission, on_delete=models.CASCADE, related_name='verification_jobs')
+    status = models.CharField('Status', max_length=10, choices=STATUS_CHOICES, default='queued', db_index=True)
+    error = models.TextField('Error', blank=True)
+    created_at = models.DateTimeField('Created At', auto_now_add=True)
+    started_at = models.DateTimeField('Started At', null=True, blank=True)
+    finished_at = models.DateTimeField('Finished At', null=True, blank=True)
+    
+    class Meta:
+        verbose_name = 'Verification Job'
+        verbose_name_plural = 'Verification Jobs'
+        ordering = ['created_at']
+    
+    def __str__(self):
+        return f"Verification job for {self.submission} ({self.status})"
+
 class TeacherReview(models.Model):
     """Model representing a teacher's review of a submission."""
     
@@ -100,3 +286,48 @@ class CodeComment(models.Model):
     
     def __str__(self):
         return f"Comment on line {self.line_number} by {self.teacher.full_name}"
+
+class AssignmentStats(models.Model):
+    """Model holding running totals of an assignment's submissions, reviews and results."""
+    
+    assignment = models.OneToOneField(Assignment, on_delete=models.CASCADE, related_name='stats')
+    submission_count = models.PositiveIntegerField('Submissions', default=0)
+    student_count = models.PositiveIntegerField('Students', default=0)  # Students with at least one submission
+    pending_count = models.PositiveIntegerField('Pending', default=0)
+    verified_count = models.PositiveIntegerField('Verified', default=0)
+    reviewed_count = models.PositiveIntegerField('Reviewed', default=0)
+    verification_count = models.PositiveIntegerField('Verification Results', default=0)
+    syntax_passed_count = models.PositiveIntegerField('Syntax Checks Passed', default=0)
+    plagiarism_score_sum = models.FloatField('Plagiarism Score Sum', default=0.0)
+    tests_passed_sum = models.PositiveIntegerField('Tests Passed Sum', default=0)
+    tests_total_sum = models.PositiveIntegerField('Tests Total Sum', default=0)
+    review_count = models.PositiveIntegerField('Reviews', default=0)
+    graded_count = models.PositiveIntegerField('Graded Reviews', default=0)
+    grade_sum = models.PositiveIntegerField('Grade Sum', default=0)
+    grade_distribution = models.JSONField('Grade Distribution', default=dict, blank=True)  # Grade -> review count
+    updated_at = models.DateTimeField('Updated At', auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Assignment Statistics'
+        verbose_name_plural = 'Assignment Statistics'
+    
+    def __str__(self):
+        return f"Statistics for {self.assignment}"
+    
+    @property
+    def average_plagiarism_score(self):
+        if not self.verification_count:
+            return None
+        return self.plagiarism_score_sum / self.verification_count
+    
+    @property
+    def average_grade(self):
+        if not self.graded_count:
+            return None
+        return self.grade_sum / self.graded_count
+    
+    @property
+    def test_pass_rate(self):
+        if not self.tests_total_sum:
+            return None
+        return self.tests_passed_sum / self.tests_total_sum
@@ -0,0 +1,154 @@
+"""
+Warm pool of pylint worker processes.
+
+Starting pylint costs about a second of interpreter and astroid start-up per
+file. The pool keeps a few processes with pylint already imported and sends
+them file paths over a pipe, so each check only pays for the lint itself.
+This module must not import Django: the workers are started with the
+``spawn`` method and only load what they need.
+"""
+import atexit
+import importlib.util
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# Times a check is resubmitted after another check restarted its pool
+RESTART_RETRIES = 2
+
+# Seconds between checks of whether a waited-on pool was restarted
+_POLL_INTERVAL = 0.5
+
+
+def _init_worker():
+    """Import pylint once when a worker process starts."""
+    import pylint.lint  # noqa: F401
+    import pylint.reporters.text  # noqa: F401
+
+
+def _lint(file_path):
+    """
+    Run pylint on a file inside a worker process.
+
+    Returns:
+        int: Pylint message status (0 when no errors were found)
+        str: Pylint report
+    """
+    from astroid import MANAGER
+    from pylint.lint import Run
+    from pylint.reporters.text import TextReporter
+
+    output = io.StringIO()
+    try:
+        run = Run(['--errors-only', file_path], reporter=TextReporter(output), exit=False)
+        return run.linter.msg_status, output.getvalue()
+    finally:
+        # Do not let a cached AST leak into the next check of the same path
+        path = os.path.abspath(file_path)
+        for name, module in list(MANAGER.astroid_cache.items()):
+            if module.file and os.path.abspath(module.file) == path:
+                del MANAGER.astroid_cache[name]
+
+
+def pylint_available():
+    """Return True if pylint can be imported in this environment."""
+    return importlib.util.find_spec('pylint') is not None
+
+
+def get_pool(processes, max_tasks_per_child):
+    """
+    Return the process-wide pylint pool, starting it on first use.
+
+    A pool inherited from a parent process is never reused.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            context = multiprocessing.get_context('spawn')
+            _pool = context.Pool(
+                processes=processes,
+                initializer=_init_worker,
+                maxtasksperchild=max_tasks_per_child,
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def close_pool():
+    """Terminate the pylint pool if it is running."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.terminate()
+            _pool.join()
+        _pool = None
+        _pool_pid = None
+
+
+def _restart_pool(pool):
+    """
+    Terminate a pool with a stuck worker, unless it was already replaced.
+
+    The next get_pool() starts a fresh pool. Checks still waiting on the
+    terminated one notice the replacement and resubmit themselves.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not pool:
+            return
+        _pool = None
+        _pool_pid = None
+    pool.terminate()
+    pool.join()
+
+
+def lint_file(file_path, processes, max_tasks_per_child=None, timeout=None):
+    """
+    Lint a file with errors-only pylint in the warm pool.
+
+    A timed-out check restarts the pool it ran in so a stuck worker is not
+    reused. Other checks that were waiting on that pool are resubmitted to
+    the new one, up to RESTART_RETRIES times, each with a fresh timeout.
+
+    Args:
+        file_path: Path to the Python file
+        processes: Number of pool processes
+        max_tasks_per_child: Files after which a worker is replaced
+        timeout: Seconds to wait for the result
+
+    Returns:
+        int: Pylint message status (0 when no errors were found)
+        str: Pylint report
+
+    Raises:
+        multiprocessing.TimeoutError: If the check did not finish in time
+    """
+    for attempt in range(RESTART_RETRIES + 1):
+        pool = get_pool(processes, max_tasks_per_child)
+        result = pool.apply_async(_lint, (file_path,))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not result.ready():
+            if _pool is not pool:
+                # Restarted because of another check, this one was lost with it
+                break
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                _restart_pool(pool)
+                raise multiprocessing.TimeoutError
+            result.wait(_POLL_INTERVAL if remaining is None else min(remaining, _POLL_INTERVAL))
+        if result.ready():
+            return result.get()
+        logger.warning(f"Pylint pool restarted while checking {file_path}, retrying")
+    raise multiprocessing.TimeoutError
+
+
+atexit.register(close_pool)
@@ -0,0 +1,157 @@
+"""
+Content-addressed cache of syntax check results.
+
+Results are keyed by the SHA-256 of the checked file's content together with
+the checker's name and version, so resubmissions of identical files (or the
+same starter file uploaded by many students) are answered without running
+the checker again, and upgrading pylint or g++ invalidates old entries.
+"""
+import hashlib
+import importlib.metadata
+import subprocess
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+
+# Placeholder for the checked file's path inside cached checker output
+_PATH_PLACEHOLDER = '\x00path\x00'
+_MODULE_PLACEHOLDER = '\x00module\x00'
+
+
+class CheckResultCache:
+    """Thread-safe LRU mapping of cache keys to check results, bounded by entries and bytes."""
+
+    # Approximate bytes of the tuples, strings and dict slot of an entry
+    # besides the characters of its strings
+    ENTRY_OVERHEAD = 400
+
+    def __init__(self, max_entries, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @classmethod
+    def entry_size(cls, key, value):
+        """Return the approximate memory used by an entry."""
+        strings = [part for part in (*key, *value) if isinstance(part, str)]
+        return cls.ENTRY_OVERHEAD + sum(len(string) for string in strings)
+
+    def get(self, key):
+        """Return the cached value for a key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries."""
+        size = self.entry_size(key, value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Larger than the whole cache, it would only evict everything else
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self.size > self.max_bytes
+            ):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide check result cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CheckResultCache(
+                settings.VERIFICATION_CHECK_CACHE_SIZE, settings.VERIFICATION_CHECK_CACHE_MAX_BYTES
+            )
+        return _cache
+
+
+@lru_cache(maxsize=None)
+def checker_version(checker):
+    """
+    Return the installed version of a checker program.
+
+    Args:
+        checker: 'pylint' or 'g++'
+
+    Returns:
+        str: Version string, empty if it cannot be determined
+    """
+    if checker == 'pylint':
+        try:
+            return importlib.metadata.version('pylint')
+        except importlib.metadata.PackageNotFoundError:
+            pass
+        command = ['pylint', '--version']
+    else:
+        command = [checker, '--version']
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, check=False)
+    except OSError:
+        return ''
+    return result.stdout.strip()
+
+
+def file_key(file_path, checker, options='', content_hash=None):
+    """
+    Build the cache key of a file for a checker.
+
+    Args:
+        file_path: Path to the checked file
+        checker: Name of the checker program
+        options: Checker options that influence the result
+        content_hash: SHA-256 of the file's content if already known (e.g.
+            Submission.content_hash), saves reading and hashing the file
+
+    Returns:
+        tuple: (content hash, checker, options, checker version)
+    """
+    if not content_hash:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(65536), b''):
+                digest.update(block)
+        content_hash = digest.hexdigest()
+    return content_hash, checker, options, checker_version(checker)
+
+
+def _module_name(file_path):
+    return file_path.replace('\\', '/').rsplit('/', 1)[-1].rsplit('.', 1)[0]
+
+
+def make_portable(output, file_path):
+    """Replace the file's path and module name in checker output with placeholders."""
+    output = output.replace(file_path, _PATH_PLACEHOLDER)
+    return output.replace(f"Module {_module_name(file_path)}\n", f"Module {_MODULE_PLACEHOLDER}\n")
+
+
+def restore(output, file_path):
+    """Fill the placeholders of portable checker output for a file."""
+    output = output.replace(_PATH_PLACEHOLDER, file_path)
+    return output.replace(_MODULE_PLACEHOLDER, _module_name(file_path))
@@ -0,0 +1,524 @@
+"""
+Resource-limited execution of untrusted programs.
+
+Every program is started by the zygote, a helper process running this
+module as a script. For each request, the zygote forks a runner, which
+forks the program and waits for it. The program runs in its own session
+with rlimits on CPU time, address space, written file size, open files and
+processes. When a wall-clock limit passes, it is killed with its whole
+process group. Standard streams go through files in the run directory, so
+RLIMIT_FSIZE also caps the output and no pipe can fill up. The program is
+set up in a fork of the single-threaded zygote and never in a fork of a
+threaded server process, where only async-signal-safe code may run before
+exec.
+
+The zygote moves itself into a new network namespace when it starts, in
+which only a loopback interface exists and is down. Programs therefore
+cannot reach the database or any other service, local or remote. If the
+namespace cannot be created, the zygote refuses to start.
+
+Python scripts run directly in the fork, which starts from a warm
+interpreter that already imported the commonly used standard library.
+Other programs, and Python in a fresh interpreter, are exec'd.
+
+Given a user, the zygote checks when it starts that it can switch to that
+unprivileged uid and gid, which needs root or CAP_SETUID and CAP_SETGID.
+Programs then run as that user with no supplementary groups. A program
+enters its run directory before switching users and is started through a
+path relative to it. The user therefore needs no access to any directory
+above the run directory, and must not have any to the project's own files
+(settings, media, database credentials).
+
+A run that fails because of the sandbox rather than the program raises
+SandboxError. The zygote must only import the standard library.
+"""
+import builtins
+import io
+import itertools
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import types
+from collections import namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+RunResult = namedtuple('RunResult', [
+    'exit_code',    # Exit status, negative signal number if killed
+    'output',       # Standard output, at most output_limit bytes
+    'errors',       # Standard error, at most ERRORS_LIMIT bytes
+    'wall_time',    # Seconds
+    'cpu_time',     # Seconds of user and system time
+    'max_memory',   # Peak resident memory in bytes
+    'timed_out',    # Killed by the wall-clock limit
+    'output_truncated',
+])
+
+ERRORS_LIMIT = 64 * 1024
+
+# unshare() flags, see sched.h
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWNET = 0x40000000
+
+# Minimal environment of sandboxed programs
+SANDBOX_ENV = {'PATH': '/usr/local/bin:/usr/bin:/bin', 'LANG': 'C.UTF-8', 'PYTHONIOENCODING': 'utf-8'}
+
+
+def _limit_resources(cpu_time, memory, output_limit, max_processes):
+    """Return the function setting the rlimits in the child process."""
+    cpu_seconds = max(1, int(cpu_time + 0.999))
+
+    def set_limits():
+        # SIGXCPU at the soft limit, SIGKILL one second later
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+        # One byte over the limit, so that reaching it is detected as truncation
+        resource.setrlimit(resource.RLIMIT_FSIZE, (output_limit + 1, output_limit + 1))
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        resource.setrlimit(resource.RLIMIT_NOFILE, (64, 64))
+        if max_processes:
+            resource.setrlimit(resource.RLIMIT_NPROC, (max_processes, max_processes))
+
+    return set_limits
+
+
+def _kill_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def _read_limited(path, limit):
+    with open(path, 'rb') as f:
+        data = f.read(limit + 1)
+    return data[:limit], len(data) > limit
+
+
+def _stream_paths(work_dir, input_data):
+    """Write the input of a run and return the paths of its standard streams."""
+    paths = tuple(os.path.join(work_dir, name) for name in ('.stdin', '.stdout', '.stderr'))
+    with open(paths[0], 'wb') as f:
+        f.write(input_data)
+    return paths
+
+
+def _run_result(stdout_path, stderr_path, output_limit, exit_code, wall, cpu, max_memory, timed_out):
+    output, truncated = _read_limited(stdout_path, output_limit)
+    errors, _ = _read_limited(stderr_path, ERRORS_LIMIT)
+    return RunResult(
+        exit_code=exit_code,
+        output=output,
+        errors=errors,
+        wall_time=wall,
+        cpu_time=cpu,
+        max_memory=max_memory,
+        timed_out=timed_out,
+        output_truncated=truncated or exit_code == -signal.SIGXFSZ,
+    )
+
+
+class SandboxError(RuntimeError):
+    """The sandbox could not run a program; not the program's fault."""
+
+
+class PythonZygote:
+    """
+    Client of a zygote process running sandboxed programs.
+
+    Runs may be requested from many threads at once; the zygote forks a
+    runner per request, so they execute in parallel.
+    """
+
+    def __init__(self, python, user=None):
+        """
+        Start a zygote.
+
+        Args:
+            python: Python interpreter running the zygote and fresh interpreters
+            user: Optional (uid, gid) programs run as
+
+        Raises:
+            SandboxError: If the zygote cannot sandbox programs, e.g. it
+                lacks the privileges to switch to the user
+        """
+        self.user = user
+        self.process = subprocess.Popen(
+            [python, '-I', '-B', os.path.abspath(__file__), '%d:%d' % user if user else ''],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=SANDBOX_ENV,
+            close_fds=True,
+            start_new_session=True,
+        )
+        # The zygote reports whether it can sandbox programs before accepting runs
+        line = self.process.stdout.readline()
+        ready = json.loads(line) if line else {'error': "The Python zygote exited on startup."}
+        if 'error' in ready:
+            self.close()
+            raise SandboxError(ready['error'])
+
+        self._pending = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        threading.Thread(target=self._read_replies, name='zygote-replies', daemon=True).start()
+
+    def _read_replies(self):
+        for line in self.process.stdout:
+            reply = json.loads(line)
+            with self._lock:
+                future = self._pending.pop(reply['id'], None)
+            if future is not None:
+                future.set_result(reply)
+        # The zygote exited, runs still waiting will never get a reply
+        with self._lock:
+            self._closed = True
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(SandboxError("The Python zygote exited."))
+
+    def alive(self):
+        """Return whether the zygote still accepts runs."""
+        return not self._closed and self.process.poll() is None
+
+    def close(self):
+        """Stop the zygote; runs in progress are finished by their runners."""
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+
+    def run(self, script_path, input_data, work_dir, cpu_time, memory, wall_time=None,
+            output_limit=1024 * 1024, max_processes=None):
+        """
+        Run a Python script in a fork of the zygote.
+
+        The script is read before switching users, so it may lie outside
+        the directories the sandbox user can access.
+
+        Args:
+            script_path: Path to the script
+            input_data: Bytes passed on standard input
+            work_dir: Empty directory the program runs in
+            cpu_time: CPU time limit in seconds
+            memory: Address space limit in bytes
+            wall_time: Wall-clock limit in seconds, defaults to twice the CPU limit plus one
+            output_limit: Maximum bytes the program may write to one file or stdout
+            max_processes: Optional RLIMIT_NPROC value (counts all processes of the user)
+
+        Returns:
+            RunResult: Outcome of the run
+
+        Raises:
+            SandboxError: If the run failed because of the sandbox
+        """
+        return self._request(
+            {'script': os.path.abspath(script_path)},
+            input_data, work_dir, cpu_time, memory, wall_time, output_limit, max_processes
+        )
+
+    def execute(self, command, input_data, work_dir, cpu_time, memory, wall_time=None,
+                output_limit=1024 * 1024, max_processes=None):
+        """
+        Exec a program in a fork of the zygote, with the arguments of run().
+
+        Args:
+            command: Program and arguments; a relative program path is
+                resolved from work_dir, other names are looked up on PATH
+        """
+        return self._request(
+            {'command': list(command)},
+            input_data, work_dir, cpu_time, memory, wall_time, output_limit, max_processes
+        )
+
+    def _request(self, program, input_data, work_dir, cpu_time, memory, wall_time, output_limit, max_processes):
+        if wall_time is None:
+            wall_time = cpu_time * 2 + 1
+
+        stdin_path, stdout_path, stderr_path = _stream_paths(work_dir, input_data)
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise SandboxError("The Python zygote exited.")
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            request = {
+                'id': request_id,
+                **program,
+                'cwd': work_dir,
+                'streams': [stdin_path, stdout_path, stderr_path],
+                'limits': [cpu_time, memory, output_limit, max_processes],
+                'wall_time': wall_time,
+            }
+            try:
+                self.process.stdin.write(json.dumps(request).encode('utf-8') + b'\n')
+                self.process.stdin.flush()
+            except OSError:
+                self._pending.pop(request_id, None)
+                raise
+        try:
+            # The runner enforces the wall-clock limit, this only guards against a lost reply
+            reply = future.result(timeout=wall_time + 30)
+        except FutureTimeoutError:
+            raise SandboxError("No reply from the Python zygote.")
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+        if 'error' in reply:
+            raise SandboxError(reply['error'])
+
+        return _run_result(
+            stdout_path, stderr_path, output_limit,
+            exit_code=reply['exit_code'],
+            wall=reply['wall_time'],
+            cpu=reply['cpu_time'],
+            max_memory=reply['max_memory'],
+            timed_out=reply['timed_out'],
+        )
+
+
+# Imported by the zygote before forking, so runs find them loaded
+ZYGOTE_PRELOAD = (
+    'array', 'bisect', 'collections', 'copy', 'dataclasses', 'datetime', 'decimal', 'fractions',
+    'functools', 'heapq', 'itertools', 'math', 'operator', 'random', 're', 'statistics', 'string',
+    'typing',
+)
+
+
+def _drop_privileges(user):
+    uid, gid = user
+    os.setgroups([])
+    os.setgid(gid)
+    os.setuid(uid)
+
+
+def _zygote_program(request, user, error_fd):
+    """
+    Set up a forked child and run the program of a request in it. Never returns.
+
+    Failures before the program starts are written to error_fd, which is
+    closed (or closed on exec) once it runs.
+    """
+    try:
+        os.setsid()
+        stdin_path, stdout_path, stderr_path = request['streams']
+        for target, path, flags in (
+            (0, stdin_path, os.O_RDONLY),
+            (1, stdout_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC),
+            (2, stderr_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC),
+        ):
+            fd = os.open(path, flags, 0o600)
+            os.dup2(fd, target)
+            os.close(fd)
+        # The zygote's request and reply pipes
+        os.closerange(3, error_fd)
+        os.closerange(error_fd + 1, os.sysconf('SC_OPEN_MAX'))
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(SANDBOX_ENV)
+        for signum in (signal.SIGCHLD, signal.SIGALRM):
+            signal.signal(signum, signal.SIG_DFL)
+        _limit_resources(*request['limits'])()
+
+        if 'command' in request:
+            if user:
+                _drop_privileges(user)
+            os.execvp(request['command'][0], request['command'])
+
+        import random
+        random.seed()
+        script = request['script']
+        with open(script, 'rb') as f:
+            code = compile(f.read(), script, 'exec', dont_inherit=True)
+        if user:
+            _drop_privileges(user)
+        sys.stdin = sys.__stdin__ = open(0, 'r', encoding='utf-8', closefd=False)
+        sys.stdout = sys.__stdout__ = open(1, 'w', encoding='utf-8', closefd=False)
+        sys.stderr = sys.__stderr__ = io.TextIOWrapper(
+            open(2, 'wb', buffering=0, closefd=False), encoding='utf-8', errors='backslashreplace',
+            line_buffering=True
+        )
+        sys.argv = [script]
+        main = types.ModuleType('__main__')
+        main.__file__ = script
+        main.__builtins__ = builtins
+        sys.modules['__main__'] = main
+    except BaseException as e:
+        try:
+            os.write(error_fd, f"Sandbox setup failed: {type(e).__name__}: {e}".encode('utf-8')[:4096])
+        finally:
+            os._exit(1)
+    os.close(error_fd)
+
+    exit_code = 0
+    try:
+        exec(code, main.__dict__)
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException as e:
+        # Leave this function's frame out of the traceback, like the interpreter does
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        exit_code = 1
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    except BaseException:
+        # What the interpreter exits with when flushing fails
+        exit_code = 120
+    os._exit(exit_code & 0xFF)
+
+
+def _zygote_runner(request, user, reply_fd):
+    """Fork the program of a request, wait for it and write the reply."""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    # Close on exec, so a successful exec leaves it empty
+    error_read, error_write = os.pipe()
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(error_read)
+        _zygote_program(request, user, error_write)
+    os.close(error_write)
+
+    timed_out = False
+
+    def on_timeout(signum, frame):
+        nonlocal timed_out
+        timed_out = True
+        _kill_group(pid)
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, request['wall_time'])
+    _, status, usage = os.wait4(pid, 0)
+    signal.setitimer(signal.ITIMER_REAL, 0)
+    wall = time.perf_counter() - start
+    _kill_group(pid)
+
+    with os.fdopen(error_read, 'rb') as f:
+        setup_error = f.read().decode('utf-8', errors='replace')
+    if setup_error:
+        reply = {'id': request['id'], 'error': setup_error}
+    else:
+        reply = {
+            'id': request['id'],
+            'exit_code': os.waitstatus_to_exitcode(status),
+            'wall_time': wall,
+            'cpu_time': usage.ru_utime + usage.ru_stime,
+            'max_memory': usage.ru_maxrss * 1024,
+            'timed_out': timed_out,
+        }
+    # Replies are shorter than PIPE_BUF, so runners never interleave them
+    os.write(reply_fd, json.dumps(reply).encode('utf-8') + b'\n')
+
+
+def _unshare(flags):
+    if hasattr(os, 'unshare'):
+        os.unshare(flags)
+        return
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.unshare(flags) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+def _isolate_network(user):
+    """Return why the zygote could not leave the host's network, None if it did."""
+    try:
+        _unshare(CLONE_NEWNET)
+        return None
+    except PermissionError:
+        if user:
+            # A user namespace would take away the right to switch to the user
+            return "Cannot isolate the network of sandboxed programs: CAP_SYS_ADMIN is required"
+    except OSError as e:
+        return f"Cannot isolate the network of sandboxed programs: {str(e)}"
+    # Unprivileged, a new user namespace grants the right to create the network namespace
+    try:
+        _unshare(CLONE_NEWUSER | CLONE_NEWNET)
+    except OSError as e:
+        return f"Cannot isolate the network of sandboxed programs: {str(e)}"
+    return None
+
+
+def _check_user(user):
+    """Return why programs cannot be switched to a user, None if they can."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _drop_privileges(user)
+        except BaseException:
+            os._exit(1)
+        os._exit(0)
+    _, status = os.waitpid(pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0:
+        return (
+            f"Cannot switch sandboxed programs to uid {user[0]}, gid {user[1]}: "
+            "run the verification workers as root or with CAP_SETUID and CAP_SETGID"
+        )
+    return None
+
+
+def serve_zygote(user=None):
+    """
+    Main loop of the zygote: fork a runner for every request on stdin.
+
+    Args:
+        user: Optional (uid, gid) programs run as
+    """
+    for name in ZYGOTE_PRELOAD:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+
+    requests = os.fdopen(os.dup(0), 'rb')
+    reply_fd = os.dup(1)
+    null_fd = os.open(os.devnull, os.O_RDWR)
+    os.dup2(null_fd, 0)
+    os.dup2(null_fd, 1)
+    os.close(null_fd)
+
+    problem = _isolate_network(user) or (_check_user(user) if user else None)
+    os.write(reply_fd, json.dumps({'error': problem} if problem else {'ready': True}).encode('utf-8') + b'\n')
+    if problem:
+        return
+
+    # Finished runners are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    for line in requests:
+        request = json.loads(line)
+        try:
+            pid = os.fork()
+        except OSError as e:
+            os.write(reply_fd, json.dumps({'id': request['id'], 'error': str(e)}).encode('utf-8') + b'\n')
+            continue
+        if pid == 0:
+            try:
+                _zygote_runner(request, user, reply_fd)
+            except BaseException as e:
+                os.write(reply_fd, json.dumps({'id': request['id'], 'error': str(e)}).encode('utf-8') + b'\n')
+            finally:
+                os._exit(0)
+
+
+if __name__ == '__main__':
+    serve_zygote(tuple(int(part) for part in sys.argv[1].split(':')) if sys.argv[1:] and sys.argv[1] else None)
@@ -2,73 +2,306 @@ import os
 import subprocess
 import tempfile
 import shutil
-import textdistance
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, TextField, Value, When
+from django.db.models.functions import Replace
 import logging
 
+from .models import CodeComment, Submission, TeacherReview, TestCaseResult, VerificationResult
+from .grading import compile_error_results, run_test_cases
+from .fingerprints import (
+    FINGERPRINT_VERSION, assignment_index, fingerprint_file, get_submission_fingerprint, index_assignment,
+    unpack_fingerprints
+)
+from . import cache_versions, cpp_checker, metrics, result_cache, stats
+from .pylint_pool import lint_file, pylint_available
+from .corpus import search_corpus
+from .minhash import MinHasher, jaccard_pairs, lsh_candidate_pairs
+from .winnowing import FingerprintIndex
+
 logger = logging.getLogger(__name__)
 
+CPP_EXTENSIONS = ['.cpp', '.cc', '.cxx', '.c++']
+
 class SyntaxChecker:
     """Class for checking syntax of code files."""
     
     @staticmethod
-    def check_python(file_path):
+    def precheck_python(file_path):
+        """
+        Compile Python source to catch syntax errors without running pylint.
+        
+        Returns:
+            bool: Whether the file compiles
+            str: Pylint-style syntax error message, None if it compiles
+        """
+        with open(file_path, 'rb') as f:
+            source = f.read()
+        try:
+            compile(source, file_path, 'exec', dont_inherit=True)
+        except SyntaxError as e:
+            return False, f"{file_path}:{e.lineno or 1}:{e.offset or 0}: E0001: {e.msg} (syntax-error)"
+        except ValueError as e:
+            return False, f"{file_path}:1:0: E0001: {str(e)} (syntax-error)"
+        return True, None
+    
+    @staticmethod
+    def cached_check(checker, options, file_path, check, content_hash=None):
+        """
+        Run a syntax check through the content-addressed result cache.
+        
+        Args:
+            checker: Name of the checker program
+            options: Checker options that influence the result
+            file_path: Path to the file to check
+            check: Callable running the check on a file path
+            content_hash: SHA-256 of the file's content if already known
+            
+        Returns:
+            bool: Whether the check passed
+            str: Checker output
+        """
+        try:
+            key = result_cache.file_key(file_path, checker, options, content_hash)
+        except Exception as e:
+            logger.error(f"Error hashing {file_path} for the check cache: {str(e)}")
+            return check(file_path)
+        
+        cache = result_cache.get_cache()
+        cached = cache.get(key)
+        if cached is not None:
+            passed, output = cached
+            return passed, result_cache.restore(output, file_path)
+        
+        passed, output = check(file_path)
+        # Failures of the checker itself are not properties of the file
+        if not output.startswith('Error checking syntax:'):
+            cache.set(key, (passed, result_cache.make_portable(output, file_path)))
+        return passed, output
+    
+    @classmethod
+    def check_python(cls, file_path, content_hash=None):
         """Check Python syntax using pylint."""
+        return cls.cached_check('pylint', '--errors-only', file_path, cls._check_python_uncached, content_hash)
+    
+    @classmethod
+    def _check_python_uncached(cls, file_path):
         try:
-            result = subprocess.run(
-                ['pylint', '--errors-only', file_path],
-                capture_output=True,
-                text=True,
-                check=False
-            )
+            # Files that do not even compile skip the linter entirely
+            with metrics.stage('compile'):
+                compiles, compile_error = cls.precheck_python(file_path)
+            if not compiles:
+                return False, compile_error
             
-            if result.returncode == 0:
+            with metrics.stage('pylint'):
+                if settings.VERIFICATION_PYLINT_WORKERS > 0 and pylint_available():
+                    returncode, output = lint_file(
+                        file_path,
+                        processes=settings.VERIFICATION_PYLINT_WORKERS,
+                        max_tasks_per_child=settings.VERIFICATION_PYLINT_MAX_TASKS,
+                        timeout=settings.VERIFICATION_PYLINT_TIMEOUT,
+                    )
+                else:
+                    result = subprocess.run(
+                        ['pylint', '--errors-only', file_path],
+                        capture_output=True,
+                        text=True,
+                        check=False
+                    )
+                    returncode, output = result.returncode, result.stdout or result.stderr
+            
+            if returncode == 0:
                 return True, "No syntax errors found."
             else:
-                return False, result.stdout or result.stderr
+                return False, output
         except Exception as e:
             logger.error(f"Error checking Python syntax: {str(e)}")
             return False, f"Error checking syntax: {str(e)}"
     
+    @classmethod
+    def check_cpp(cls, file_path, build=False, content_hash=None):
+        """
+        Check C++ syntax using g++ with precompiled standard headers.
+        
+        Args:
+            file_path: Path to the C++ file
+            build: Compile an executable instead, which the test runs then
+                take from the binary cache
+            content_hash: SHA-256 of the file's content if already known
+            
+        Returns:
+            bool: Whether the file compiles
+            str: Checker output
+        """
+        if build:
+            return cls.cached_check(
+                'g++', cpp_checker.cache_options(*cpp_checker.BUILD_FLAGS), file_path,
+                cls._build_cpp_uncached, content_hash
+            )
+        return cls.cached_check(
+            'g++', cpp_checker.cache_options('-fsyntax-only'), file_path, cls._check_cpp_uncached, content_hash
+        )
+    
     @staticmethod
-    def check_cpp(file_path):
-        """Check C++ syntax using g++ compiler."""
+    def _cpp_result(passed, output):
+        if passed:
+            return True, "No syntax errors found."
+        return False, output
+    
+    @classmethod
+    def _check_cpp_uncached(cls, file_path):
+        try:
+            return cls._cpp_result(*cpp_checker.check_files([file_path])[file_path])
+        except Exception as e:
+            logger.error(f"Error checking C++ syntax: {str(e)}")
+            return False, f"Error checking syntax: {str(e)}"
+    
+    @classmethod
+    def _build_cpp_uncached(cls, file_path):
         try:
-            result = subprocess.run(
-                ['g++', '-fsyntax-only', file_path],
-                capture_output=True,
-                text=True,
-                check=False
+            binary, output = cpp_checker.compile_binary(
+                file_path, timeout=settings.VERIFICATION_TEST_COMPILE_TIMEOUT
             )
+            return cls._cpp_result(binary is not None, output)
+        except Exception as e:
+            logger.error(f"Error compiling C++ file: {str(e)}")
+            return False, f"Error checking syntax: {str(e)}"
+    
+    @classmethod
+    def check_cpp_batch(cls, file_paths, content_hashes=None):
+        """
+        Check the syntax of many C++ files with as few g++ runs as possible.
+        
+        Args:
+            file_paths: List of paths to C++ files
+            content_hashes: Optional file path -> known SHA-256 of its content
             
-            if result.returncode == 0:
-                return True, "No syntax errors found."
+        Returns:
+            dict: File path -> (passed, errors)
+        """
+        cache = result_cache.get_cache()
+        content_hashes = content_hashes or {}
+        results = {}
+        pending = {}
+        for file_path in file_paths:
+            try:
+                key = result_cache.file_key(
+                    file_path, 'g++', cpp_checker.cache_options('-fsyntax-only'), content_hashes.get(file_path)
+                )
+            except Exception as e:
+                logger.error(f"Error hashing {file_path} for the check cache: {str(e)}")
+                key = None
+            cached = cache.get(key) if key else None
+            if cached is not None:
+                results[file_path] = (cached[0], result_cache.restore(cached[1], file_path))
             else:
-                return False, result.stderr
+                pending[file_path] = key
+        
+        if not pending:
+            return results
+        
+        try:
+            checked = cpp_checker.check_files(list(pending))
         except Exception as e:
             logger.error(f"Error checking C++ syntax: {str(e)}")
-            return False, f"Error checking syntax: {str(e)}"
+            for file_path in pending:
+                results[file_path] = (False, f"Error checking syntax: {str(e)}")
+            return results
+        
+        for file_path, key in pending.items():
+            passed, output = cls._cpp_result(*checked[file_path])
+            results[file_path] = (passed, output)
+            # Failures of the compiler itself are not properties of the file
+            if key and not output.startswith('Error checking syntax:'):
+                cache.set(key, (passed, result_cache.make_portable(output, file_path)))
+        return results
     
     @classmethod
-    def check_file(cls, file_path):
+    def check_file(cls, file_path, content_hash=None):
         """Check syntax based on file extension."""
         _, extension = os.path.splitext(file_path)
         extension = extension.lower()
         
         if extension == '.py':
-            return cls.check_python(file_path)
-        elif extension in ['.cpp', '.cc', '.cxx', '.c++']:
-            return cls.check_cpp(file_path)
+            return cls.check_python(file_path, content_hash)
+        elif extension in CPP_EXTENSIONS:
+            return cls.check_cpp(file_path, content_hash=content_hash)
         else:
             return True, "File type not supported for syntax checking."
 
 class PlagiarismChecker:
     """Class for checking plagiarism in code files."""
     
+    @classmethod
+    def build_index(cls, reference_files):
+        """
+        Build a winnowing fingerprint index over reference files.
+        
+        Args:
+            reference_files: List of paths to reference files
+            
+        Returns:
+            FingerprintIndex: Index keyed by reference file path
+        """
+        index = FingerprintIndex()
+        for ref_file in reference_files:
+            try:
+                index.add(ref_file, fingerprint_file(ref_file))
+            except Exception as e:
+                logger.error(f"Error processing reference file {ref_file}: {str(e)}")
+        return index
+    
+    @classmethod
+    def check_index_similarity(cls, fingerprints, index, labels=None, exclude=None):
+        """
+        Score fingerprints against a fingerprint index.
+        
+        Args:
+            fingerprints: Fingerprint hashes of the checked file
+            index: FingerprintIndex of the reference documents
+            labels: Optional mapping of index keys to display names
+            exclude: Optional index key to skip (the checked file itself)
+            
+        Returns:
+            float: Similarity score (0-100)
+            str: Details of the similarity check
+        """
+        return cls.summarize_matches(index.query(fingerprints, exclude=exclude), labels)
+    
     @staticmethod
-    def check_code_similarity(file_path, reference_files):
+    def summarize_matches(matches, labels=None):
+        """
+        Turn index matches into a similarity score and report.
+        
+        Args:
+            matches: (key, similarity) pairs sorted by descending similarity
+            labels: Optional mapping of index keys to display names
+            
+        Returns:
+            float: Similarity score (0-100)
+            str: Details of the similarity check
+        """
+        if not matches:
+            return 0, ""
+        
+        def label(key):
+            if labels and key in labels:
+                return labels[key]
+            return os.path.basename(str(key))
+        
+        details = [f"Similarity with {label(key)}: {similarity:.2f}%" for key, similarity in matches]
+        max_key, max_similarity = matches[0]
+        details.append(f"Highest similarity ({max_similarity:.2f}%) found with {label(max_key)}")
+        return max_similarity, "\n".join(details)
+    
+    @classmethod
+    def check_code_similarity(cls, file_path, reference_files):
         """
-        Check code similarity using textdistance.
+        Check code similarity using winnowing fingerprints of normalized tokens.
         
         Args:
             file_path: Path to the file to check
@@ -79,35 +312,9 @@ class PlagiarismChecker:
             str: Details of the similarity check
         """
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                submission_code = f.read()
-            
-            max_similarity = 0
-            similar_file = None
-            details = []
-            
-            for ref_file in reference_files:
-                try:
-                    with open(ref_file, 'r', encoding='utf-8') as f:
-                        reference_code = f.read()
-                    
-                    # Calculate similarity using Jaccard similarity
-                    similarity = textdistance.jaccard.normalized_similarity(
-                        submission_code, reference_code
-                    ) * 100
-                    
-                    details.append(f"Similarity with {os.path.basename(ref_file)}: {similarity:.2f}%")
-                    
-                    if similarity > max_similarity:
-                        max_similarity = similarity
-                        similar_file = os.path.basename(ref_file)
-                except Exception as e:
-                    logger.error(f"Error processing reference file {ref_file}: {str(e)}")
-            
-            if max_similarity > 0:
-                details.append(f"Highest similarity ({max_similarity:.2f}%) found with {similar_file}")
-            
-            return max_similarity, "\n".join(details)
+            fingerprints = fingerprint_file(file_path)
+            index = cls.build_index(reference_files)
+            return cls.check_index_similarity(fingerprints, index)
         except Exception as e:
             logger.error(f"Error checking code similarity: {str(e)}")
             return 0, f"Error checking similarity: {str(e)}"
@@ -143,38 +350,249 @@ class PlagiarismChecker:
             float: Plagiarism score (0-100)
             str: Details of the plagiarism check
         """
-        # For now, we'll use textdistance for similarity checking
+        # For now, we'll use winnowing fingerprints for similarity checking
         return cls.check_code_similarity(file_path, reference_files)
 
-def verify_submission(submission):
+def find_similar_pairs(assignment, threshold, limit=None):
     """
-    Verify a submission by checking syntax and plagiarism.
+    Find the most similar pairs of submissions of an assignment above a threshold.
+    
+    MinHash signatures of every submission are computed in one batch and LSH
+    banding selects candidate pairs; only candidates get an exact Jaccard
+    score over their fingerprint sets, computed for all of them at once.
+    The submissions are those of the assignment index (see
+    fingerprints.index_assignment), whose fingerprints are read with one query.
+    
+    LSH only finds nearly all pairs at or above
+    minhash.LSH_RELIABLE_THRESHOLD; below it less similar pairs may be
+    missing. Near-duplicate clusters larger than minhash.LSH_MAX_BUCKET_SIZE
+    are reported as each member paired with one representative.
+    
+    Args:
+        assignment: Assignment model instance
+        threshold: Minimum similarity (0-100) of reported pairs
+        limit: Maximum number of pairs returned, by default
+            VERIFICATION_SIMILARITY_MAX_PAIRS
+        
+    Returns:
+        list: Dicts describing the most similar pairs, sorted by descending similarity
+        int: Number of candidate pairs that were scored exactly
+        int: Number of pairs above the threshold, including those past the limit
+    """
+    if limit is None:
+        limit = settings.VERIFICATION_SIMILARITY_MAX_PAIRS
+    index_assignment(assignment)
+    submissions = list(
+        assignment.submissions
+        .filter(fingerprint__version=FINGERPRINT_VERSION)
+        .exclude(fingerprint__fingerprints=b'')
+        .select_related('student', 'fingerprint').defer('fingerprint__tokens')
+    )
+    fingerprint_arrays = [
+        np.frombuffer(bytes(submission.fingerprint.fingerprints), dtype='<u8') for submission in submissions
+    ]
+    
+    signatures = MinHasher().signatures(fingerprint_arrays)
+    candidates = np.array(sorted(lsh_candidate_pairs(signatures)), dtype=np.int64).reshape(-1, 2)
+    similarities = jaccard_pairs(fingerprint_arrays, candidates)
+    
+    above = np.flatnonzero(similarities >= threshold)
+    # Stable sort keeps pairs of equal similarity in submission order
+    top = above[np.argsort(-similarities[above], kind='stable')[:limit]]
+    pairs = []
+    for row in top:
+        submission_a, submission_b = submissions[candidates[row, 0]], submissions[candidates[row, 1]]
+        pairs.append({
+            'submission_a': submission_a.id,
+            'student_a': submission_a.student.full_name,
+            'submission_b': submission_b.id,
+            'student_b': submission_b.student.full_name,
+            'similarity': round(float(similarities[row]), 2),
+        })
+    return pairs, len(candidates), len(above)
+
+def check_submission_plagiarism(submission, index=None):
+    """
+    Score a submission against the other submissions of its assignment
+    and the historical corpus.
     
     Args:
         submission: Submission model instance
+        index: Optional up-to-date AssignmentIndex of the assignment (see
+            fingerprints.assignment_index); the submission itself is skipped
         
     Returns:
-        dict: Verification results
+        float: Plagiarism score (0-100)
+        str: Details of the plagiarism check
+        list: (submission id, similarity) of the matched submissions of the
+        assignment
     """
-    # Create a temporary directory for verification
-    temp_dir = tempfile.mkdtemp(dir=settings.VERIFICATION_TEMP_DIR)
+    with metrics.stage('fingerprint'):
+        fingerprint = get_submission_fingerprint(submission)
+    if fingerprint is None:
+        return 0, "Error checking similarity: file could not be read.", []
+    
+    if index is None:
+        with metrics.stage('reference_index'):
+            index = assignment_index(submission.assignment)
+    with metrics.stage('similarity'):
+        fingerprints = unpack_fingerprints(fingerprint.fingerprints)
+        matches = index.query(fingerprints, exclude=submission.id)
+        labels = index.labels([submission_id for submission_id, _ in matches])
     
+    # Previous years' submissions from the historical corpus
     try:
-        # Get the file path
-        file_path = submission.file.path
-        
-        # Check syntax
-        syntax_passed, syntax_errors = SyntaxChecker.check_file(file_path)
+        with metrics.stage('corpus'):
+            corpus_matches, corpus_labels = search_corpus(fingerprints, exclude_assignment=submission.assignment_id)
+    except Exception as e:
+        logger.error(f"Error searching the submission corpus: {str(e)}")
+        corpus_matches, corpus_labels = [], {}
+    
+    score, details = PlagiarismChecker.summarize_matches(
+        sorted(matches + corpus_matches, key=lambda match: match[1], reverse=True),
+        {**labels, **corpus_labels}
+    )
+    return score, details, matches
+
+def propagate_plagiarism_scores(hits):
+    """
+    Update the results of earlier submissions matched by newly verified ones.
+    
+    Only the verification results hit in the index are touched, and the new
+    similarities are added to their details. Results whose score is raised
+    are locked and rewritten with one bulk update; the others only get the
+    new lines inserted before their "Highest similarity" line, with one
+    UPDATE statement and no lock. Must be called inside a transaction.
+    
+    Args:
+        hits: List of (submission, matches) of the newly verified
+            submissions, as returned by check_submission_plagiarism
         
-        # Get reference files (other submissions for the same assignment)
-        reference_files = []
-        for ref_submission in submission.assignment.submissions.exclude(id=submission.id):
-            reference_files.append(ref_submission.file.path)
+    Returns:
+        int: Number of updated verification results
+    """
+    similarities = defaultdict(list)
+    for submission, matches in hits:
+        for submission_id, similarity in matches:
+            similarities[submission_id].append((similarity, submission.filename))
+    if not similarities:
+        return 0
+    
+    raised = []
+    inserted = {}
+    rows = VerificationResult.objects.filter(submission_id__in=similarities).values_list(
+        'id', 'submission_id', 'plagiarism_score', 'plagiarism_details'
+    )
+    for result_id, submission_id, score, details in rows:
+        if '\nHighest similarity' not in details or max(similarities[submission_id])[0] > score:
+            raised.append(result_id)
+            continue
+        existing = set(details.splitlines())
+        lines = [
+            line for line in dict.fromkeys(
+                f"Similarity with {label}: {similarity:.2f}%"
+                for similarity, label in sorted(similarities[submission_id], reverse=True)
+            )
+            if line not in existing
+        ]
+        if lines:
+            inserted[result_id] = "\n".join(lines)
+    
+    if inserted:
+        VerificationResult.objects.filter(id__in=inserted).update(plagiarism_details=Case(
+            *(
+                When(id=result_id, then=Replace(
+                    F('plagiarism_details'), Value('\nHighest similarity'), Value(f"\n{lines}\nHighest similarity")
+                ))
+                for result_id, lines in inserted.items()
+            ),
+            default=F('plagiarism_details'),
+            output_field=TextField(),
+        ))
+    
+    results = list(VerificationResult.objects.select_for_update().filter(id__in=raised).order_by('id'))
+    previous_scores = {result.id: result.plagiarism_score for result in results}
+    for result in results:
+        lines = result.plagiarism_details.splitlines()
+        highest = lines.pop() if lines and lines[-1].startswith('Highest similarity') else None
+        for similarity, label in sorted(similarities[result.submission_id], reverse=True):
+            line = f"Similarity with {label}: {similarity:.2f}%"
+            if line not in lines:
+                lines.append(line)
+            if highest is None or similarity > result.plagiarism_score:
+                result.plagiarism_score = similarity
+                highest = f"Highest similarity ({similarity:.2f}%) found with {label}"
+        lines.append(highest)
+        result.plagiarism_details = "\n".join(lines)
+    
+    VerificationResult.objects.bulk_update(results, ['plagiarism_score', 'plagiarism_details'])
+    
+    submissions = dict(
+        Submission.objects.filter(id__in=similarities).values_list('id', 'assignment_id')
+    )
+    score_changes = defaultdict(float)
+    for result in results:
+        score_changes[submissions[result.submission_id]] += result.plagiarism_score - previous_scores[result.id]
+    for assignment_id, change in score_changes.items():
+        stats.apply_delta(assignment_id, {'plagiarism_score_sum': change})
+    cache_versions.bump_submissions(
+        Submission.objects.filter(id__in=similarities).values_list('student_id', flat=True)
+    )
+    return len(results) + len(inserted)
+
+def verify_submission(submission, index=None, syntax_result=None, test_cases=None):
+    """
+    Verify a submission by checking syntax and plagiarism and running its tests.
+    
+    Args:
+        submission: Submission model instance
+        index: Optional up-to-date AssignmentIndex of the assignment
+        syntax_result: Optional (passed, errors) from an earlier syntax check
+        test_cases: Optional test cases of the assignment, loaded if omitted
         
-        # Check plagiarism
-        plagiarism_score, plagiarism_details = PlagiarismChecker.check_plagiarism(
-            file_path, reference_files
-        )
+    Returns:
+        dict: Verification results; 'similar_submissions' holds the index
+        matches and 'test_results' the TestCaseResult values, neither is a
+        VerificationResult field
+    """
+    # Create a temporary directory for verification
+    temp_dir = tempfile.mkdtemp(dir=settings.VERIFICATION_TEMP_DIR)
+    timer = metrics.StageTimer()
+    
+    try:
+        with timer.activate():
+            # Get the file path
+            file_path = submission.file.path
+            
+            if test_cases is None:
+                test_cases = list(submission.assignment.test_cases.all())
+            
+            # Check syntax
+            is_cpp = os.path.splitext(file_path)[1].lower() in CPP_EXTENSIONS
+            if syntax_result is None:
+                with metrics.stage('syntax'):
+                    if test_cases and is_cpp:
+                        # Compile once for both the syntax check and the test runs
+                        syntax_result = SyntaxChecker.check_cpp(
+                            file_path, build=True, content_hash=submission.content_hash
+                        )
+                    else:
+                        syntax_result = SyntaxChecker.check_file(file_path, submission.content_hash)
+            syntax_passed, syntax_errors = syntax_result
+            
+            # Check plagiarism
+            with metrics.stage('plagiarism'):
+                plagiarism_score, plagiarism_details, matches = check_submission_plagiarism(
+                    submission, index=index
+                )
+            
+            # Run the test cases
+            with metrics.stage('tests'):
+                if is_cpp and not syntax_passed:
+                    # The compiler already failed, do not run it again
+                    test_results = compile_error_results(test_cases, syntax_errors)
+                else:
+                    test_results = run_test_cases(file_path, test_cases)
         
         # Return the results
         return {
@@ -182,7 +600,230 @@ def verify_submission(submission):
             'syntax_errors': syntax_errors,
             'plagiarism_score': plagiarism_score,
             'plagiarism_details': plagiarism_details,
+            'stage_timings': timer.as_dict(),
+            'tests_passed': sum(1 for result in test_results if result['status'] == 'passed'),
+            'tests_total': len(test_results),
+            'similar_submissions': matches,
+            'test_results': test_results,
         }
     finally:
         # Clean up the temporary directory
         shutil.rmtree(temp_dir, ignore_errors=True)
+
+def check_syntax_batch(file_paths, concurrency, content_hashes=None):
+    """
+    Check the syntax of many files with bounded parallelism.
+    
+    C++ files are checked in batched g++ runs. The other files are spread
+    over at most `concurrency` threads; the checks themselves run outside
+    the interpreter (warm pylint processes, compilers), so threads are
+    enough to keep that many checks in flight.
+    
+    Args:
+        file_paths: List of paths to check
+        concurrency: Maximum number of checks running at the same time
+        content_hashes: Optional file path -> known SHA-256 of its content
+        
+    Returns:
+        dict: File path -> (passed, errors)
+    """
+    cpp_files = [path for path in file_paths if os.path.splitext(path)[1].lower() in CPP_EXTENSIONS]
+    other_files = [path for path in file_paths if path not in cpp_files]
+    
+    content_hashes = content_hashes or {}
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        cpp_future = executor.submit(SyntaxChecker.check_cpp_batch, cpp_files, content_hashes) if cpp_files else None
+        hashes = [content_hashes.get(path) for path in other_files]
+        for path, result in zip(other_files, executor.map(SyntaxChecker.check_file, other_files, hashes)):
+            results[path] = result
+        if cpp_future is not None:
+            results.update(cpp_future.result())
+    return results
+
+def verify_submission_batch(assignment, submissions, concurrency):
+    """
+    Verify a batch of submissions of one assignment together.
+    
+    The fingerprint index of the assignment is brought up to date once for
+    the whole batch, C++ syntax checks share g++ runs, and all results are written
+    with a single bulk insert. Job workers run queued jobs of the same
+    assignment through here, so a bulk verification is spread over the
+    worker processes in batches.
+    
+    Args:
+        assignment: Assignment model instance
+        submissions: Submissions of the assignment to verify
+        concurrency: Maximum number of syntax checks running at the same time
+        
+    Returns:
+        list: Created VerificationResult instances
+    """
+    pending = list(submissions)
+    if not pending:
+        return []
+    
+    syntax_results = check_syntax_batch(
+        [submission.file.path for submission in pending], concurrency,
+        {submission.file.path: submission.content_hash for submission in pending}
+    )
+    index = assignment_index(assignment)
+    test_cases = list(assignment.test_cases.all())
+    
+    verification_results = []
+    hits = []
+    test_results = {}
+    for submission in pending:
+        verification_data = verify_submission(
+            submission, index=index,
+            syntax_result=syntax_results[submission.file.path], test_cases=test_cases
+        )
+        hits.append((submission, verification_data.pop('similar_submissions')))
+        test_results[submission.id] = verification_data.pop('test_results')
+        verification_results.append(VerificationResult(submission=submission, **verification_data))
+    
+    with transaction.atomic():
+        # Submissions verified concurrently by a job worker keep that result
+        unverified = set(
+            Submission.objects
+            .select_for_update(of=('self',))
+            .filter(id__in=[submission.id for submission in pending], verification_result__isnull=True)
+            .values_list('id', flat=True)
+        )
+        verification_results = [
+            result for result in verification_results if result.submission_id in unverified
+        ]
+        # The batch was scored against itself, only results from before it need updates
+        propagate_plagiarism_scores([
+            (submission, [match for match in matches if match[0] not in unverified])
+            for submission, matches in hits if submission.id in unverified
+        ])
+        VerificationResult.objects.bulk_create(verification_results)
+        TestCaseResult.objects.bulk_create([
+            TestCaseResult(verification_result=result, **values)
+            for result in verification_results
+            for values in test_results[result.submission_id]
+        ])
+        statuses = list(Submission.objects.filter(id__in=unverified).values_list('status', flat=True))
+        Submission.objects.filter(id__in=unverified).update(status='verified')
+        stats.apply_delta(assignment.id, stats.add_deltas(
+            stats.status_delta(statuses, -1),
+            stats.status_delta(['verified'] * len(statuses)),
+            *(stats.result_delta(result) for result in verification_results)
+        ))
+        cache_versions.bump_submissions(
+            submission.student_id for submission in pending if submission.id in unverified
+        )
+    return verification_results
+
+def record_verification(submission):
+    """
+    Verify a submission and store the result.
+    
+    Earlier submissions that the new one is similar to get their scores
+    updated as well.
+    
+    Args:
+        submission: Submission model instance
+        
+    Returns:
+        VerificationResult: The created verification result
+    """
+    verification_data = verify_submission(submission)
+    matches = verification_data.pop('similar_submissions')
+    test_results = verification_data.pop('test_results')
+    
+    with transaction.atomic():
+        verification_result = VerificationResult.objects.create(
+            submission=submission,
+            **verification_data
+        )
+        TestCaseResult.objects.bulk_create([
+            TestCaseResult(verification_result=verification_result, **values) for values in test_results
+        ])
+        propagate_plagiarism_scores([(submission, matches)])
+        
+        submission.status = 'verified'
+        submission.save(update_fields=['status'])
+    return verification_result
+
+def _lock_submissions(submission_ids):
+    """Return the existing submissions among these ids, locked until the transaction ends."""
+    return (
+        Submission.objects
+        .select_for_update()
+        .only('id', 'student_id', 'assignment_id', 'status')
+        .in_bulk(set(submission_ids))
+    )
+
+def add_code_comments(comments):
+    """
+    Store many code comments with one query.
+    
+    Bulk queries send no signals, so this bumps the cache versions itself.
+    
+    Args:
+        comments: Unsaved CodeComment instances
+    
+    Returns:
+        tuple: (created comments, submission ids of comments skipped because
+            their submission was deleted meanwhile)
+    """
+    with transaction.atomic():
+        submissions = _lock_submissions(comment.submission_id for comment in comments)
+        skipped = [comment.submission_id for comment in comments if comment.submission_id not in submissions]
+        comments = [comment for comment in comments if comment.submission_id in submissions]
+        CodeComment.objects.bulk_create(comments)
+        cache_versions.bump_submissions(submissions[comment.submission_id].student_id for comment in comments)
+    return comments, skipped
+
+def add_teacher_reviews(reviews):
+    """
+    Store many teacher reviews and mark their submissions reviewed, in one transaction.
+    
+    The reviews are inserted with one query and the submission statuses
+    updated with another. Bulk queries send no signals, so this applies the
+    statistics deltas and bumps the cache versions itself.
+    
+    Args:
+        reviews: Unsaved TeacherReview instances, at most one per submission
+    
+    Returns:
+        tuple: (created reviews, submission ids of reviews skipped because
+            their submission was deleted or reviewed meanwhile)
+    """
+    with transaction.atomic():
+        submissions = _lock_submissions(review.submission_id for review in reviews)
+        reviewed = set(
+            TeacherReview.objects.filter(submission_id__in=submissions).values_list('submission_id', flat=True)
+        )
+        skipped = [
+            review.submission_id for review in reviews
+            if review.submission_id not in submissions or review.submission_id in reviewed
+        ]
+        reviews = [
+            review for review in reviews
+            if review.submission_id in submissions and review.submission_id not in reviewed
+        ]
+        TeacherReview.objects.bulk_create(reviews)
+        
+        deltas = defaultdict(list)
+        grades = defaultdict(list)
+        updated = []
+        for review in reviews:
+            submission = submissions[review.submission_id]
+            delta, grade_delta = stats.review_delta(review)
+            deltas[submission.assignment_id] += [
+                delta, stats.status_delta([submission.status], -1), stats.status_delta(['reviewed'])
+            ]
+            grades[submission.assignment_id].append(grade_delta)
+            submission.status = 'reviewed'
+            updated.append(submission)
+        Submission.objects.bulk_update(updated, ['status'])
+        
+        for assignment_id, assignment_deltas in deltas.items():
+            stats.apply_delta(
+                assignment_id, stats.add_deltas(*assignment_deltas), stats.add_deltas(*grades[assignment_id])
+            )
+        cache_versions.bump_submissions(submission.student_id for submission in updated)
+    return reviews, skipped
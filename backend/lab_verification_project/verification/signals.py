@@ -0,0 +1,147 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import cache_versions, stats
+from .models import Assignment, CodeComment, Submission, TeacherReview, TestCase, VerificationResult
+from .storage import release_blob
+
+
+@receiver(post_delete, sender=Submission)
+def release_submission_file(sender, instance, **kwargs):
+    """Delete the stored file when its last submission is deleted."""
+    release_blob(instance.file.name, instance.content_hash)
+
+
+@receiver([post_save, post_delete], sender=Assignment)
+@receiver([post_save, post_delete], sender=TestCase)
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def bump_assignment_versions(sender, instance, **kwargs):
+    """Make cached responses stale after assignments, test cases or user names change."""
+    cache_versions.bump_on_commit(cache_versions.ASSIGNMENTS)
+
+
+@receiver([post_save, post_delete], sender=Submission)
+def bump_submission_versions(sender, instance, **kwargs):
+    """Make the cached responses showing a submission stale."""
+    cache_versions.bump_submissions([instance.student_id])
+
+
+@receiver([post_save, post_delete], sender=VerificationResult)
+@receiver([post_save, post_delete], sender=TeacherReview)
+@receiver([post_save, post_delete], sender=CodeComment)
+def bump_submission_detail_versions(sender, instance, **kwargs):
+    """Make the cached responses showing the submission of a result, review or comment stale."""
+    # The submission may be deleted in the same cascade, its own signal covers the student then
+    student_ids = Submission.objects.filter(pk=instance.submission_id).values_list('student_id', flat=True)
+    cache_versions.bump_submissions(list(student_ids))
+
+
+def _assignment_id(instance):
+    """Return the assignment of a result or review, None if its submission is gone."""
+    if instance.__class__.submission.is_cached(instance):
+        return instance.submission.assignment_id
+    return Submission.objects.filter(pk=instance.submission_id).values_list('assignment_id', flat=True).first()
+
+
+@receiver(pre_save, sender=Submission)
+@receiver(pre_save, sender=VerificationResult)
+@receiver(pre_save, sender=TeacherReview)
+def remember_previous_values(sender, instance, update_fields=None, **kwargs):
+    """Keep the stored version of an updated row, the statistics need the difference."""
+    instance._previous = None
+    if instance._state.adding or instance.pk is None:
+        return
+    if sender is Submission and update_fields is not None and 'status' not in update_fields:
+        return
+    instance._previous = sender.objects.filter(pk=instance.pk).first()
+
+
+@receiver(pre_delete, sender=Submission)
+@receiver(pre_delete, sender=VerificationResult)
+@receiver(pre_delete, sender=TeacherReview)
+def remember_deleted_values(sender, instance, **kwargs):
+    """Keep the stored version of a row about to be deleted, the instance may be outdated."""
+    instance._previous = sender.objects.filter(pk=instance.pk).first()
+
+
+def _stored(instance):
+    return getattr(instance, '_previous', None) or instance
+
+
+@receiver(post_save, sender=Submission)
+def count_saved_submission(sender, instance, created, **kwargs):
+    """Update the statistics of the assignment of a new or updated submission."""
+    if created:
+        other_submissions = Submission.objects.filter(
+            assignment_id=instance.assignment_id, student_id=instance.student_id
+        ).exclude(pk=instance.pk)
+        delta = stats.add_deltas(
+            {'submission_count': 1, 'student_count': 0 if other_submissions.exists() else 1},
+            stats.status_delta([instance.status]),
+        )
+    else:
+        previous = getattr(instance, '_previous', None)
+        if previous is None or previous.status == instance.status:
+            return
+        delta = stats.add_deltas(stats.status_delta([previous.status], -1), stats.status_delta([instance.status]))
+    stats.apply_delta(instance.assignment_id, delta)
+
+
+@receiver(post_delete, sender=Submission)
+def count_deleted_submission(sender, instance, **kwargs):
+    """Remove a deleted submission from the statistics of its assignment."""
+    instance = _stored(instance)
+    remaining = Submission.objects.filter(assignment_id=instance.assignment_id, student_id=instance.student_id)
+    delta = stats.add_deltas(
+        {'submission_count': -1, 'student_count': 0 if remaining.exists() else -1},
+        stats.status_delta([instance.status], -1),
+    )
+    stats.apply_delta(instance.assignment_id, delta, create=False)
+
+
+@receiver(post_save, sender=VerificationResult)
+def count_saved_result(sender, instance, created, **kwargs):
+    """Update the statistics of the assignment of a new or updated verification result."""
+    previous = getattr(instance, '_previous', None)
+    if not created and previous is None:
+        return
+    delta = stats.result_delta(instance)
+    if previous is not None:
+        delta = stats.add_deltas(stats.result_delta(previous, -1), delta)
+    assignment_id = _assignment_id(instance)
+    if assignment_id is not None:
+        stats.apply_delta(assignment_id, delta)
+
+
+@receiver(post_delete, sender=VerificationResult)
+def count_deleted_result(sender, instance, **kwargs):
+    """Remove a deleted verification result from the statistics of its assignment."""
+    assignment_id = _assignment_id(instance)
+    if assignment_id is not None:
+        stats.apply_delta(assignment_id, stats.result_delta(_stored(instance), -1), create=False)
+
+
+@receiver(post_save, sender=TeacherReview)
+def count_saved_review(sender, instance, created, **kwargs):
+    """Update the statistics of the assignment of a new or updated review."""
+    previous = getattr(instance, '_previous', None)
+    if not created and previous is None:
+        return
+    delta, grades = stats.review_delta(instance)
+    if previous is not None:
+        previous_delta, previous_grades = stats.review_delta(previous, -1)
+        delta = stats.add_deltas(previous_delta, delta)
+        grades = stats.add_deltas(previous_grades, grades)
+    assignment_id = _assignment_id(instance)
+    if assignment_id is not None:
+        stats.apply_delta(assignment_id, delta, grades)
+
+
+@receiver(post_delete, sender=TeacherReview)
+def count_deleted_review(sender, instance, **kwargs):
+    """Remove a deleted review from the statistics of its assignment."""
+    assignment_id = _assignment_id(instance)
+    if assignment_id is not None:
+        delta, grades = stats.review_delta(_stored(instance), -1)
+        stats.apply_delta(assignment_id, delta, grades, create=False)
@@ -0,0 +1,159 @@
+"""
+Incrementally maintained statistics of assignments.
+
+Every change to a submission, verification result or teacher review applies
+a delta to the AssignmentStats row of its assignment, in the same
+transaction as the change, so reading the statistics of an assignment is a
+single row lookup however many submissions it has. Model signals apply the
+deltas of single saves and deletes; bulk queries send no signals, so code
+using them calls apply_delta() itself.
+
+An assignment without a statistics row (created before the table existed,
+or whose row was deleted) gets one computed from scratch by the next change
+that adds to it or by get_stats().
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, Sum
+
+from .models import Assignment, AssignmentStats, Submission, TeacherReview, VerificationResult
+
+# Counted fields of AssignmentStats
+COUNT_FIELDS = (
+    'submission_count', 'student_count', 'pending_count', 'verified_count', 'reviewed_count',
+    'verification_count', 'syntax_passed_count', 'plagiarism_score_sum', 'tests_passed_sum',
+    'tests_total_sum', 'review_count', 'graded_count', 'grade_sum',
+)
+
+
+def compute_stats(assignment_id):
+    """
+    Compute the statistics of an assignment from its rows.
+
+    Returns:
+        dict: AssignmentStats field values
+    """
+    submissions = Submission.objects.filter(assignment_id=assignment_id).aggregate(
+        submission_count=Count('id'),
+        student_count=Count('student', distinct=True),
+        pending_count=Count('id', filter=Q(status='pending')),
+        verified_count=Count('id', filter=Q(status='verified')),
+        reviewed_count=Count('id', filter=Q(status='reviewed')),
+    )
+    results = VerificationResult.objects.filter(submission__assignment_id=assignment_id).aggregate(
+        verification_count=Count('id'),
+        syntax_passed_count=Count('id', filter=Q(syntax_check_passed=True)),
+        plagiarism_score_sum=Sum('plagiarism_score'),
+        tests_passed_sum=Sum('tests_passed'),
+        tests_total_sum=Sum('tests_total'),
+    )
+    reviews = TeacherReview.objects.filter(submission__assignment_id=assignment_id)
+    grades = dict(
+        reviews.filter(grade__isnull=False).values_list('grade').annotate(count=Count('id'))
+    )
+    values = {**submissions, **results, 'review_count': reviews.count()}
+    values = {field: values.get(field) or 0 for field in COUNT_FIELDS if field in values}
+    values['graded_count'] = sum(grades.values())
+    values['grade_sum'] = sum(grade * count for grade, count in grades.items())
+    values['grade_distribution'] = {str(grade): count for grade, count in sorted(grades.items())}
+    return values
+
+
+def get_stats(assignment):
+    """Return the statistics row of an assignment, creating it if missing."""
+    stats = AssignmentStats.objects.filter(assignment=assignment).first()
+    if stats is not None:
+        return stats
+    try:
+        with transaction.atomic():
+            return AssignmentStats.objects.create(assignment=assignment, **compute_stats(assignment.id))
+    except IntegrityError:
+        # Created by a concurrent request
+        return AssignmentStats.objects.get(assignment=assignment)
+
+
+def apply_delta(assignment_id, delta, grades=None, create=True):
+    """
+    Add to the statistics of an assignment.
+
+    Must run in the transaction of the change it describes, after the
+    change, so that a row computed from scratch already includes it.
+
+    Args:
+        assignment_id: Assignment of the changed rows
+        delta: COUNT_FIELDS name -> amount to add
+        grades: Grade -> change of its review count
+        create: Create a missing row; deltas of deletions pass False, the
+            assignment itself may be being deleted
+    """
+    delta = {field: amount for field, amount in delta.items() if amount}
+    grades = {grade: amount for grade, amount in (grades or {}).items() if amount}
+    if not delta and not grades:
+        return
+
+    with transaction.atomic():
+        stats = AssignmentStats.objects.select_for_update().filter(assignment_id=assignment_id).first()
+        if stats is None:
+            if not create or not Assignment.objects.filter(pk=assignment_id).exists():
+                return
+            try:
+                with transaction.atomic():
+                    AssignmentStats.objects.create(assignment_id=assignment_id, **compute_stats(assignment_id))
+                return
+            except IntegrityError:
+                # A concurrent transaction created it without this change
+                stats = AssignmentStats.objects.select_for_update().get(assignment_id=assignment_id)
+
+        for field, amount in delta.items():
+            setattr(stats, field, max(0, getattr(stats, field) + amount))
+        distribution = dict(stats.grade_distribution)
+        for grade, amount in grades.items():
+            count = distribution.get(str(grade), 0) + amount
+            if count > 0:
+                distribution[str(grade)] = count
+            else:
+                distribution.pop(str(grade), None)
+        stats.grade_distribution = dict(sorted(distribution.items(), key=lambda item: int(item[0])))
+        stats.save()
+
+
+def status_delta(statuses, sign=1):
+    """Return the delta of submissions with the given statuses being added (or removed with sign=-1)."""
+    delta = Counter()
+    for status in statuses:
+        delta[f"{status}_count"] += sign
+    return delta
+
+
+def result_delta(result, sign=1):
+    """Return the delta of a verification result being added (or removed with sign=-1)."""
+    return {
+        'verification_count': sign,
+        'syntax_passed_count': sign if result.syntax_check_passed else 0,
+        'plagiarism_score_sum': sign * result.plagiarism_score,
+        'tests_passed_sum': sign * result.tests_passed,
+        'tests_total_sum': sign * result.tests_total,
+    }
+
+
+def review_delta(review, sign=1):
+    """
+    Return the delta of a teacher review being added (or removed with sign=-1).
+
+    Returns:
+        dict: Count delta
+        dict: Grade distribution delta
+    """
+    if review.grade is None:
+        return {'review_count': sign}, {}
+    return {'review_count': sign, 'graded_count': sign, 'grade_sum': sign * review.grade}, {review.grade: sign}
+
+
+def add_deltas(*deltas):
+    """Sum deltas."""
+    total = Counter()
+    for delta in deltas:
+        for field, amount in delta.items():
+            total[field] += amount
+    return dict(total)
@@ -0,0 +1,133 @@
+"""
+Content-addressed storage for submission files.
+
+Uploads are hashed while they are streamed to disk and stored as
+``<upload_to>/ab/cd/<sha256><ext>``. The two fan-out levels keep directories
+small, and identical uploads share one blob on disk. A blob is referenced
+by every Submission with its content hash and is deleted after the
+transaction deleting the last of them commits.
+
+Storing a duplicate upload and releasing a blob both take the blob's lock
+(see lock_blob) and hold it until their transaction ends, so a release
+never deletes a blob that an upload in flight has decided to reuse.
+"""
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+from django.utils.deconstruct import deconstructible
+
+logger = logging.getLogger(__name__)
+
+_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def lock_blob(content_hash):
+    """
+    Lock the blob of a content hash until the current transaction ends.
+
+    Uses a PostgreSQL transaction-level advisory lock. Other databases
+    (SQLite in development) have no such lock and skip it.
+
+    Args:
+        content_hash: Content hash of the blob ('' locks nothing)
+    """
+    if not content_hash or connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        # 60 bits of the hash fit the signed 64-bit lock key
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [int(content_hash[:15], 16)])
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage that names files after the SHA-256 of their content."""
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is derived from the content in _save, and an
+        # existing file with that name is the same content
+        return name
+
+    def _save(self, name, content):
+        directory = posixpath.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+
+        incoming = os.path.join(self.location, '.incoming')
+        os.makedirs(incoming, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=incoming)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            content_hash = digest.hexdigest()
+            stored_name = posixpath.join(
+                directory, content_hash[:2], content_hash[2:4], content_hash + extension
+            )
+            full_path = self.path(stored_name)
+            # Held until the submission row is committed, see Submission.save
+            lock_blob(content_hash)
+            if os.path.exists(full_path):
+                # Duplicate upload, keep the blob that is already stored
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(temp_path, full_path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(full_path, self.file_permissions_mode)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return stored_name
+
+    @staticmethod
+    def content_hash(name):
+        """Return the content hash encoded in a stored name, or '' for other names."""
+        stem = os.path.splitext(posixpath.basename(name))[0]
+        return stem if _HASH_RE.match(stem) else ''
+
+
+submission_storage = ContentAddressedStorage()
+
+
+def release_blob(name, content_hash):
+    """
+    Delete a stored blob once no submission references its content anymore.
+
+    Runs after the current transaction commits, so a rolled back delete
+    keeps the file. The references are counted under the blob's lock, which
+    waits for uploads reusing the blob to commit their rows.
+
+    Args:
+        name: Stored file name
+        content_hash: Content hash of the blob ('' for legacy, non-shared files)
+    """
+    if not name:
+        return
+    transaction.on_commit(lambda: _release_blob(name, content_hash))
+
+
+def _release_blob(name, content_hash):
+    from .models import Submission
+
+    try:
+        with transaction.atomic():
+            lock_blob(content_hash)
+            references = Submission.objects.filter(file=name)
+            if content_hash:
+                # Narrow the lookup through the indexed hash column
+                references = references.filter(content_hash=content_hash)
+            if not references.exists():
+                submission_storage.delete(name)
+    except Exception as e:
+        logger.error(f"Error releasing blob {name}: {str(e)}")
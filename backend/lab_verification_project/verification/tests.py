@@ -0,0 +1,701 @@
+import os
+import pwd
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from . import cpp_checker, grading, lexer, result_cache, stats
+from .corpus import load_shard, search_corpus, shard_content_hashes, write_shard
+from .fingerprints import assignment_index, get_submission_fingerprint, hash_content, unpack_fingerprints
+from .jobs import claim_jobs, enqueue_verifications
+from .models import (
+    Assignment, AssignmentStats, FingerprintPosting, Submission, TeacherReview, VerificationResult
+)
+from .sandbox import SandboxError
+from .services import (
+    SyntaxChecker, add_teacher_reviews, check_submission_plagiarism, find_similar_pairs,
+    propagate_plagiarism_scores
+)
+from .storage import release_blob, submission_storage
+from .winnowing import (
+    HASH_BASE, HASH_MODULUS, FingerprintIndex, fingerprint_code, fingerprint_symbols, kgram_hashes, winnow
+)
+
+User = get_user_model()
+
+SOURCE = '''
+def fibonacci(n):
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+
+
+def main():
+    count = int(input())
+    print(" ".join(str(fibonacci(i)) for i in range(count)))
+
+
+main()
+'''
+
+
+class MediaTestCase(TestCase):
+    """Test case storing uploads in a temporary MEDIA_ROOT."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, VERIFICATION_CORPUS_DIR='')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.teacher = User.objects.create_user(
+            'teacher@example.com', first_name='Teacher', last_name='One', role='teacher'
+        )
+        self.assignment = Assignment.objects.create(
+            title='Lab 1', description='First lab', created_by=self.teacher
+        )
+        self.student_count = 0
+
+    def submit(self, content, filename='lab1.py', assignment=None):
+        """Store a submission of a new student, fingerprinted like an upload through the API."""
+        self.student_count += 1
+        student = User.objects.create_user(
+            f"student{self.student_count}@example.com",
+            first_name='Student', last_name=str(self.student_count), role='student'
+        )
+        submission = Submission.objects.create(
+            assignment=assignment or self.assignment, student=student,
+            file=SimpleUploadedFile(filename, content.encode())
+        )
+        get_submission_fingerprint(submission)
+        return submission
+
+
+CPP_SOURCE = '''
+#include <iostream>
+#include <vector>
+
+// Sum of the first values
+int total(const std::vector<int>& values, int count) {
+    int sum = 0;
+    for (int i = 0; i < count; ++i) {
+        sum += values[i];
+    }
+    return sum;
+}
+
+int main() {
+    std::vector<int> values = {1, 2, 3};
+    std::cout << "Sum: " << total(values, 3) << std::endl;
+    return 0;
+}
+'''
+
+
+class WinnowingTests(SimpleTestCase):
+    """Rolling hashes and winnowing match their definitions."""
+
+    def test_kgram_hashes_match_direct_hashes(self):
+        symbols = [random.Random(1).randrange(300) for _ in range(50)]
+        expected = []
+        for start in range(len(symbols) - 4):
+            value = 0
+            for symbol in symbols[start:start + 5]:
+                value = (value * HASH_BASE + symbol + 1) % HASH_MODULUS
+            expected.append(value)
+        self.assertEqual(kgram_hashes(symbols, 5), expected)
+        self.assertEqual(kgram_hashes(symbols[:4], 5), [])
+
+    def test_winnow_selects_rightmost_minimum_of_every_window(self):
+        rng = random.Random(2)
+        for _ in range(200):
+            # A small hash range gives many ties
+            hashes = [rng.randrange(6) for _ in range(rng.randrange(1, 40))]
+            window = rng.randrange(1, 8)
+
+            expected = []
+            for start in range(max(1, len(hashes) - window + 1)):
+                positions = range(start, min(len(hashes), start + window))
+                selected = min(positions, key=lambda i: (hashes[i], -i))
+                if not expected or expected[-1][1] != selected:
+                    expected.append((hashes[selected], selected))
+            self.assertEqual(winnow(hashes, window), expected, (hashes, window))
+
+    def test_winnow_guarantees_shared_substrings_match(self):
+        shared = [random.Random(3).randrange(100) for _ in range(30)]
+        first = fingerprint_symbols([200, 201, 202] + shared)
+        second = fingerprint_symbols(shared + [203, 204, 205, 206])
+        # A shared run of at least k + window - 1 symbols shares a fingerprint
+        self.assertTrue(first & second)
+
+    def test_fingerprint_code_ignores_formatting(self):
+        self.assertEqual(fingerprint_code(SOURCE), fingerprint_code(SOURCE.upper().replace('    ', '\t  ')))
+
+
+class LexerTests(SimpleTestCase):
+    """The lexers normalize identifiers, literals, comments and formatting."""
+
+    def test_detect_language(self):
+        self.assertEqual(lexer.detect_language('lab1.py'), lexer.PYTHON)
+        self.assertEqual(lexer.detect_language('Lab1.CPP'), lexer.CPP)
+        self.assertEqual(lexer.detect_language('main.cc'), lexer.CPP)
+        self.assertIsNone(lexer.detect_language('notes.txt'))
+
+    def test_python_renaming_and_literals(self):
+        renamed = (
+            SOURCE.replace('fibonacci', 'fib').replace('count', 'n_values')
+            .replace('" "', "', '").replace('0, 1', '1, 2')
+        )
+        commented = SOURCE.replace('    return a', '    # the result\n    return a  # done')
+        tokens = lexer.tokenize_python(SOURCE)
+        self.assertEqual(lexer.tokenize_python(renamed), tokens)
+        self.assertEqual(lexer.tokenize_python(commented), tokens)
+        self.assertNotEqual(lexer.tokenize_python(SOURCE.replace('for _ in', 'while _ in')), tokens)
+
+    def test_python_categories(self):
+        tokens = lexer.tokenize_python('if x:\n    y = 1 + "a"\n')
+        self.assertEqual(tokens[1:3], [lexer.IDENTIFIER, lexer._symbol_id(':')])
+        self.assertEqual(tokens[3:5], [lexer.NEWLINE, lexer.INDENT])
+        self.assertEqual(tokens[5:10], [
+            lexer.IDENTIFIER, lexer._symbol_id('='), lexer.NUMBER, lexer._symbol_id('+'), lexer.STRING
+        ])
+        self.assertEqual(tokens[0], lexer._symbol_id('if'))
+        self.assertIn(lexer.DEDENT, tokens)
+
+    def test_cpp_renaming_literals_and_comments(self):
+        renamed = (
+            CPP_SOURCE.replace('total', 'accumulate_all').replace('values', 'v').replace('"Sum: "', '"="')
+            .replace('{1, 2, 3}', '{4, 5, 6}').replace('// Sum of the first values', '/* multi\nline */')
+        )
+        reformatted = CPP_SOURCE.replace('    ', '').replace(') {', ')\n{')
+        tokens = lexer.tokenize_cpp(CPP_SOURCE)
+        self.assertEqual(lexer.tokenize_cpp(renamed), tokens)
+        self.assertEqual(lexer.tokenize_cpp(reformatted), tokens)
+        # Library names keep their own ids
+        self.assertNotEqual(lexer.tokenize_cpp(CPP_SOURCE.replace('std::cout', 'std::cerr')), tokens)
+
+    def test_cpp_categories(self):
+        tokens = lexer.tokenize_cpp('#include <vector>\nauto s = R"x(a ) " b)x"; x->y <<= 0x1F;')
+        self.assertEqual(tokens, [
+            lexer._symbol_id('#include'), lexer.STRING,
+            lexer._symbol_id('auto'), lexer.IDENTIFIER, lexer._symbol_id('='), lexer.STRING, lexer._symbol_id(';'),
+            lexer.IDENTIFIER, lexer._symbol_id('->'), lexer.IDENTIFIER, lexer._symbol_id('<<='), lexer.NUMBER,
+            lexer._symbol_id(';'),
+        ])
+
+    def test_broken_python_falls_back_to_cpp_lexer(self):
+        broken = 'def f(:\n  return """unterminated\n'
+        tokens = lexer.tokenize_code(broken, lexer.PYTHON)
+        self.assertEqual(tokens, lexer.tokenize_cpp(broken))
+        self.assertTrue(tokens)
+
+
+class AssignmentIndexTests(MediaTestCase):
+    """The fingerprint postings of an assignment are kept up to date and score like FingerprintIndex."""
+
+    def memory_index(self, submissions):
+        index = FingerprintIndex()
+        for submission in submissions:
+            index.add(submission.id, unpack_fingerprints(submission.fingerprint.fingerprints))
+        return index
+
+    def test_upload_is_indexed(self):
+        submission = self.submit(SOURCE)
+        postings = FingerprintPosting.objects.filter(submission=submission)
+        self.assertEqual(postings.count(), len(unpack_fingerprints(submission.fingerprint.fingerprints)))
+        self.assertTrue(all(posting.assignment_id == self.assignment.id for posting in postings))
+
+    def test_query_matches_memory_index(self):
+        submissions = [
+            self.submit(SOURCE),
+            self.submit(SOURCE.replace('fibonacci', 'fib')),
+            self.submit(SOURCE.replace('main()\n', 'main()\nprint("done")\n')),
+            self.submit('print(sum(map(int, input().split())))\n'),
+        ]
+        other = Assignment.objects.create(title='Lab 2', description='Second lab', created_by=self.teacher)
+        self.submit(SOURCE, assignment=other)
+
+        fingerprints = unpack_fingerprints(submissions[0].fingerprint.fingerprints)
+        expected = self.memory_index(submissions).query(fingerprints, exclude=submissions[0].id)
+        matches = assignment_index(self.assignment).query(fingerprints, exclude=submissions[0].id)
+        self.assertEqual(sorted(matches), sorted(expected))
+        self.assertEqual(matches[0][0], submissions[1].id)
+        self.assertEqual(matches[0][1], 100.0)
+
+    def test_plagiarism_check_does_not_scan_assignment(self):
+        submission = self.submit(SOURCE)
+        self.submit(SOURCE)
+        with self.assertNumQueries(4):
+            score, details, matches = check_submission_plagiarism(submission)
+        self.assertEqual(score, 100.0)
+        self.assertIn('lab1.py', details)
+
+        for _ in range(5):
+            self.submit(SOURCE.replace('count', 'total'))
+        with self.assertNumQueries(4):
+            check_submission_plagiarism(submission)
+
+    def test_missing_postings_are_rebuilt(self):
+        first, second = self.submit(SOURCE), self.submit(SOURCE)
+        FingerprintPosting.objects.filter(submission=second).delete()
+        matches = assignment_index(self.assignment).query(
+            unpack_fingerprints(first.fingerprint.fingerprints), exclude=first.id
+        )
+        self.assertEqual(matches, [(second.id, 100.0)])
+
+    def test_replaced_file_is_reindexed(self):
+        first, second = self.submit(SOURCE), self.submit(SOURCE)
+        second.file = SimpleUploadedFile('lab1.py', b'print(input()[::-1])\n')
+        second.fingerprint = None
+        second.save()
+        get_submission_fingerprint(second)
+
+        matches = assignment_index(self.assignment).query(
+            unpack_fingerprints(first.fingerprint.fingerprints), exclude=first.id
+        )
+        self.assertEqual(matches, [])
+
+
+class SimilarityPropagationTests(MediaTestCase):
+    """Similar pairs come from the assignment index and new matches update earlier results."""
+
+    def test_similar_pairs(self):
+        first, second = self.submit(SOURCE), self.submit(SOURCE)
+        self.submit('print(sum(map(int, input().split())))\n')
+        FingerprintPosting.objects.all().delete()
+
+        pairs, candidate_count, pair_count = find_similar_pairs(self.assignment, 50)
+        self.assertEqual(pair_count, 1)
+        self.assertEqual({pairs[0]['submission_a'], pairs[0]['submission_b']}, {first.id, second.id})
+        self.assertEqual(pairs[0]['similarity'], 100.0)
+        # Finding pairs brought the index up to date
+        self.assertEqual(FingerprintPosting.objects.values('submission').distinct().count(), 3)
+
+    def verified(self, score, details):
+        submission = self.submit(SOURCE)
+        VerificationResult.objects.create(
+            submission=submission, syntax_check_passed=True, plagiarism_score=score, plagiarism_details=details
+        )
+        return submission
+
+    def propagate(self, hits):
+        with transaction.atomic():
+            return propagate_plagiarism_scores(hits)
+
+    def test_raised_and_unchanged_scores(self):
+        raised = self.verified(10.0, "Similarity with a.py: 10.00%\nHighest similarity (10.00%) found with a.py")
+        unchanged = self.verified(90.0, "Similarity with b.py: 90.00%\nHighest similarity (90.00%) found with b.py")
+        new = self.submit(SOURCE, filename='new.py')
+
+        self.assertEqual(self.propagate([(new, [(raised.id, 50.0), (unchanged.id, 50.0)])]), 2)
+        raised_result = VerificationResult.objects.get(submission=raised)
+        self.assertEqual(raised_result.plagiarism_score, 50.0)
+        self.assertEqual(raised_result.plagiarism_details.splitlines(), [
+            'Similarity with a.py: 10.00%',
+            'Similarity with new.py: 50.00%',
+            'Highest similarity (50.00%) found with new.py',
+        ])
+        unchanged_result = VerificationResult.objects.get(submission=unchanged)
+        self.assertEqual(unchanged_result.plagiarism_score, 90.0)
+        self.assertEqual(unchanged_result.plagiarism_details.splitlines(), [
+            'Similarity with b.py: 90.00%',
+            'Similarity with new.py: 50.00%',
+            'Highest similarity (90.00%) found with b.py',
+        ])
+        self.assertEqual(AssignmentStats.objects.get(assignment=self.assignment).plagiarism_score_sum, 140.0)
+
+        # Propagating the same match again adds nothing
+        self.assertEqual(self.propagate([(new, [(unchanged.id, 50.0)])]), 0)
+        self.assertEqual(
+            VerificationResult.objects.get(submission=unchanged).plagiarism_details, unchanged_result.plagiarism_details
+        )
+
+
+@unittest.skipUnless(shutil.which(cpp_checker.COMPILER), 'g++ is not installed')
+class CppCheckerTests(TestCase):
+    """Precompiled headers are evicted by last use but never while used, and only file results are cached."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(
+            VERIFICATION_CPP_PCH_DIR=os.path.join(self.directory, 'pch'),
+            VERIFICATION_CPP_PCH_ENABLED=True, VERIFICATION_CPP_PCH_MIN_USES=1, VERIFICATION_CPP_PCH_MAX=2,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        result_cache.get_cache().clear()
+        self.addCleanup(result_cache.get_cache().clear)
+
+        self.source = os.path.join(self.directory, 'main.cpp')
+        with open(self.source, 'w') as f:
+            f.write('#include <vector>\nint main() { std::vector<int> v; return v.size(); }\n')
+
+    def use_header(self, *headers):
+        with cpp_checker.precompiled_header(headers) as header:
+            return header
+
+    def test_least_recently_used_header_is_evicted(self):
+        vector, deque = self.use_header('vector'), self.use_header('deque')
+        # Using a header makes it the most recently used one
+        os.utime(vector + '.gch', (time.time() - 60, time.time() - 60))
+        os.utime(deque + '.gch', (time.time() - 30, time.time() - 30))
+        self.use_header('vector')
+        self.use_header('list')
+        self.assertTrue(os.path.exists(vector + '.gch'))
+        self.assertFalse(os.path.exists(deque + '.gch'))
+
+    def test_header_in_use_is_not_evicted(self):
+        with cpp_checker.precompiled_header(('vector',)) as vector:
+            os.utime(vector + '.gch', (0, 0))
+            self.use_header('deque')
+            self.use_header('list')
+            self.assertTrue(os.path.exists(vector + '.gch'))
+
+    def test_compiler_failures_are_not_cached(self):
+        killed = subprocess.CompletedProcess([], -9, '', 'g++: fatal error: Killed signal terminated program cc1plus\n')
+        with mock.patch.object(cpp_checker.subprocess, 'run', return_value=killed):
+            passed, output = SyntaxChecker.check_cpp_batch([self.source])[self.source]
+            self.assertFalse(passed)
+            self.assertTrue(output.startswith('Error checking syntax:'))
+            with self.assertRaises(cpp_checker.CompilerError):
+                cpp_checker.compile_binary(self.source)
+        self.assertEqual(len(result_cache.get_cache()), 0)
+
+        self.assertTrue(SyntaxChecker.check_cpp_batch([self.source])[self.source][0])
+        self.assertEqual(len(result_cache.get_cache()), 1)
+
+    def test_flags_are_part_of_the_cache_key(self):
+        SyntaxChecker.check_cpp_batch([self.source])
+        with override_settings(VERIFICATION_CPP_FLAGS=['-DLIMIT=1', '-DDEBUG']):
+            SyntaxChecker.check_cpp_batch([self.source])
+        with override_settings(VERIFICATION_CPP_FLAGS=['-DLIMIT=1 -DDEBUG']):
+            SyntaxChecker.check_cpp_batch([self.source])
+        self.assertEqual(len(result_cache.get_cache()), 3)
+
+
+class JobQueueTests(TestCase):
+    """Workers split the queued jobs of an assignment evenly, up to VERIFICATION_JOB_BATCH_SIZE."""
+
+    def setUp(self):
+        teacher = User.objects.create_user('teacher@example.com', first_name='Teacher', last_name='One', role='teacher')
+        self.assignment = Assignment.objects.create(title='Lab 1', description='First lab', created_by=teacher)
+        submissions = []
+        for number in range(10):
+            student = User.objects.create_user(
+                f"student{number}@example.com", first_name='Student', last_name=str(number), role='student'
+            )
+            submissions.append(Submission.objects.create(
+                assignment=self.assignment, student=student, file='submissions/lab1.py'
+            ))
+        enqueue_verifications(submissions)
+
+    def test_jobs_are_split_over_workers(self):
+        self.assertEqual([len(claim_jobs(20, workers=4)) for _ in range(6)], [3, 2, 2, 1, 1, 1])
+        self.assertEqual(claim_jobs(20, workers=4), [])
+
+    def test_batch_size_limits_the_share(self):
+        self.assertEqual(len(claim_jobs(4, workers=1)), 4)
+
+
+class ContentAddressedStorageTests(MediaTestCase):
+    """Identical uploads share one blob, which is deleted with the last submission referencing it."""
+
+    def test_identical_uploads_share_a_blob(self):
+        first, second = self.submit(SOURCE), self.submit(SOURCE, filename='copy.py')
+        other = self.submit(SOURCE + '# changed\n')
+
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertNotEqual(first.file.name, other.file.name)
+        self.assertEqual(first.content_hash, submission_storage.content_hash(first.file.name))
+        self.assertEqual(
+            first.file.name,
+            f"submissions/{first.content_hash[:2]}/{first.content_hash[2:4]}/{first.content_hash}.py"
+        )
+        self.assertEqual(second.filename, 'copy.py')
+        with first.file.open('rb') as f:
+            self.assertEqual(f.read(), SOURCE.encode())
+
+    def test_blob_is_deleted_with_its_last_reference(self):
+        first, second = self.submit(SOURCE), self.submit(SOURCE)
+        path = first.file.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_release_keeps_referenced_blob(self):
+        first = self.submit(SOURCE)
+        with self.captureOnCommitCallbacks(execute=True):
+            release_blob(first.file.name, first.content_hash)
+        self.assertTrue(os.path.exists(first.file.path))
+
+    def test_rolled_back_release_keeps_blob(self):
+        first = self.submit(SOURCE)
+        path = first.file.path
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            Submission.objects.filter(pk=first.pk).delete()
+            release_blob(first.file.name, first.content_hash)
+        self.assertTrue(callbacks)
+        self.assertTrue(os.path.exists(path))
+
+
+@override_settings(VERIFICATION_CORPUS_STOP_MIN_DOCS=2, VERIFICATION_CORPUS_STOP_FRACTION=0)
+class CorpusTests(SimpleTestCase):
+    """Corpus shards grow by appending, moving boilerplate to the stoplist and skipping known documents."""
+
+    def setUp(self):
+        self.corpus_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.corpus_dir, ignore_errors=True)
+        settings_override = override_settings(VERIFICATION_CORPUS_DIR=self.corpus_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def shard(self, name):
+        return load_shard(os.path.join(self.corpus_dir, name))
+
+    def test_stoplist_promotion_across_appends(self):
+        write_shard('course', [{'label': 'a'}, {'label': 'b'}], [[1, 2], [1, 3]], append=False)
+        shard = self.shard('course')
+        self.assertEqual(len(shard.stop), 0)
+        self.assertEqual(list(shard.sizes), [2, 2])
+
+        # A third document makes fingerprint 1 boilerplate, its postings go
+        write_shard('course', [{'label': 'c'}], [[1, 4]])
+        shard = self.shard('course')
+        self.assertEqual(list(shard.stop), [1])
+        self.assertNotIn(1, shard.hashes)
+        self.assertEqual(list(shard.sizes), [1, 1, 1])
+
+        # Later documents never get postings for it, however the counts change
+        write_shard('course', [{'label': 'd'}], [[1, 5]])
+        shard = self.shard('course')
+        self.assertEqual(list(shard.stop), [1])
+        self.assertNotIn(1, shard.hashes)
+        self.assertEqual(list(shard.sizes), [1, 1, 1, 1])
+
+        matches, labels = search_corpus([1, 2], min_similarity=0)
+        self.assertEqual(matches, [(('course', 0), 100.0)])
+        self.assertEqual(labels, {('course', 0): 'a [course]'})
+
+    def test_directory_skips_known_contents(self):
+        archive = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive, ignore_errors=True)
+        os.makedirs(os.path.join(archive, 'copies'))
+        files = {
+            'lab1.py': SOURCE,
+            os.path.join('copies', 'lab1.py'): SOURCE,
+            'lab2.py': SOURCE.replace('fibonacci', 'fib'),
+        }
+        for relpath, content in files.items():
+            with open(os.path.join(archive, relpath), 'w') as f:
+                f.write(content)
+
+        out = StringIO()
+        call_command('build_corpus_index', 'archive', '--directory', archive, stdout=out)
+        self.assertIn('Added 2 document(s)', out.getvalue())
+
+        with open(os.path.join(archive, 'lab3.py'), 'w') as f:
+            f.write(SOURCE.replace('count', 'total'))
+        out = StringIO()
+        call_command('build_corpus_index', 'archive', '--directory', archive, stdout=out)
+        self.assertIn('Added 1 document(s) to shard \'archive\', 3 in total', out.getvalue())
+
+        shard = self.shard('archive')
+        self.assertEqual([shard.label(doc) for doc in range(len(shard))], ['lab1.py', 'lab2.py', 'lab3.py'])
+        self.assertEqual(
+            shard_content_hashes('archive'),
+            {hash_content(SOURCE.encode()), hash_content(SOURCE.replace('fibonacci', 'fib').encode()),
+             hash_content(SOURCE.replace('count', 'total').encode())}
+        )
+
+
+class SandboxTests(SimpleTestCase):
+    """Test programs are limited in time and memory, run unprivileged and have no network."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        # The sandbox user enters the work directories through it
+        os.chmod(self.directory, 0o711)
+        settings_override = override_settings(VERIFICATION_TEMP_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(grading.close_zygote)
+
+    def run_program(self, source, time_limit=2, memory_limit=256, input_data=''):
+        path = os.path.join(self.directory, 'program.py')
+        with open(path, 'w') as f:
+            f.write(source)
+        test_case = SimpleNamespace(
+            id=1, input_data=input_data, expected_output='', time_limit=time_limit, memory_limit=memory_limit
+        )
+        return grading.run_test_cases(path, [test_case])[0]
+
+    def each_mode(self):
+        """Yield once with Python run in forks of the zygote and once as a new interpreter."""
+        for zygote in (True, False):
+            with self.subTest(zygote=zygote), override_settings(VERIFICATION_TEST_ZYGOTE=zygote):
+                yield
+
+    def test_output(self):
+        for _ in self.each_mode():
+            result = self.run_program('print(int(input()) * 2)\n', input_data='21\n')
+            self.assertEqual(result['status'], 'wrong_answer')
+            self.assertEqual(result['output'], '42\n')
+
+    def test_time_limit(self):
+        for _ in self.each_mode():
+            self.assertEqual(self.run_program('while True:\n    pass\n', time_limit=1)['status'], 'time_limit')
+
+    def test_memory_limit(self):
+        for _ in self.each_mode():
+            result = self.run_program('data = bytearray(512 * 1024 * 1024)\n', memory_limit=64)
+            self.assertEqual(result['status'], 'memory_limit')
+
+    def test_network_is_unreachable(self):
+        source = (
+            'import socket\n'
+            'try:\n'
+            '    socket.create_connection(("127.0.0.1", 5432), timeout=2)\n'
+            '    print("connected")\n'
+            'except OSError:\n'
+            '    print("blocked")\n'
+        )
+        for _ in self.each_mode():
+            self.assertEqual(self.run_program(source)['output'], 'blocked\n')
+
+    def test_setup_failure_is_a_sandbox_error(self):
+        run_dir = tempfile.mkdtemp(dir=self.directory)
+        os.chmod(run_dir, 0o777)
+        with self.assertRaises(SandboxError):
+            grading.get_zygote().execute(['/nonexistent/program'], b'', run_dir, cpu_time=1, memory=64 * 1024 * 1024)
+        self.assertFalse(grading.get_zygote()._pending)
+
+    @unittest.skipUnless(os.geteuid() == 0, 'switching users needs root')
+    def test_privileges_are_dropped(self):
+        try:
+            user = pwd.getpwnam('nobody')
+        except KeyError:
+            self.skipTest('there is no nobody user')
+        source = 'import os\nprint(os.getuid(), os.getgid(), os.getgroups())\n'
+        with override_settings(VERIFICATION_TEST_USER='nobody'):
+            for _ in self.each_mode():
+                result = self.run_program(source)
+                self.assertEqual(result['output'], f"{user.pw_uid} {user.pw_gid} []\n")
+
+
+class AssignmentStatsTests(TestCase):
+    """The statistics rows follow every create, update and delete as deltas."""
+
+    def setUp(self):
+        self.teacher = User.objects.create_user(
+            'teacher@example.com', first_name='Teacher', last_name='One', role='teacher'
+        )
+        self.assignment = Assignment.objects.create(title='Lab 1', description='First lab', created_by=self.teacher)
+        self.students = [
+            User.objects.create_user(
+                f"student{number}@example.com", first_name='Student', last_name=str(number), role='student'
+            )
+            for number in range(2)
+        ]
+
+    def submit(self, student):
+        return Submission.objects.create(assignment=self.assignment, student=student, file='submissions/lab1.py')
+
+    def assert_stats(self, **expected):
+        row = AssignmentStats.objects.get(assignment=self.assignment)
+        computed = stats.compute_stats(self.assignment.id)
+        for field, value in computed.items():
+            self.assertEqual(getattr(row, field), value, field)
+        for field, value in expected.items():
+            self.assertEqual(getattr(row, field), value, field)
+
+    def test_submissions(self):
+        first = self.submit(self.students[0])
+        self.assert_stats(submission_count=1, student_count=1, pending_count=1)
+        second = self.submit(self.students[0])
+        self.submit(self.students[1])
+        self.assert_stats(submission_count=3, student_count=2, pending_count=3)
+
+        first.status = 'verified'
+        first.save()
+        self.assert_stats(pending_count=2, verified_count=1)
+
+        first.delete()
+        self.assert_stats(submission_count=2, student_count=2, verified_count=0)
+        second.delete()
+        self.assert_stats(submission_count=1, student_count=1, pending_count=1)
+
+    def test_verification_results(self):
+        submissions = [self.submit(student) for student in self.students]
+        result = VerificationResult.objects.create(
+            submission=submissions[0], syntax_check_passed=True, plagiarism_score=30.0, tests_passed=2, tests_total=3
+        )
+        VerificationResult.objects.create(
+            submission=submissions[1], syntax_check_passed=False, plagiarism_score=10.0, tests_total=3
+        )
+        self.assert_stats(
+            verification_count=2, syntax_passed_count=1, plagiarism_score_sum=40.0, tests_passed_sum=2, tests_total_sum=6
+        )
+
+        result.syntax_check_passed = False
+        result.plagiarism_score = 50.0
+        result.tests_passed = 3
+        result.save()
+        self.assert_stats(syntax_passed_count=0, plagiarism_score_sum=60.0, tests_passed_sum=3)
+
+        result.delete()
+        self.assert_stats(verification_count=1, plagiarism_score_sum=10.0, tests_passed_sum=0, tests_total_sum=3)
+
+        # Deleting a submission cascades to its result
+        submissions[1].delete()
+        self.assert_stats(verification_count=0, plagiarism_score_sum=0.0, submission_count=1)
+
+    def test_reviews(self):
+        submissions = [self.submit(student) for student in self.students]
+        review = TeacherReview.objects.create(submission=submissions[0], teacher=self.teacher, comments='Good', grade=4)
+        TeacherReview.objects.create(submission=submissions[1], teacher=self.teacher, comments='Ungraded')
+        self.assert_stats(review_count=2, graded_count=1, grade_sum=4, grade_distribution={'4': 1})
+
+        review.grade = 5
+        review.save()
+        self.assert_stats(grade_sum=5, grade_distribution={'5': 1})
+
+        review.delete()
+        self.assert_stats(review_count=1, graded_count=0, grade_sum=0, grade_distribution={})
+
+    def test_bulk_reviews(self):
+        submissions = [self.submit(student) for student in self.students]
+        add_teacher_reviews([
+            TeacherReview(submission=submission, teacher=self.teacher, comments='Bulk', grade=3)
+            for submission in submissions
+        ])
+        self.assert_stats(
+            review_count=2, graded_count=2, grade_sum=6, grade_distribution={'3': 2},
+            pending_count=0, reviewed_count=2
+        )
+
+    def test_missing_row_is_recomputed(self):
+        self.submit(self.students[0])
+        AssignmentStats.objects.all().delete()
+        self.submit(self.students[1])
+        self.assert_stats(submission_count=2, student_count=2)
@@ -0,0 +1,226 @@
+"""
+Winnowing fingerprints for code similarity detection.
+
+This follows the approach used by MOSS (Schleimer, Wilkerson, Aiken,
+"Winnowing: Local Algorithms for Document Fingerprinting"): the document is
+turned into a sequence of symbols, every k-gram of symbols is hashed and
+from every window of consecutive hashes the minimum is kept as a
+fingerprint. Two documents sharing a run of at least ``k + window - 1``
+symbols are guaranteed to share a fingerprint.
+"""
+from collections import defaultdict
+
+# Length of the k-grams that are hashed
+K_GRAM_SIZE = 5
+
+# Length of the k-grams when hashing lexer tokens instead of characters
+TOKEN_K_GRAM_SIZE = 8
+
+# Number of consecutive k-gram hashes a fingerprint is selected from
+WINDOW_SIZE = 4
+
+# Karp-Rabin rolling hash parameters (Mersenne prime modulus)
+HASH_BASE = 257
+HASH_MODULUS = (1 << 61) - 1
+
+
+def normalize_text(code):
+    """
+    Turn source code into a sequence of symbols for fingerprinting.
+
+    Whitespace is dropped and letters are lowercased, so formatting changes
+    do not affect the fingerprints.
+
+    Args:
+        code: Source code as a string
+
+    Returns:
+        list: Sequence of integer symbols
+    """
+    return [ord(char) for char in code.lower() if not char.isspace()]
+
+
+def kgram_hashes(symbols, k=K_GRAM_SIZE):
+    """
+    Compute rolling hashes of all k-grams of a symbol sequence.
+
+    Args:
+        symbols: Sequence of non-negative integers
+        k: Length of the k-grams
+
+    Returns:
+        list: One hash per k-gram
+    """
+    if len(symbols) < k:
+        return []
+
+    high_power = pow(HASH_BASE, k - 1, HASH_MODULUS)
+    current = 0
+    for symbol in symbols[:k]:
+        current = (current * HASH_BASE + symbol + 1) % HASH_MODULUS
+
+    hashes = [current]
+    for i in range(k, len(symbols)):
+        current = (current - (symbols[i - k] + 1) * high_power) % HASH_MODULUS
+        current = (current * HASH_BASE + symbols[i] + 1) % HASH_MODULUS
+        hashes.append(current)
+    return hashes
+
+
+def winnow(hashes, window=WINDOW_SIZE):
+    """
+    Select fingerprints from k-gram hashes using robust winnowing.
+
+    In every window the rightmost minimal hash is selected; a hash is only
+    recorded again when the selected position changes.
+
+    Args:
+        hashes: List of k-gram hashes
+        window: Number of hashes per window
+
+    Returns:
+        list: (hash, position) tuples of the selected fingerprints
+    """
+    if not hashes:
+        return []
+    if len(hashes) <= window:
+        position = min(range(len(hashes)), key=lambda i: (hashes[i], -i))
+        return [(hashes[position], position)]
+
+    fingerprints = []
+    selected = -1
+    for start in range(len(hashes) - window + 1):
+        if selected < start:
+            # The previous minimum left the window, rescan it
+            selected = start
+            for i in range(start + 1, start + window):
+                if hashes[i] <= hashes[selected]:
+                    selected = i
+            fingerprints.append((hashes[selected], selected))
+        else:
+            # Only the newly entered hash can become the new minimum
+            i = start + window - 1
+            if hashes[i] <= hashes[selected]:
+                selected = i
+                fingerprints.append((hashes[selected], selected))
+    return fingerprints
+
+
+def fingerprint_symbols(symbols, k=K_GRAM_SIZE, window=WINDOW_SIZE):
+    """
+    Compute the fingerprint set of a symbol sequence.
+
+    Args:
+        symbols: Sequence of non-negative integers
+        k: Length of the k-grams
+        window: Winnowing window size
+
+    Returns:
+        frozenset: Selected fingerprint hashes
+    """
+    return frozenset(h for h, _ in winnow(kgram_hashes(symbols, k), window))
+
+
+def fingerprint_code(code, k=K_GRAM_SIZE, window=WINDOW_SIZE):
+    """
+    Compute the fingerprint set of a piece of source code.
+
+    Args:
+        code: Source code as a string
+        k: Length of the k-grams
+        window: Winnowing window size
+
+    Returns:
+        frozenset: Selected fingerprint hashes
+    """
+    return fingerprint_symbols(normalize_text(code), k, window)
+
+
+def jaccard_similarity(shared, size_a, size_b):
+    """Return the Jaccard similarity (0-100) of two fingerprint sets."""
+    union = size_a + size_b - shared
+    if union <= 0:
+        return 0.0
+    return shared / union * 100
+
+
+class FingerprintIndex:
+    """
+    Inverted index from fingerprint hashes to the documents containing them.
+
+    Documents are identified by arbitrary hashable keys, e.g. submission ids.
+    Scoring a new document costs one dictionary lookup per fingerprint
+    instead of a comparison with every indexed document.
+    """
+
+    def __init__(self):
+        self._postings = defaultdict(set)
+        self._sizes = {}
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def __contains__(self, key):
+        return key in self._sizes
+
+    def add(self, key, fingerprints):
+        """Add a document's fingerprints to the index, replacing old ones."""
+        if key in self._sizes:
+            self.remove(key)
+        fingerprints = frozenset(fingerprints)
+        for fingerprint in fingerprints:
+            self._postings[fingerprint].add(key)
+        self._sizes[key] = len(fingerprints)
+
+    def remove(self, key):
+        """Remove a document from the index."""
+        if key not in self._sizes:
+            return
+        del self._sizes[key]
+        for fingerprint in [f for f, keys in self._postings.items() if key in keys]:
+            keys = self._postings[fingerprint]
+            keys.discard(key)
+            if not keys:
+                del self._postings[fingerprint]
+
+    def size(self, key):
+        """Return the number of fingerprints stored for a document."""
+        return self._sizes.get(key, 0)
+
+    def shared_counts(self, fingerprints, exclude=None):
+        """
+        Count the fingerprints each indexed document shares with a query.
+
+        Args:
+            fingerprints: Fingerprint hashes of the query document
+            exclude: Optional key to leave out of the result
+
+        Returns:
+            dict: Document key -> number of shared fingerprints
+        """
+        counts = defaultdict(int)
+        for fingerprint in set(fingerprints):
+            for key in self._postings.get(fingerprint, ()):
+                counts[key] += 1
+        if exclude is not None:
+            counts.pop(exclude, None)
+        return dict(counts)
+
+    def query(self, fingerprints, exclude=None):
+        """
+        Score a document against every indexed document it overlaps with.
+
+        Args:
+            fingerprints: Fingerprint hashes of the query document
+            exclude: Optional key to leave out of the result
+
+        Returns:
+            list: (key, similarity) tuples sorted by descending similarity
+        """
+        fingerprints = frozenset(fingerprints)
+        matches = [
+            (key, jaccard_similarity(shared, len(fingerprints), self._sizes[key]))
+            for key, shared in self.shared_counts(fingerprints, exclude).items()
+        ]
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches